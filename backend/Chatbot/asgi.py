@@ -9,14 +9,19 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-import chatapp.routing  
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "Chatbot.settings")
 
+# Set up Django before importing the consumers, so standalone Daphne workers
+# (python manage.py runworkers) can load this module
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.auth import AuthMiddlewareStack
+import chatapp.routing
+
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
         URLRouter(
             chatapp.routing.websocket_urlpatterns
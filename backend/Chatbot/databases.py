@@ -0,0 +1,80 @@
+"""
+Database profiles for Chatbot.
+
+DB_ENGINE picks the profile used in settings.DATABASES:
+
+    sqlite    (default) single file database (SQLITE_PATH, db.sqlite3 by default),
+              tuned for concurrent consumers unless SQLITE_TUNED=false. WAL is
+              only switched on with SQLITE_WAL=true, since it is a lasting change
+              to the file and db.sqlite3 is checked in
+    postgres  PostgreSQL through psycopg, with persistent connections or a
+              psycopg_pool connection pool (DB_POOL=true)
+
+Run `python manage.py bench_db` to compare the profiles under concurrent writers.
+"""
+
+import os
+
+# Writers wait on the lock instead of failing with "database is locked"
+SQLITE_PRAGMAS = (
+    'PRAGMA busy_timeout=20000;'
+    'PRAGMA temp_store=MEMORY;'
+    'PRAGMA mmap_size=134217728;'
+)
+
+# WAL lets readers run alongside the single writer, NORMAL sync is safe with WAL
+SQLITE_WAL_PRAGMAS = (
+    'PRAGMA journal_mode=WAL;'
+    'PRAGMA synchronous=NORMAL;'
+)
+
+
+def sqlite(name, tuned=True, wal=True):
+    database = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+    }
+    if tuned:
+        database['OPTIONS'] = {
+            'init_command': (SQLITE_WAL_PRAGMAS if wal else '') + SQLITE_PRAGMAS,
+            'timeout': 20,
+            # Take the write lock at BEGIN so two writers never deadlock upgrading a read lock
+            'transaction_mode': 'IMMEDIATE',
+        }
+    return database
+
+
+def postgres(pool=None):
+    if pool is None:
+        pool = os.environ.get('DB_POOL', 'false').lower() == 'true'
+    database = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('POSTGRES_DB', 'chatbot'),
+        'USER': os.environ.get('POSTGRES_USER', 'chatbot'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
+    }
+    if pool:
+        # Django's pool and persistent connections are mutually exclusive
+        database['CONN_MAX_AGE'] = 0
+        database['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', '20')),
+            'timeout': float(os.environ.get('DB_POOL_TIMEOUT', '10')),
+        }
+    else:
+        database['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', '600'))
+    return database
+
+
+def from_env(base_dir):
+    if os.environ.get('DB_ENGINE', 'sqlite') == 'postgres':
+        return postgres()
+    return sqlite(
+        os.environ.get('SQLITE_PATH') or base_dir / 'db.sqlite3',
+        tuned=os.environ.get('SQLITE_TUNED', 'true').lower() == 'true',
+        wal=os.environ.get('SQLITE_WAL', 'false').lower() == 'true',
+    )
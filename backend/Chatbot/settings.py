@@ -10,11 +10,17 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
+from dotenv import load_dotenv
+from . import databases
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Read the backend .env once per process instead of on every connection
+load_dotenv(BASE_DIR / '.env')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -44,6 +50,24 @@ INSTALLED_APPS = [
 
 ASGI_APPLICATION = 'Chatbot.asgi.application'
 
+# Channel layer for server initiated pushes to a session's socket. With several
+# workers (python manage.py runworkers) it has to be Redis (pip install channels-redis)
+# so a push reaches whichever worker holds the socket; the in-memory layer only
+# works inside one process and is meant for development and tests.
+if os.environ.get('REDIS_URL'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [os.environ['REDIS_URL']]},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -76,14 +100,58 @@ WSGI_APPLICATION = 'Chatbot.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+# DB_ENGINE=sqlite (default, tuned, WAL with SQLITE_WAL=true) or DB_ENGINE=postgres, see Chatbot/databases.py
 
 DATABASES = {
+    'default': databases.from_env(BASE_DIR),
+}
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# llm_responses memoizes validated LLM replies, RESPONSE_CACHE_BACKEND picks
+# memory (per process LRU) or file (shared by every worker on the machine,
+# culls a random third of the entries when MAX_ENTRIES is reached)
+
+RESPONSE_CACHE_BACKENDS = {
+    'memory': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+}
+
+RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'llm_responses': {
+        'BACKEND': RESPONSE_CACHE_BACKENDS.get(RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_BACKENDS['memory']),
+        'LOCATION': str(BASE_DIR / '.cache' / 'llm_responses') if RESPONSE_CACHE_BACKEND == 'file' else 'llm_responses',
+        'TIMEOUT': int(os.environ.get('RESPONSE_CACHE_TTL', str(60 * 60 * 24))),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '10000')),
+        },
+    },
+    # Conversation state snapshots for resuming sessions. Use Redis (REDIS_URL,
+    # needs the redis package) when several workers serve the same sessions.
+    'conversations': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache' if os.environ.get('REDIS_URL')
+                   else 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': os.environ.get('REDIS_URL', 'conversations'),
+        'TIMEOUT': int(os.environ.get('CONVERSATION_STATE_TTL', str(60 * 60 * 24))),
+        'KEY_PREFIX': 'conversation',
+        'OPTIONS': {} if os.environ.get('REDIS_URL') else {
+            'MAX_ENTRIES': int(os.environ.get('CONVERSATION_CACHE_MAX_ENTRIES', '10000')),
+        },
+    },
 }
 
+# Cache alias used for LLM replies, empty to turn memoization off
+RESPONSE_CACHE = '' if RESPONSE_CACHE_BACKEND == 'off' else 'llm_responses'
+
+# Seconds a connection may hold unsaved transcript rows before they are written
+DB_FLUSH_INTERVAL = float(os.environ.get('DB_FLUSH_INTERVAL', '2'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -125,3 +193,126 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# OpenAI / LLM backend
+# OPENAI_BASE_URL can point at a local stub server (see chatapp/fakellm.py)
+
+OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
+
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL') or None
+
+LLM_MODEL = os.environ.get('LLM_MODEL', 'gpt-4o')
+
+# With LLM_ROUTING=true a cheaper model is tried first on simple steps and the
+# large model only sees the answers it could not settle. Off by default: an
+# invalid answer then costs two calls, one per model, and takes about twice as long.
+LLM_SMALL_MODEL = os.environ.get('LLM_SMALL_MODEL', 'gpt-4o-mini')
+
+LLM_ROUTING = os.environ.get('LLM_ROUTING', 'false').lower() == 'true'
+
+# Seconds before a single completion request is abandoned
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', '30'))
+
+# Clients that send {"stream": true} get {"delta": ...} frames while the reply is generated
+LLM_STREAMING = os.environ.get('LLM_STREAMING', 'true').lower() == 'true'
+
+# Send the step name as prompt_cache_key so the static system prompts stay in the provider cache.
+# OpenAI only caches prompts of 1024+ tokens, the step prompts are 100-400 so
+# today cached_tokens stays 0, this matters once a prompt grows past that.
+LLM_PROMPT_CACHE_KEY = os.environ.get('LLM_PROMPT_CACHE_KEY', 'true').lower() == 'true'
+
+# Retries of rate limited (429), failed (5xx), dropped or timed out completions,
+# with exponential backoff and full jitter between LLM_BACKOFF_BASE and LLM_BACKOFF_MAX seconds
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', '2'))
+
+LLM_BACKOFF_BASE = float(os.environ.get('LLM_BACKOFF_BASE', '0.5'))
+
+LLM_BACKOFF_MAX = float(os.environ.get('LLM_BACKOFF_MAX', '8'))
+
+# Total seconds one completion may take, retries included
+LLM_DEADLINE = float(os.environ.get('LLM_DEADLINE', '40'))
+
+# After this many failures in a row a model's circuit opens, and calls to it fail
+# fast with a "please retry" reply for LLM_BREAKER_COOLDOWN seconds
+LLM_BREAKER_THRESHOLD = int(os.environ.get('LLM_BREAKER_THRESHOLD', '5'))
+
+LLM_BREAKER_COOLDOWN = float(os.environ.get('LLM_BREAKER_COOLDOWN', '30'))
+
+# Provider quota budgeted on our side, requests and tokens per minute (0 is unlimited).
+# Calls over budget queue by priority: progress (sessions nearer completion first) or fifo
+LLM_RPM = int(os.environ.get('LLM_RPM', '0'))
+
+LLM_TPM = int(os.environ.get('LLM_TPM', '0'))
+
+LLM_PRIORITY = os.environ.get('LLM_PRIORITY', 'progress')
+
+# Seconds of quota that may be used at once after a quiet period
+LLM_RATE_BURST = float(os.environ.get('LLM_RATE_BURST', '10'))
+
+# Worker processes sharing the quota, each gets an equal part (runworkers sets this)
+LLM_RATE_WORKERS = int(os.environ.get('LLM_RATE_WORKERS', '1'))
+
+# Reply tokens assumed per call until the real usage is known
+LLM_COMPLETION_TOKENS_ESTIMATE = int(os.environ.get('LLM_COMPLETION_TOKENS_ESTIMATE', '150'))
+
+# Seconds after which a second copy of a slow completion is sent, first answer wins.
+# Around the p95 latency is a good value, 0 turns hedging off
+LLM_HEDGE_DELAY = float(os.environ.get('LLM_HEDGE_DELAY', '0'))
+
+# Maximum completions in flight per worker process
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '200'))
+
+# Shared connection pool for all sockets in a worker
+LLM_MAX_CONNECTIONS = int(os.environ.get('LLM_MAX_CONNECTIONS', '200'))
+
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('LLM_MAX_KEEPALIVE_CONNECTIONS', '100'))
+
+LLM_KEEPALIVE_EXPIRY = float(os.environ.get('LLM_KEEPALIVE_EXPIRY', '60'))
+
+# Only used when the h2 package is installed
+LLM_HTTP2 = os.environ.get('LLM_HTTP2', 'true').lower() == 'true'
+
+# Answer clear-cut inputs (ZIP codes, yes/no, numbers, VINs...) without calling the LLM
+LOCAL_VALIDATORS = os.environ.get('LOCAL_VALIDATORS', 'true').lower() == 'true'
+
+# Structured output requested per step: json_schema (strict schema per step),
+# json_object (any JSON) or off for providers that support neither
+LLM_RESPONSE_FORMAT = os.environ.get('LLM_RESPONSE_FORMAT', 'json_schema')
+
+# Extra completions allowed to repair a reply that is not readable JSON
+LLM_REPAIR_ATTEMPTS = int(os.environ.get('LLM_REPAIR_ATTEMPTS', '1'))
+
+# Pull every field out of messages that answer several questions at once with
+# one structured output call, then skip the steps already answered
+LLM_EXTRACTION = os.environ.get('LLM_EXTRACTION', 'false').lower() == 'true'
+
+# Recent timings per step and phase kept for the percentiles on /metrics
+METRICS_SAMPLES = int(os.environ.get('METRICS_SAMPLES', '1024'))
+
+# Inbound socket limits. Longer frames are refused, a socket may start
+# WS_TURNS_PER_MINUTE turns (0 is unlimited, WS_TURN_BURST at once) and
+# messages sent while a turn is running wait in a queue of WS_TURN_QUEUE,
+# anything beyond that is added to the last queued message
+WS_MAX_MESSAGE_LENGTH = int(os.environ.get('WS_MAX_MESSAGE_LENGTH', '2000'))
+
+WS_TURNS_PER_MINUTE = int(os.environ.get('WS_TURNS_PER_MINUTE', '60'))
+
+WS_TURN_BURST = int(os.environ.get('WS_TURN_BURST', '20'))
+
+WS_TURN_QUEUE = int(os.environ.get('WS_TURN_QUEUE', '1'))
+
+# Retention (python manage.py retention): transcripts of sessions completed more
+# than RETENTION_COMPLETED_DAYS ago, or started and abandoned more than
+# RETENTION_ABANDONED_DAYS ago, are archived to ARCHIVE_DIR and removed from
+# the database. 0 keeps them forever. The session rows and vehicles stay.
+RETENTION_COMPLETED_DAYS = int(os.environ.get('RETENTION_COMPLETED_DAYS', '90'))
+
+RETENTION_ABANDONED_DAYS = int(os.environ.get('RETENTION_ABANDONED_DAYS', '30'))
+
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', '500'))
+
+ARCHIVE_DIR = Path(os.environ.get('ARCHIVE_DIR') or BASE_DIR / 'archive')
+
+# gzip, or zstd with the optional zstandard package
+ARCHIVE_COMPRESSION = os.environ.get('ARCHIVE_COMPRESSION', 'gzip')
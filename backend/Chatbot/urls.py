@@ -16,7 +16,12 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path
+from chatapp.views import export_view, funnel_view, metrics_view, search_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
+    path('search', search_view, name='search'),
+    path('funnel', funnel_view, name='funnel'),
+    path('export', export_view, name='export'),
 ]
@@ -1,27 +1,136 @@
+import uuid
 from django.contrib import admin
-from .models import ChatSession, ChatMessage, Vehicle
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connection
+from django.db.models.functions import Lower
+from django.urls import reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html, format_html_join
+from .models import ChatSession, ChatMessage, Vehicle, LLMUsage
+from . import search
+
+# The changelists are built for tables with millions of rows: related rows are
+# joined instead of fetched per row, unfiltered lists use the planner's row
+# estimate instead of COUNT(*), and searches only use indexed lookups (message text through the full-text index in search.py).
+
+# Unfiltered tables smaller than this are still counted exactly
+EXACT_COUNT_BELOW = 10000
+
+# Messages shown on the session page, the rest are on the message changelist
+TRANSCRIPT_MESSAGES = 50
+
+
+# Row count from the database statistics, None when there are none yet
+# (SQLite needs an ANALYZE, PostgreSQL fills them in with autovacuum)
+def estimated_rows(model):
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+            elif connection.vendor == "sqlite":
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+            else:
+                return None
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if row is None:
+        return None
+    rows = int(str(row[0]).split()[0])
+    return rows if rows >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, "query", None)
+        if query is not None and not query.where:
+            estimate = estimated_rows(self.object_list.model)
+            if estimate is not None and estimate >= EXACT_COUNT_BELOW:
+                return estimate
+        return super().count
 
-# Register your models here.
-class ChatMessageInline(admin.TabularInline):
-    model = ChatMessage
-    readonly_fields = ['timestamp', 'role', 'content']
-    extra = 0
 
+# Shared by the big changelists, no second COUNT(*) for the "n total" link either
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+# Session id, email, ZIP code or the start of a name, each one hits an index
+def search_sessions(queryset, term, prefix=""):
+    try:
+        return queryset.filter(**{f"{prefix}pk": uuid.UUID(term)})
+    except ValueError:
+        pass
+    if "@" in term:
+        return queryset.alias(email_lower=Lower(f"{prefix}email")).filter(email_lower=term.lower())
+    if term.isdigit() and len(term) == 5:
+        return queryset.filter(**{f"{prefix}zip_code": term})
+    # A range on lower(full_name) instead of LIKE so the expression index is used
+    name = term.lower()
+    return queryset.alias(name_lower=Lower(f"{prefix}full_name")).filter(name_lower__gte=name, name_lower__lt=name + "\uffff")
+
+
+# Register your models here.
 class VehicleInline(admin.TabularInline):
     model = Vehicle
     readonly_fields = ['vin', 'use_type', 'blind_spot', 'commute_days', 'commute_miles', 'annual_mileage']
     extra = 0
 
 @admin.register(ChatSession)
-class ChatSessionAdmin(admin.ModelAdmin):
+class ChatSessionAdmin(LargeTableAdmin):
     list_display = ['id', 'full_name', 'email', 'current_step', 'is_complete', 'started_at']
     list_filter = ['is_complete', 'current_step', 'started_at']
     search_fields = ['full_name', 'email', 'zip_code']
-    readonly_fields = ['id', 'started_at', 'completed_at']
-    inlines = [ChatMessageInline, VehicleInline]
+    search_help_text = "Session id, email, ZIP code or the start of a name"
+    readonly_fields = ['id', 'started_at', 'completed_at', 'transcript']
+    raw_id_fields = ['user']
+    inlines = [VehicleInline]
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        return (search_sessions(queryset, term) if term else queryset), False
+
+    # Only the end of the conversation, a long session does not render every message
+    @admin.display(description="Transcript")
+    def transcript(self, obj):
+        if obj.pk is None:
+            return "-"
+        messages = list(obj.messages.order_by('-timestamp')[:TRANSCRIPT_MESSAGES])[::-1]
+        rows = format_html_join(
+            "", "<tr><td>{}</td><td>{}</td><td>{}</td></tr>",
+            ((message.timestamp, message.role, message.content) for message in messages),
+        )
+        url = reverse("admin:chatapp_chatmessage_changelist") + f"?session__id__exact={obj.pk}"
+        return format_html('<table>{}</table><p><a href="{}">All {} messages</a></p>', rows, url, obj.messages.count())
 
 @admin.register(ChatMessage)
-class ChatMessageAdmin(admin.ModelAdmin):
+class ChatMessageAdmin(LargeTableAdmin):
     list_display = ['session', 'role', 'content', 'timestamp']
     list_filter = ['role', 'timestamp']
-    search_fields = ['content']
\ No newline at end of file
+    list_select_related = ['session']
+    raw_id_fields = ['session']
+    ordering = ['-timestamp']
+    search_fields = ['content']
+    search_help_text = "Session id or email, anything else is a full-text search of the messages"
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if "@" in term:
+            return search_sessions(queryset, term, prefix="session__"), False
+        try:
+            return queryset.filter(session_id=uuid.UUID(term)), False
+        except ValueError:
+            return search.filter_messages(queryset, term), False
+
+@admin.register(LLMUsage)
+class LLMUsageAdmin(LargeTableAdmin):
+    list_display = ['session', 'step', 'model', 'prompt_tokens', 'cached_tokens', 'completion_tokens', 'created_at']
+    list_filter = ['step', 'model', 'created_at']
+    list_select_related = ['session']
+    raw_id_fields = ['session']
+    ordering = ['-created_at']
@@ -1,523 +1,445 @@
+import asyncio
+import copy
 import json
-from openai import OpenAI
+import logging
+from collections import deque
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from .models import ChatSession, ChatMessage, Vehicle
+from channels.layers import get_channel_layer
+from .models import ChatSession
+from .llm import LLMClient
+from .resilience import FALLBACK_MESSAGE, LLMUnavailable
+from .streaming import MessageStreamParser
+from .writes import WriteBuffer
+from .validators import to_number
+from . import conversations, extraction, metrics, parsing, ratelimit, steps, response_cache
+from .steps import STEPS, COMPLETE
+from django.conf import settings
+from django.utils import timezone
 from datetime import datetime
-import os
-from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+BUSY_MESSAGE = "Still working on your last message, I'll get to this one next."
+DROPPED_MESSAGE = "Still working on your last messages, please wait for my reply before sending more."
+TOO_FAST_MESSAGE = "You're sending messages too quickly, please wait a moment and try again."
+
+
+def group_name(session_id):
+    return f"session_{session_id}"
+
+
+# Send a message to the socket of a session from anywhere (views, commands, other
+# workers). The channel layer routes it to the worker holding the connection.
+async def push_to_session(session_id, message):
+    await get_channel_layer().group_send(group_name(session_id), {"type": "chat.push", "message": message})
+
 
 # This manages communication with the client and openai until the connection is closed and all info is obtained
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        self.session = await self.create_chat_session()
-
-        self.state = {
-            "step": "zip",
-            "zip": None,
-            "name": None,
-            "email": None,
-            "vehicles": [],
-            "license_type": None,
-            "license_status": None,
-            "current_vehicle": {}
-            }
+        # Reconnecting clients pass ?session=<id> to pick up where they left off
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        session_id = conversations.parse_session_id(query.get("session", [""])[0])
+        self.session = None
+        if session_id:
+            with metrics.timed("connect", "db"):
+                self.session = await self.get_chat_session(session_id)
+
+        started = self.session is None
+        if self.session is not None:
+            self.state = await conversations.load_state(self.session) or conversations.new_state()
+        else:
+            with metrics.timed("connect", "db"):
+                self.session = await self.create_chat_session()
+            self.state = conversations.new_state()
         
         self.chat = []
-        load_dotenv()
-        self.client = OpenAI(api_key = os.environ["OPENAI_API_KEY"])
+        self.llm = LLMClient(session=self.session.id)
+        # Cheaper tier tried first on the steps that allow it, see route_llm
+        self.small_llm = LLMClient(model=settings.LLM_SMALL_MODEL, session=self.session.id) if settings.LLM_SMALL_MODEL else None
+        self.writes = WriteBuffer(self.session)
+        if started:
+            self.record_transition("", self.state["step"])
+        elif "step_started" not in self.state:
+            # Snapshot from before funnel events, time the step from now on
+            self.state["step_started"] = timezone.now().timestamp()
+        # One turn runs at a time, messages sent meanwhile wait in `pending`, see receive
+        self.turn = None
+        self.pending = deque()
+        rate = settings.WS_TURNS_PER_MINUTE / 60
+        self.turn_budget = ratelimit.TokenBucket(rate, max(1, settings.WS_TURN_BURST))
+        if self.channel_layer is not None:
+            await self.channel_layer.group_add(group_name(self.session.id), self.channel_name)
         await self.accept()
-        await self.send(text_data=json.dumps({"message": "Connection Established"}))
+        metrics.gauges["active_sockets"] += 1
+        welcome = {
+            "message": "Connection Established",
+            "session": str(self.session.id),
+            "step": self.state["step"],
+        }
+        # A resumed session asks again where it left off instead of the client's opening question
+        if not started:
+            welcome["question"] = steps.QUESTIONS.get(self.state["step"])
+        await self.send(text_data=json.dumps(welcome))
 
     @database_sync_to_async
     def create_chat_session(self):
         return ChatSession.objects.create()
 
+    # Only unfinished sessions can be resumed
     @database_sync_to_async
+    def get_chat_session(self, session_id):
+        return ChatSession.objects.filter(id=session_id, is_complete=False).first()
+
+    # Queue a transcript row, written with the next flush of the write buffer
     def save_message(self, role, content):
-        return ChatMessage.objects.create(
-            session=self.session,
-            role=role,
-            content=content
-        )
+        self.writes.add_message(role, content)
 
     # Update Session Db with collected data
-    @database_sync_to_async
-    def update_session_data(self):
-        self.session.current_step = self.state["step"]
-        self.session.zip_code = self.state.get("zip")
-        self.session.full_name = self.state.get("name")
-        self.session.email = self.state.get("email")
-        self.session.license_type = self.state.get("license_type")
-        self.session.license_status = self.state.get("license_status")
-        
-        # Check if we are complete based on the conditions
-        if self.state["step"] == "license_type" and self.state.get("license_type") == "foreign":
-            self.session.is_complete = True
-            self.session.completed_at = datetime.now()
-        elif self.state["step"] == "license_status" and self.state.get("license_status"):
-            self.session.is_complete = True
-            self.session.completed_at = datetime.now()
-            
-        self.session.save()
+    async def update_session_data(self, complete=False):
+        conversations.bump(self.state)
+        fields = {
+            "current_step": self.state["step"],
+            "zip_code": self.state.get("zip"),
+            "full_name": self.state.get("name"),
+            "email": self.state.get("email"),
+            "license_type": self.state.get("license_type"),
+            "license_status": self.state.get("license_status"),
+            "state": copy.deepcopy(self.state),
+        }
+
+        # Complete whenever the flow reached the end, extraction and skipped steps can get there from any step
+        if complete:
+            fields.update(is_complete=True, completed_at=timezone.now())
+
+        self.writes.update_session(**fields)
+
+        # Keep the fast snapshot current every turn, the row copy is written with the next flush
+        if fields.get("is_complete"):
+            await conversations.forget(self.session.id)
+        else:
+            await conversations.save_state(self.session.id, self.state)
+
+    # Record the token usage of one LLM call for this step
+    def save_usage(self, step, usage, model=None):
+        self.writes.add_usage(step, model or self.llm.model, usage)
+
+    # Funnel event for leaving `step` (or starting the session when it is ""),
+    # the counters for the step just entered start again, see funnel.py
+    def record_transition(self, step, next_step):
+        now = timezone.now()
+        started = self.state.get("step_started")
+        entered = datetime.fromtimestamp(started, tz=now.tzinfo) if started else now
+        self.writes.add_event(
+            step=step, next_step=next_step, entered_at=entered, created_at=now,
+            dwell_seconds=max((now - entered).total_seconds(), 0.0) if step else 0.0,
+            turns=self.state.get("step_turns", 0), llm_retries=self.state.get("step_retries", 0),
+        )
+        self.state.update(step_started=now.timestamp(), step_turns=0, step_retries=0)
+
+    # LLM retries of the turn, counted against the current step
+    def count_retries(self):
+        for llm in (self.llm, self.small_llm):
+            if llm is not None and llm.retries:
+                self.state["step_retries"] = self.state.get("step_retries", 0) + llm.retries
+                llm.retries = 0
 
     # Save vehicle to Database
-    @database_sync_to_async
     def save_vehicle(self, vehicle_data):
-        print(vehicle_data)
-        return Vehicle.objects.create(
-            session=self.session,
+        self.writes.add_vehicle(
             vin=vehicle_data["vin"],
             use_type=vehicle_data["use"],
             blind_spot=vehicle_data["blind_spot"],
-            commute_days=vehicle_data.get("commute_days"), 
-            commute_miles=vehicle_data.get("commute_miles"), 
-            annual_mileage=vehicle_data.get("annual_mileage")
+            commute_days=to_number(vehicle_data.get("commute_days")),
+            commute_miles=to_number(vehicle_data.get("commute_miles")),
+            annual_mileage=to_number(vehicle_data.get("annual_mileage"))
         )
     
     async def disconnect(self, close_code):
-        print("Disconnected")
-
+        # Nothing to flush if the connection failed before connect() finished
+        if hasattr(self, "writes"):
+            metrics.gauges["active_sockets"] -= 1
+            # Let the running turn finish so its answer is written, queued ones are dropped
+            self.pending.clear()
+            if self.turn is not None:
+                await asyncio.gather(self.turn, return_exceptions=True)
+            with metrics.timed(self.state["step"], "db"):
+                await self.writes.flush()
+            if self.channel_layer is not None:
+                await self.channel_layer.group_discard(group_name(self.session.id), self.channel_name)
+            ratelimit.forget(self.session.id)
+
+    # Handler for push_to_session
+    async def chat_push(self, event):
+        await self.send(text_data=json.dumps({"message": event["message"]}))
+
+    # Frames are checked here and the turn itself runs in a task, so a client
+    # sending faster than the LLM answers gets a busy frame instead of an
+    # ever growing backlog. Only one turn per socket touches self.state at a time.
     async def receive(self, text_data):
-        data = json.loads(text_data)
-        user_input = data["message"]
-        await self.save_message("user", user_input)
-
-
-        self.chat.append({"role": "user", "content": user_input})
-
-        response = self.client.chat.completions.create(
-            model="gpt-4o",
-            messages=self.make_msg(user_input)
-        )
-
-        text = response.choices[0].message.content.strip()
-
-        parsed = json.loads(text)
-        if parsed["valid"] and "zip" in parsed:
-            self.state["zip"] = parsed["zip"]
-            self.state["step"] = "name"
-
-        elif parsed["valid"] and "name" in parsed:
-            self.state["name"] = parsed["name"]
-            self.state["step"] = "email"
-        
-        elif parsed["valid"] and "email" in parsed:
-            self.state["email"] = parsed["email"]
-            self.state["step"] = "add_vehicle"
-        
-        elif self.state["step"] == "add_vehicle" and parsed["valid"]:
-            if "add_vehicle" in parsed and parsed["add_vehicle"]:
-                self.state["step"] = "vehicle_vin"
-            elif "no_vehicle" in parsed and parsed["no_vehicle"]:
-                self.state["step"] = "license_type"
+        if len(text_data) > settings.WS_MAX_MESSAGE_LENGTH:
+            metrics.counters["ws_rejected"] += 1
+            await self.send_error("too_long", f"Please keep messages under {settings.WS_MAX_MESSAGE_LENGTH} characters.")
+            return
+        with metrics.timed(self.state["step"], "decode"):
+            try:
+                data = json.loads(text_data)
+            except ValueError:
+                data = None
+        if not isinstance(data, dict) or not isinstance(data.get("message"), str) or not data["message"].strip():
+            metrics.counters["ws_rejected"] += 1
+            await self.send_error("bad_request", "Messages need a non-empty \"message\" text.")
+            return
 
-        elif self.state["step"] == "vehicle_vin" and parsed["valid"] and "vin" in parsed:
-            self.state["current_vehicle"]["vin"] = parsed["vin"]
-            self.state["step"] = "vehicle_use"
+        if self.turn_budget.wait_time(1) > 0:
+            metrics.counters["ws_rate_limited"] += 1
+            await self.send_busy(TOO_FAST_MESSAGE, queued=False)
+            return
+        self.turn_budget.take(1)
 
-        elif self.state["step"] == "vehicle_use" and parsed["valid"] and "use" in parsed:
-            self.state["current_vehicle"]["use"] = parsed["use"]
-            self.state["step"] = "blind_spot"
+        if self.turn is None or self.turn.done():
+            self.turn = asyncio.ensure_future(self.run_turns(data))
+            return
 
-        elif self.state["step"] == "blind_spot" and parsed["valid"] and "blind_spot" in parsed:
-            self.state["current_vehicle"]["blind_spot"] = parsed["blind_spot"]
+        if len(self.pending) < settings.WS_TURN_QUEUE:
+            self.pending.append(data)
+            metrics.counters["ws_queued"] += 1
+            await self.send_busy(BUSY_MESSAGE, queued=True)
+        elif self.pending and len(self.pending[-1]["message"]) + len(data["message"]) < settings.WS_MAX_MESSAGE_LENGTH:
+            # Queue full, the message is answered together with the last queued one
+            self.pending[-1] = {**self.pending[-1], "message": self.pending[-1]["message"] + "\n" + data["message"]}
+            metrics.counters["ws_coalesced"] += 1
+            await self.send_busy(BUSY_MESSAGE, queued=True)
+        else:
+            metrics.counters["ws_dropped"] += 1
+            await self.send_busy(DROPPED_MESSAGE, queued=False)
+
+    async def send_error(self, error, message):
+        await self.send(text_data=json.dumps({"error": error, "message": message}))
+
+    # Not a reply, the client shows it without treating it as the next question
+    async def send_busy(self, message, queued):
+        await self.send(text_data=json.dumps({"busy": True, "queued": queued, "message": message}))
+
+    async def run_turns(self, data):
+        try:
+            while data is not None:
+                await self.handle_turn(data)
+                data = self.pending.popleft() if self.pending else None
+        except Exception:
+            logger.exception("Chat turn failed for session %s", self.session.id)
+            self.pending.clear()
+            await self.close(code=1011)
+
+    # Each phase of a turn is timed per step, see metrics.py and /metrics
+    async def handle_turn(self, data):
+        step = STEPS[self.state["step"]]
+        user_input = data["message"]
+        self.state["step_turns"] = self.state.get("step_turns", 0) + 1
+        self.save_message("user", user_input)
 
-            if self.state["current_vehicle"]["use"] == "commuting":
-                self.state["step"] = "commute_days"
+        self.chat.append({"role": "user", "content": user_input})
+        self.set_priority()
 
-            else:  
-                self.state["step"] = "annual_mileage"
+        # Clear-cut answers are settled locally, then repeated answers come from the
+        # response cache, everything else goes to the LLM
+        with metrics.timed(step.name, "validate"):
+            parsed = step.validate(self.state, user_input) if settings.LOCAL_VALIDATORS else None
 
-        elif self.state["step"] == "commute_days" and parsed["valid"] and "days" in parsed:
-            self.state["current_vehicle"]["commute_days"] = parsed["days"]
-            self.state["step"] = "commute_miles"
+        # Several answers in one message are extracted with a single call
+        if parsed is None and settings.LLM_EXTRACTION and extraction.looks_multi(user_input):
+            await self.extract_fields(step, user_input)
+            return
 
-        elif self.state["step"] == "commute_miles" and parsed["valid"] and "miles" in parsed:
-            self.state["current_vehicle"]["commute_miles"] = parsed["miles"]
-            
+        if parsed is None:
+            messages = self.make_msg(user_input)
+            prompt = messages[0]["content"]
+            if response_cache.enabled():
+                with metrics.timed(step.name, "cache"):
+                    parsed = await response_cache.get(step.name, prompt, user_input)
+
+        if parsed is None:
+            try:
+                with metrics.timed(step.name, "llm"):
+                    parsed, text = await self.route_llm(step, messages, stream=data.get("stream") and settings.LLM_STREAMING)
+            except LLMUnavailable:
+                # The provider is failing, keep the socket and the state and ask for a resend
+                metrics.counters["llm_fallbacks"] += 1
+                await self.finish_turn(step, None, FALLBACK_MESSAGE)
+                return
+            if parsed is None:
+                # Still unreadable after the repairs, ask the question again rather than fail the turn
+                parsed = {"message": f"Sorry, I didn't catch that. {steps.QUESTIONS[step.name]}", "valid": False}
+                text = json.dumps(parsed)
+            elif response_cache.enabled():
+                await response_cache.set(step.name, prompt, user_input, parsed)
+        else:
+            text = json.dumps(parsed)
+
+        with metrics.timed(step.name, "transition"):
+            next_step = step.advance(self.state, parsed)
+
+        if next_step and step.completes_vehicle:
             # Vehicle complete so save it
-            await self.save_vehicle(self.state["current_vehicle"])
+            self.save_vehicle(self.state["current_vehicle"])
 
             self.state["vehicles"].append(self.state["current_vehicle"].copy())
             self.state["current_vehicle"] = {}
-            self.state["step"] = "add_another_vehicle"
 
-        elif self.state["step"] == "annual_mileage" and parsed["valid"] and "mileage" in parsed:
-            self.state["current_vehicle"]["annual_mileage"] = parsed["mileage"]
-            
-            # Vehicle complete so save it
-            await self.save_vehicle(self.state["current_vehicle"])
+        message = parsed["message"]
+        if next_step and settings.LLM_EXTRACTION:
+            # Answers extracted earlier can make the next questions unnecessary
+            skipped_to = extraction.skip_answered(self.state, next_step)
+            if skipped_to != next_step:
+                next_step, message = skipped_to, steps.QUESTIONS.get(skipped_to)
 
-            self.state["vehicles"].append(self.state["current_vehicle"].copy())
-            self.state["current_vehicle"] = {}
-            self.state["step"] = "add_another_vehicle"
-
-        elif self.state["step"] == "add_another_vehicle" and parsed["valid"]:
-            if "add_vehicle" in parsed and parsed["add_vehicle"]:
-                self.state["step"] = "vehicle_vin" 
-            elif "no_vehicle" in parsed and parsed["no_vehicle"]:
-                self.state["step"] = "license_type"  
-
-        elif self.state["step"] == "license_type" and parsed["valid"] and "license_type" in parsed:
-            self.state["license_type"] = parsed["license_type"]
-            
-            # If license is personal or commercial then ask for status
-            if parsed["license_type"] in ["personal", "commercial"]:
-                self.state["step"] = "license_status"
-            else: 
-                summary = f"""Information collected:
-                    - ZIP: {self.state['zip']}
-                    - Name: {self.state['name']}
-                    - Email: {self.state['email']}
-                    - Vehicles: {len(self.state['vehicles'])}
-                    - License Type: {self.state['license_type']}
-                    - License Status: {self.state.get('license_status', 'N/A')}"""
-                await self.update_session_data()
-                await self.save_message("assistant", summary)
-                await self.send(text_data=json.dumps({"message": summary}))
-                return
-
-        elif self.state["step"] == "license_status" and parsed["valid"] and "license_status" in parsed:
-            self.state["license_status"] = parsed["license_status"]
-            summary = f"""Information collected:
-                - ZIP: {self.state['zip']}
-                - Name: {self.state['name']}
-                - Email: {self.state['email']}
-                - Vehicles: {len(self.state['vehicles'])}
-                - License Type: {self.state['license_type']}
-                - License Status: {self.state.get('license_status', 'N/A')}"""
-            await self.save_message("assistant", summary)
-            await self.send(text_data=json.dumps({"message": summary}))
+        self.chat.append({"role": "assistant", "content": text})
+        await self.finish_turn(step, next_step, message)
+
+    # Place of this socket's calls in the rate limiter queue
+    def set_priority(self):
+        priority = steps.progress(self.state) if settings.LLM_PRIORITY == "progress" else 0
+        for llm in (self.llm, self.small_llm):
+            if llm is not None:
+                llm.priority = priority
+
+    # Steps with tier "small" go to LLM_SMALL_MODEL first and only escalate to
+    # the large model when its reply is unreadable or not valid. The small tier
+    # is never streamed so an escalated turn does not show two drafts.
+    async def route_llm(self, step, messages, stream=False):
+        if settings.LLM_ROUTING and self.small_llm and step.tier == "small":
+            try:
+                parsed, text = await self.ask_llm(step, messages, llm=self.small_llm, tier="small")
+            except LLMUnavailable:
+                # A failing small model is just one more reason to ask the large one
+                parsed = None
+            if parsed is not None and parsed.get("valid"):
+                metrics.routes[step.name, "small"] += 1
+                return parsed, text
+            metrics.routes[step.name, "escalated"] += 1
+        else:
+            metrics.routes[step.name, "large"] += 1
+        return await self.ask_llm(step, messages, stream=stream)
+
+    # One completion for the step in its structured output format. A reply that
+    # cannot be read is sent back for repair up to LLM_REPAIR_ATTEMPTS times,
+    # returns (None, text) if it never becomes readable.
+    async def ask_llm(self, step, messages, stream=False, llm=None, tier="large"):
+        llm = llm or self.llm
+        response_format = step.response_format()
+        kwargs = {"response_format": response_format} if response_format else {}
+        with metrics.timed(step.name, f"llm_{tier}"):
+            if stream:
+                text, usage = await self.stream_completion(messages, **kwargs)
+            else:
+                text, usage = await llm.complete(messages, cache_key=step.name, **kwargs)
+        if usage:
+            self.save_usage(step.name, usage, llm.model)
+
+        for attempt in range(settings.LLM_REPAIR_ATTEMPTS + 1):
+            try:
+                with metrics.timed(step.name, "parse"):
+                    return parsing.extract_reply(text), text
+            except ValueError:
+                if attempt == settings.LLM_REPAIR_ATTEMPTS:
+                    break
+            metrics.counters["llm_repairs"] += 1
+            repair = messages + [{"role": "assistant", "content": text}, {"role": "user", "content": parsing.REPAIR_PROMPT}]
+            with metrics.timed(step.name, "repair"):
+                text, usage = await llm.complete(repair, cache_key=step.name, **kwargs)
+            if usage:
+                self.save_usage(step.name, usage, llm.model)
+
+        metrics.counters["llm_unreadable"] += 1
+        return None, text
+
+    # Fill every field found in a multi-answer message and jump to the first
+    # step still missing, see extraction.py
+    async def extract_fields(self, step, user_input):
+        try:
+            with metrics.timed(step.name, "extract"):
+                response_format = extraction.extraction_format()
+                kwargs = {"response_format": response_format} if response_format else {}
+                text, usage = await self.llm.complete(
+                    extraction.messages(self.state, user_input), cache_key="extract", **kwargs,
+                )
+        except LLMUnavailable:
+            metrics.counters["llm_fallbacks"] += 1
+            await self.finish_turn(step, None, FALLBACK_MESSAGE)
             return
-        
-        await self.update_session_data()
-
-        await self.save_message("assistant", parsed["message"])
-
+        if usage:
+            self.save_usage("extract", usage)
+        try:
+            with metrics.timed(step.name, "parse"):
+                found = parsing.extract_json(text)
+        except ValueError:
+            # Treated as nothing found, the user is asked the same question again
+            found = {}
+        metrics.counters["extractions"] += 1
+
+        completed = extraction.apply(self.state, found)
+        for vehicle in completed:
+            self.save_vehicle(vehicle)
+        next_step = extraction.skip_answered(self.state, step.name, found.get("more_vehicles"), len(completed))
+
+        # Nothing usable in the message, ask the same question again
+        if next_step == step.name:
+            next_step = None
+        message = steps.QUESTIONS.get(next_step or step.name)
+        if next_step and message:
+            message = f"Thanks! {message}"
         self.chat.append({"role": "assistant", "content": text})
+        await self.finish_turn(step, next_step, message)
+
+    # Store the outcome of a turn, answer the client and write the turn out
+    async def finish_turn(self, step, next_step, message):
+        self.count_retries()
+        if next_step:
+            self.record_transition(step.name, next_step)
+
+        if next_step == COMPLETE:
+            summary = steps.summary(self.state)
+            await self.update_session_data(complete=True)
+            self.save_message("assistant", summary)
+            with metrics.timed(step.name, "send"):
+                await self.send(text_data=json.dumps({"message": summary}))
+            with metrics.timed(step.name, "db"):
+                await self.writes.flush()
+            metrics.counters["sessions_completed"] += 1
+            return
 
-        await self.send(text_data=json.dumps({"message": parsed["message"]}))
+        if next_step:
+            self.state["step"] = next_step
 
+        await self.update_session_data()
 
-    # This method takes in the users input and looks at the current state we are in to prompt openai for an appropriate response.
+        self.save_message("assistant", message)
+
+        with metrics.timed(step.name, "send"):
+            await self.send(text_data=json.dumps({"message": message}))
+
+        # Write the turn out once a step is done, invalid answers wait for the timer
+        if next_step:
+            with metrics.timed(step.name, "db"):
+                await self.writes.flush()
+
+    # Forward the "message" text to the client as it is generated. The state fields
+    # are only applied once the whole JSON object has arrived, and the final
+    # {"message": ...} frame is still sent as usual at the end of the turn
+    async def stream_completion(self, messages, **kwargs):
+        parser = MessageStreamParser()
+        chunks = []
+        usage = {}
+        async for chunk in self.llm.stream(messages, cache_key=self.state["step"], usage=usage, **kwargs):
+            chunks.append(chunk)
+            delta = parser.feed(chunk)
+            if delta:
+                await self.send(text_data=json.dumps({"delta": delta}))
+        return "".join(chunks).strip(), usage
+
+    # This method takes in the users input and looks up the current step to prompt openai for an appropriate response.
+    # The prompts are built once in steps.py so nothing is formatted per turn.
     def make_msg(self, input):
-        if self.state["step"] == "zip":
-            return [
-                {
-                    "role": "system", 
-                    "content": """You are a ZIP code validator. You MUST validate strictly.
-
-        VALIDATION RULES:
-        1. MUST be EXACTLY 5 digits - no more, no less
-        2. MUST contain ONLY numbers (0-9)
-        3. "1234" is INVALID (only 4 digits)
-        4. "123456" is INVALID (6 digits)
-        5. "12a45" is INVALID (contains letter)
-
-        Count the digits carefully. If it's not exactly 5 digits, it's invalid.
-
-        Response format (JSON only):
-        {"message": "your message", "valid": true/false, "zip": "value only if valid"}
-
-        Examples:
-        - Input "1234" → {"message": "That's only 4 digits. Please enter a 5-digit ZIP code.", "valid": false}
-        - Input "12345" → {"message": "Perfect! What's your full name?", "valid": true, "zip": "12345"}
-        - Input "123456" → {"message": "That's 6 digits. ZIP codes need exactly 5 digits.", "valid": false}"""
-                },
-                {
-                    "role": "user", 
-                    "content": f"Validate this ZIP code: {input}"
-                }
-            ]
-        elif self.state["step"] == "name":
-            return [
-                {
-                    "role": "system",
-                    "content": """You collect and validate full names for onboarding.
-
-    VALIDATION RULES:
-    1. Must include both first and last name
-    2. Each name should be at least 2 characters
-    3. Only letters, spaces, hyphens, and apostrophes allowed inside the name
-    4. No numbers or special characters besides hyphen and apostrophe
-    5. Names Can't have vulgar language in them
-
-    Response format (JSON only):
-    {"message": "your message", "valid": true/false, "name": "full name only if valid"}
-
-    Examples:
-    - Input "John" → {"message": "I need both your first and last name. Could you provide your full name?", "valid": false}
-    - Input "John Smith" → {"message": "Thanks, John! Now I need your email address.", "valid": true, "name": "John Smith"}
-    - Input "Mary-Jane O'Brien" → {"message": "Nice to meet you, Mary-Jane! What's your email address?", "valid": true, "name": "Mary-Jane O'Brien"}
-    - Input "John123" → {"message": "Names shouldn't contain numbers. Please enter your full name using only letters.", "valid": false}"""
-                },
-                {
-                    "role": "user",
-                    "content": f"Validate this name: {input}"
-                }
-            ]
-        elif self.state["step"] == "email":
-            return [
-                {
-                    "role": "system",
-                    "content": """You collect and validate email addresses for onboarding.
-
-        VALIDATION RULES:
-        1. Must have @ symbol
-        2. Must have domain (e.g., .com, .org, .edu)
-        3. Must have text before and after @
-        4. No spaces allowed
-        5. Standard email format: username@domain.extension
-
-        Response format (JSON only):
-        {"message": "your message", "valid": true/false, "email": "email only if valid"}
-
-        Examples:
-        - Input "john@gmail.com" → {"message": "Great! Now let's add your vehicle information. Do you want to add a vehicle?", "valid": true, "email": "john@gmail.com"}
-        - Input "sarah.smith@company.org" → {"message": "Perfect! Ready to add vehicle details. Would you like to add a vehicle?", "valid": true, "email": "sarah.smith@company.org"}
-        - Input "notanemail" → {"message": "That doesn't look like a valid email. Please include an @ symbol and domain.", "valid": false}
-        - Input "john@" → {"message": "Your email seems incomplete. Please provide the full email address including the domain.", "valid": false}
-        - Input "john smith@gmail.com" → {"message": "Email addresses can't contain spaces. Please enter a valid email.", "valid": false}"""
-                },
-                {
-                    "role": "user",
-                    "content": f"Validate this email: {input}"
-                }
-            ]
-        elif self.state["step"] == "add_vehicle":
-            return [
-                {
-                    "role": "system",
-                    "content": """You ask if the user wants to add a vehicle and interpret their response.
-
-        TASK: Determine if the user wants to add a vehicle or skip to license information.
-
-        Interpret YES responses: "yes", "yeah", "sure", "ok", "y", "yep", "definitely", "I do", "let's do it", etc.
-        Interpret NO responses: "no", "nope", "n", "not now", "skip", "no thanks", "later", "I don't", etc.
-
-        Response format (JSON only):
-        If they want to add a vehicle: {"message": "your message asking for VIN or Year/Make/Model/Body Type", "valid": true, "add_vehicle": true}
-        If they don't want to add: {"message": "your message moving to license type question", "valid": true, "no_vehicle": true}
-        If unclear: {"message": "your message asking for clarification", "valid": false}
-
-        Examples:
-        - Input "yes" → {"message": "Great! Please provide your vehicle's VIN or the Year, Make, Model, and Body Type.", "valid": true, "add_vehicle": true}
-        - Input "no" → {"message": "No problem! Now I need to know your US License Type. Is it Foreign, Personal, or Commercial?", "valid": true, "no_vehicle": true}
-        - Input "sure thing" → {"message": "Perfect! I'll need either your vehicle's VIN number or the Year, Make, Model, and Body Type.", "valid": true, "add_vehicle": true}
-        - Input "maybe" → {"message": "I need a yes or no answer. Would you like to add a vehicle now?", "valid": false}"""
-                },
-                {
-                    "role": "user",
-                    "content": f"User response: {input}"
-                }
-            ]
-        elif self.state["step"] == "vehicle_vin":
-            return [
-                {
-                    "role": "system",
-                    "content": """You collect vehicle identification information.
-
-        Accept EITHER:
-        1. A VIN (Vehicle Identification Number) - 17 characters
-        2. Year, Make, Model, and Body Type (all four required)
-
-        Response format (JSON only):
-        {"message": "your message", "valid": true/false, "vin": "the VIN or year/make/model/body info"}
-
-        Examples:
-        - Input "1HGBH41JXMN109186" → {"message": "Got it! How is this vehicle primarily used? (commuting, commercial, farming, or business)", "valid": true, "vin": "1HGBH41JXMN109186"}
-        - Input "2022 Honda Civic Sedan" → {"message": "Perfect! How do you primarily use this 2022 Honda Civic? (commuting, commercial, farming, or business)", "valid": true, "vin": "2022 Honda Civic Sedan"}
-        - Input "Honda Civic" → {"message": "I need more details. Please provide either a VIN or the Year, Make, Model, and Body Type.", "valid": false}"""
-                },
-                {
-                    "role": "user",
-                    "content": f"Vehicle info: {input}"
-                }
-            ]
-
-        elif self.state["step"] == "vehicle_use":
-            return [
-                {
-                    "role": "system",
-                    "content": """You collect vehicle use type.
-
-        Valid uses: commuting, commercial, farming, business (accept variations)
-
-        Response format (JSON only):
-        {"message": "your message asking about blind spot warning", "valid": true/false, "use": "commuting/commercial/farming/business"}
-
-        IMPORTANT: After validating the use type, immediately ask "Does this vehicle have blind spot warning equipped? (yes or no)"
-
-        Examples:
-        - Input "commuting" → {"message": "Does this vehicle have blind spot warning equipped? (yes or no)", "valid": true, "use": "commuting"}
-        - Input "I use it for work" → {"message": "Is this for commuting to work or commercial/business use?", "valid": false}
-        - Input "commercial" → {"message": "Got it, commercial use. Is this vehicle equipped with blind spot warning? (yes or no)", "valid": true, "use": "commercial"}
-        - Input "farming" → {"message": "Got it, farming use. Does this vehicle have blind spot warning equipped? (yes or no)", "valid": true, "use": "farming"}
-        - Input "business" → {"message": "Understood, business use. Is this vehicle equipped with blind spot warning? (yes or no)", "valid": true, "use": "business"}"""
-                },
-                {
-                    "role": "user",
-                    "content": f"Vehicle use: {input}"
-                }
-            ]
-
-        elif self.state["step"] == "blind_spot":
-            # Get the vehicle use type we already collected
-            vehicle_use = self.state["current_vehicle"].get("use", "")
-            
-            if vehicle_use == "commuting":
-                next_question = "How many days per week do you use this vehicle for commuting?"
-            else:
-                next_question = "What's the annual mileage for this vehicle?"
-            
-            return [
-                {
-                    "role": "system",
-                    "content": f"""You ask about blind spot warning.
-
-        Accept: yes/no variations (y, n, yeah, nope, etc.)
-
-        Response format (JSON only):
-        {{"message": "your message", "valid": true/false, "blind_spot": "yes/no"}}
-
-        IMPORTANT: After validating the blind spot response, your message should ask: "{next_question}"
-
-        Examples:
-        - Input "yes" → {{"message": "Great to hear that your vehicle has blind spot warning. {next_question}", "valid": true, "blind_spot": "yes"}}
-        - Input "no" → {{"message": "Noted, no blind spot warning. {next_question}", "valid": true, "blind_spot": "no"}}"""
-                },
-                {
-                    "role": "user",
-                    "content": f"Blind spot response: {input}"
-                }
-            ]
-
-        elif self.state["step"] == "commute_days":
-            return [
-                {
-                    "role": "system",
-                    "content": """You collect days per week for commuting.
-
-        Valid: 1-7 days
-
-        Response format (JSON only):
-        {"message": "your message asking for one-way miles", "valid": true/false, "days": number}
-
-        Examples:
-        - Input "5" → {"message": "And how many miles is your one-way commute to work or school?", "valid": true, "days": 5}
-        - Input "every day" → {"message": "So that's 7 days a week. How many miles one-way to work/school?", "valid": true, "days": 7}"""
-                },
-                {
-                    "role": "user",
-                    "content": f"Days per week: {input}"
-                }
-            ]
-
-        elif self.state["step"] == "commute_miles":
-            return [
-                {
-                    "role": "system",
-                    "content": """You collect one-way commute miles.
-
-
-        Response format (JSON only):
-        {"message": "your message about adding another vehicle", "valid": true/false, "miles": number}
-
-        Examples:
-        - Input "15" → {"message": "Great! Would you like to add another vehicle?", "valid": true, "miles": 15}
-        - Input "10.5" → {"message": "Got it, 10.5 miles. Do you have another vehicle to add?", "valid": true, "miles": 10.5}"""
-                },
-                {
-                    "role": "user",
-                    "content": f"Miles: {input}"
-                }
-            ]
-
-        elif self.state["step"] == "annual_mileage":
-            return [
-                {
-                    "role": "system",
-                    "content": """You collect annual mileage for commercial/farming/business vehicles.
-
-
-        Response format (JSON only):
-        {"message": "your message about adding another vehicle", "valid": true/false, "mileage": number}
-
-        Examples:
-        - Input "12000" → {"message": "Noted! Would you like to add another vehicle?", "valid": true, "mileage": 12000}
-        - Input "15,000" → {"message": "Got it, 15,000 miles annually. Do you have another vehicle to add?", "valid": true, "mileage": 15000}"""
-                },
-                {
-                    "role": "user",
-                    "content": f"Annual mileage: {input}"
-                }
-            ]
-
-        elif self.state["step"] == "add_another_vehicle":
-            # Same as add_vehicle prompt but asking about another vehicle
-            return [
-                {
-                    "role": "system",
-                    "content": """Ask if they want to add another vehicle.
-
-        Same logic as before - interpret yes/no responses.
-
-        Response format (JSON only):
-        If yes: {"message": "your message asking for next vehicle's VIN", "valid": true, "add_vehicle": true}
-        If no: {"message": "your message about US license type which is either Foreign, Personal, or Commercial?", "valid": true, "no_vehicle": true}"""
-                },
-                {
-                    "role": "user",
-                    "content": f"Response: {input}"
-                }
-            ]
-                
-        elif self.state["step"] == "license_type":
-            return [
-                {
-                    "role": "system",
-                    "content": """You collect US License Type information.
-
-        Valid types: Foreign, Personal, Commercial (accept case variations)
-
-        Response format (JSON only):
-        {"message": "your message", "valid": true/false, "license_type": "foreign/personal/commercial"}
-
-        Examples:
-        - Input "personal" → {"message": "Thank you. Is your personal license currently valid or suspended?", "valid": true, "license_type": "personal"}
-        - Input "commercial" → {"message": "Got it, commercial license. Is it currently valid or suspended?", "valid": true, "license_type": "commercial"}
-        - Input "foreign" → {"message": "Thank you! I've collected all your information. Here's a summary of what you provided...", "valid": true, "license_type": "foreign"}
-        - Input "regular" → {"message": "Do you mean a personal license? Please specify: Foreign, Personal, or Commercial.", "valid": false}"""
-                },
-                {
-                    "role": "user",
-                    "content": f"License type: {input}"
-                }
-            ]
-
-        elif self.state["step"] == "license_status":
-            return [
-                {
-                    "role": "system",
-                    "content": """You collect license status (only for personal or commercial licenses).
-
-        Valid statuses: valid, suspended (accept variations like "active", "good standing" = valid)
-
-        Response format (JSON only):
-        {"message": "your message summarizing all collected information", "valid": true/false, "license_status": "valid/suspended"}
-
-        Examples:
-        - Input "expired" → {"message": "Is your license currently valid or suspended? Please specify one of these two options.", "valid": false}
-        - Input "I don't know" → {"message": "I need to know if your license is valid or suspended. Please check and let me know.", "valid": false}
-        - Input "revoked" → {"message": "I need to know if it's currently valid or suspended. If it's revoked, please indicate 'suspended'.", "valid": false}
-        - Input "valid" → {"message": "Perfect! I've collected all your information. Here's what I have: [provide summary]", "valid": true, "license_status": "valid"}
-        - Input "suspended" → {"message": "Noted. I've collected all your information. Here's a summary: [provide summary]", "valid": true, "license_status": "suspended"}
-        - Input "active" → {"message": "Great, your license is active. Here's everything I've collected: [provide summary]", "valid": true, "license_status": "valid"}"""
-                },
-                {
-                    "role": "user",
-                    "content": f"License status: {input}"
-                }
-            ]
-
+        return STEPS[self.state["step"]].messages(self.state, input)
@@ -0,0 +1,57 @@
+import copy
+import json
+import uuid
+from django.core.cache import caches
+
+# Conversation state outside the consumer so a client can reconnect, to any
+# worker, and continue where it left off. Snapshots are compact JSON in the
+# "conversations" cache, with ChatSession.state as the durable copy for when
+# the cache has evicted or never seen the session.
+#
+# Both copies carry a version that goes up with every saved turn. With a
+# per-worker cache (no REDIS_URL) a session that moved on through another
+# worker leaves a stale snapshot behind here, the newer copy wins.
+
+
+def new_state():
+    return {
+        "step": "zip",
+        "zip": None,
+        "name": None,
+        "email": None,
+        "vehicles": [],
+        "license_type": None,
+        "license_status": None,
+        "current_vehicle": {},
+        "version": 0,
+    }
+
+
+def parse_session_id(value):
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+
+# Call before writing the state out, once per turn
+def bump(state):
+    state["version"] = state.get("version", 0) + 1
+
+
+# The cache may be Redis, so only its async API is used from the consumer
+async def save_state(session_id, state):
+    await caches["conversations"].aset(str(session_id), json.dumps(state, separators=(",", ":")))
+
+
+async def load_state(session):
+    snapshot = await caches["conversations"].aget(str(session.id))
+    if snapshot is not None:
+        snapshot = json.loads(snapshot)
+    if session.state and (snapshot is None or session.state.get("version", 0) > snapshot.get("version", 0)):
+        return copy.deepcopy(session.state)
+    return snapshot
+
+
+async def forget(session_id):
+    await caches["conversations"].adelete(str(session_id))
@@ -0,0 +1,197 @@
+import csv
+import datetime
+import io
+import json
+from importlib.util import find_spec
+from asgiref.sync import sync_to_async
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import ChatMessage, ChatSession
+
+# Streaming export of completed sessions for downstream quoting, used by the
+# export command and /export. Sessions are read with iterator(chunk_size) and
+# their vehicles (and messages) prefetched per chunk, so memory depends on the
+# chunk size and not on the table. Output is produced a chunk at a time.
+#
+# Exports are incremental on completed_at: a run covers since < completed_at
+# <= until and hands back `until` as the watermark for the next run. until
+# lags the clock by SETTLE so sessions still in a write buffer are not skipped.
+
+FORMATS = ("csv", "jsonl", "parquet")
+
+CONTENT_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+SETTLE = datetime.timedelta(minutes=1)
+
+SESSION_FIELDS = ["id", "started_at", "completed_at", "zip_code", "full_name", "email", "license_type", "license_status"]
+
+VEHICLE_FIELDS = ["vin", "use_type", "blind_spot", "commute_days", "commute_miles", "annual_mileage"]
+
+CHUNK_SIZE = 1000
+
+
+class ExportError(Exception):
+    pass
+
+
+def watermark():
+    return timezone.now() - SETTLE
+
+
+# A watermark or --since value, naive times are taken as the current time zone
+def parse_since(value):
+    try:
+        moment = parse_datetime(value)
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise ExportError(f"Not an ISO date and time: {value!r}")
+    return moment if timezone.is_aware(moment) else timezone.make_aware(moment)
+
+
+def check_format(format):
+    if format not in WRITERS:
+        raise ExportError(f"Unknown format {format!r}, use one of {', '.join(FORMATS)}")
+    if format == "parquet" and find_spec("pyarrow") is None:
+        raise ExportError("Parquet export needs the optional pyarrow package (pip install pyarrow)")
+
+
+def completed_sessions(since=None, until=None, messages=False, chunk_size=CHUNK_SIZE):
+    sessions = ChatSession.objects.filter(is_complete=True, completed_at__isnull=False)
+    if since is not None:
+        sessions = sessions.filter(completed_at__gt=since)
+    if until is not None:
+        sessions = sessions.filter(completed_at__lte=until)
+    prefetch = ["vehicles"]
+    if messages:
+        prefetch.append(Prefetch("messages", queryset=ChatMessage.objects.order_by("timestamp", "id")))
+    return (
+        sessions.order_by("completed_at", "id")
+        .only(*SESSION_FIELDS)
+        .prefetch_related(*prefetch)
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def iso(value):
+    return value.isoformat() if value is not None else None
+
+
+def record(session, messages=False):
+    row = {field: getattr(session, field) for field in SESSION_FIELDS}
+    row.update(id=str(session.id), started_at=iso(session.started_at), completed_at=iso(session.completed_at))
+    row["vehicles"] = [{field: getattr(vehicle, field) for field in VEHICLE_FIELDS} for vehicle in session.vehicles.all()]
+    if messages:
+        row["messages"] = [
+            {"role": message.role, "content": message.content, "timestamp": iso(message.timestamp)}
+            for message in session.messages.all()
+        ]
+    return row
+
+
+# Records in lists of up to `size`, one list is one piece of output
+def batches(records, size):
+    batch = []
+    for row in records:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# One line per vehicle with the session columns repeated, a session without
+# vehicles still gets one line. Messages go in a JSON column.
+def csv_chunks(records, messages, size):
+    header = SESSION_FIELDS + [f"vehicle_{field}" for field in VEHICLE_FIELDS] + (["messages"] if messages else [])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for batch in batches(records, size):
+        for row in batch:
+            session = [row[field] for field in SESSION_FIELDS]
+            extra = [json.dumps(row["messages"])] if messages else []
+            for vehicle in row["vehicles"] or [{}]:
+                writer.writerow(session + [vehicle.get(field) for field in VEHICLE_FIELDS] + extra)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def jsonl_chunks(records, messages, size):
+    for batch in batches(records, size):
+        yield "".join(json.dumps(row, separators=(",", ":")) + "\n" for row in batch)
+
+
+# Collects what the Parquet writer produces so it can be handed out piece by piece
+class Sink(io.RawIOBase):
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+# One row group per chunk, vehicles and messages as nested lists
+def parquet_chunks(records, messages, size):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    vehicle = pa.struct([
+        ("vin", pa.string()), ("use_type", pa.string()), ("blind_spot", pa.string()),
+        ("commute_days", pa.int32()), ("commute_miles", pa.float64()), ("annual_mileage", pa.int64()),
+    ])
+    fields = [(field, pa.string()) for field in SESSION_FIELDS] + [("vehicles", pa.list_(vehicle))]
+    if messages:
+        fields.append(("messages", pa.list_(pa.struct([
+            ("role", pa.string()), ("content", pa.string()), ("timestamp", pa.string()),
+        ]))))
+    schema = pa.schema(fields)
+
+    sink = Sink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for batch in batches(records, size):
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+WRITERS = {"csv": csv_chunks, "jsonl": jsonl_chunks, "parquet": parquet_chunks}
+
+
+# Output of an export as str (csv, jsonl) or bytes (parquet) pieces
+def stream(format, since=None, until=None, messages=False, chunk_size=CHUNK_SIZE):
+    check_format(format)
+    records = (record(session, messages) for session in completed_sessions(since, until, messages, chunk_size))
+    return WRITERS[format](records, messages, chunk_size)
+
+
+# The same for StreamingHttpResponse under ASGI. Each piece is made in the
+# thread that owns the database connection, so the cursor stays usable.
+async def astream(pieces):
+    pieces = iter(pieces)
+    done = object()
+    while (piece := await sync_to_async(next)(pieces, done)) is not done:
+        yield piece
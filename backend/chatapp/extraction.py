@@ -0,0 +1,150 @@
+import re
+from .steps import STEPS, COMPLETE, QUESTIONS, ANSWER_SCHEMAS, nullable, response_format, strict_object
+
+# Optional extraction mode (LLM_EXTRACTION). A message that looks like several
+# answers at once ("12345, John Smith, john@x.com") is sent to the LLM once with
+# a JSON schema covering every onboarding field. Whatever comes back is checked
+# with the step validators, stored in the state, and the conversation skips
+# ahead to the first step that is still missing.
+
+EXTRACTION_PROMPT = """You extract onboarding details for a car insurance quote from one user message.
+
+        Fill in every field the message states clearly and use null for anything it does not mention.
+        Never guess or invent values.
+
+        FIELDS:
+        - zip: 5-digit US ZIP code
+        - name: full name, first and last
+        - email: email address
+        - vehicles: one entry per vehicle mentioned, in the order given
+            - vin: 17 character VIN, or "Year Make Model Body Type"
+            - use: commuting, commercial, farming or business
+            - blind_spot: "yes" or "no" for blind spot warning
+            - commute_days: days per week used for commuting (commuting vehicles only)
+            - commute_miles: one-way commute miles (commuting vehicles only)
+            - annual_mileage: miles per year (other vehicles only)
+        - more_vehicles: false if the user says they have no (more) vehicles to add, true if they want to add one, else null
+        - license_type: foreign, personal or commercial
+        - license_status: valid or suspended
+
+        The user message comes with the question they were just asked, use it to interpret short answers.
+        Reply with one JSON object holding exactly these fields, vehicles as a list of objects."""
+
+
+SCHEMA = strict_object({
+    "zip": ANSWER_SCHEMAS["zip"],
+    "name": ANSWER_SCHEMAS["name"],
+    "email": ANSWER_SCHEMAS["email"],
+    "vehicles": {"type": "array", "items": strict_object({
+        "vin": ANSWER_SCHEMAS["vin"],
+        "use": ANSWER_SCHEMAS["use"],
+        "blind_spot": ANSWER_SCHEMAS["blind_spot"],
+        "commute_days": ANSWER_SCHEMAS["days"],
+        "commute_miles": ANSWER_SCHEMAS["miles"],
+        "annual_mileage": ANSWER_SCHEMAS["mileage"],
+    })},
+    "more_vehicles": nullable("boolean"),
+    "license_type": ANSWER_SCHEMAS["license_type"],
+    "license_status": ANSWER_SCHEMAS["license_status"],
+})
+
+# Same LLM_RESPONSE_FORMAT handling as the steps
+def extraction_format():
+    return response_format("onboarding_fields", SCHEMA)
+
+SEPARATORS = re.compile(r"[,;\n]|\band\b")
+
+PERSON_STEPS = [step for step in STEPS.values() if step.output_key and not step.vehicle]
+VEHICLE_STEPS = [step for step in STEPS.values() if step.vehicle]
+
+
+# Only messages with several parts are worth the larger call, a single answer
+# is cheaper through the normal per-step path
+def looks_multi(text):
+    return len([part for part in SEPARATORS.split(text) if part.strip()]) >= 2
+
+
+def messages(state, input):
+    return [
+        {"role": "system", "content": EXTRACTION_PROMPT},
+        {"role": "user", "content": f"Question: {QUESTIONS[state['step']]}\nUser message: {input}"},
+    ]
+
+
+# Fields whose validator is a complete format check, anything it does not accept is wrong
+STRICT_FIELDS = {"zip", "email"}
+
+
+# The step's local validator has the final say. An ambiguous value (the
+# validator returns None) is taken as the model extracted it, unless the field
+# has a strict format, and a clearly invalid one is dropped.
+def check(step, value, state):
+    if value is None or value == "":
+        return None
+    if step.validator is None:
+        return value
+    result = step.validator(str(value), state)
+    if result is None:
+        return None if step.field in STRICT_FIELDS else value
+    return result.get(step.output_key) if result.get("valid") else None
+
+
+def vehicle_complete(vehicle):
+    needed = ["vin", "use", "blind_spot"]
+    needed += ["commute_days", "commute_miles"] if vehicle.get("use") == "commuting" else ["annual_mileage"]
+    return all(vehicle.get(field) is not None for field in needed)
+
+
+# Fill every empty state field the extraction found. Returns the vehicles that
+# are now complete, they are moved to state["vehicles"] and the caller saves them.
+def apply(state, extracted):
+    for step in PERSON_STEPS:
+        if state.get(step.field) is None:
+            value = check(step, extracted.get(step.field), state)
+            if value is not None:
+                state[step.field] = value
+
+    completed = []
+    # Vehicles already asked about past this point would be out of order
+    if state["step"] in ("license_type", "license_status"):
+        return completed
+    for found in extracted.get("vehicles") or []:
+        vehicle = state["current_vehicle"]
+        for step in VEHICLE_STEPS:
+            if vehicle.get(step.field) is None:
+                # blind_spot and the validators after it read the vehicle being built
+                value = check(step, found.get(step.field), state)
+                if value is not None:
+                    vehicle[step.field] = value
+        if not vehicle_complete(vehicle):
+            break
+        state["vehicles"].append(vehicle.copy())
+        state["current_vehicle"] = {}
+        completed.append(vehicle)
+    return completed
+
+
+# Walk forward from `step_name` past every step whose answer is already known.
+# more_vehicles answers the add (another) vehicle question when it was given.
+def skip_answered(state, step_name, more_vehicles=None, added=0):
+    if added and STEPS[step_name].vehicle:
+        step_name = "add_another_vehicle"
+    while step_name != COMPLETE:
+        step = STEPS[step_name]
+        if not step.output_key:
+            if state["current_vehicle"]:
+                step_name = "vehicle_vin"
+            elif added and step_name == "add_vehicle":
+                step_name = "add_another_vehicle"
+            elif more_vehicles is None:
+                return step_name
+            else:
+                step_name = "vehicle_vin" if more_vehicles else "license_type"
+                more_vehicles = None
+            continue
+        target = state["current_vehicle"] if step.vehicle else state
+        value = target.get(step.field)
+        if value is None:
+            return step_name
+        step_name = step.transition(state, {"valid": True, step.output_key: value})
+    return step_name
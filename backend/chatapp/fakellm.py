@@ -0,0 +1,260 @@
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import Counter
+
+# Minimal OpenAI-compatible chat completions server for offline benchmarks.
+# Point OPENAI_BASE_URL at FakeLLMServer.base_url and every completion
+# returns a canned reply after `latency` seconds, plus up to `jitter` more.
+class FakeLLMServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.2, reply=None, token_delay=0.005, jitter=0.0,
+                 failures=0, failure_status=500, stall_rate=0.0, stall=5.0, cache_min_tokens=1024):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        # The first `failures` requests get an HTTP `failure_status` error, -1 fails them all
+        self.failures = failures
+        self.failure_status = failure_status
+        # Fraction of requests that stall for `stall` extra seconds, like a provider hiccup
+        self.stall_rate = stall_rate
+        self.stall = stall
+        # Delay between streamed chunks when the client asks for stream=True
+        self.token_delay = token_delay
+        self.reply = reply or {"message": "Please enter a 5-digit ZIP code.", "valid": False}
+        self.requests = 0
+        # Requests per model name
+        self.models = Counter()
+        # System prompts seen so far, repeats are reported as cached tokens. Like
+        # OpenAI only prompts of at least `cache_min_tokens` are cached.
+        self.prefixes = set()
+        self.cache_min_tokens = cache_min_tokens
+        self.server = None
+        self.connections = {}
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port, backlog=1024)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            # Drop keep-alive connections and stop handlers still sleeping on a reply
+            for writer, task in list(self.connections.items()):
+                writer.close()
+                task.cancel()
+            await asyncio.gather(*self.connections.values(), return_exceptions=True)
+            await self.server.wait_closed()
+            self.server = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    # Rough token counts (4 characters per token) with an exact-prefix prompt cache
+    def make_usage(self, body, content):
+        messages = body.get("messages", [])
+        prompt_tokens = sum(len(message.get("content", "")) for message in messages) // 4
+        system = messages[0].get("content", "") if messages and messages[0].get("role") == "system" else ""
+        cacheable = prompt_tokens >= self.cache_min_tokens
+        cached_tokens = len(system) // 4 if cacheable and system in self.prefixes else 0
+        if cacheable:
+            self.prefixes.add(system)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": prompt_tokens + len(content) // 4,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+
+    # Build the JSON body that the model would have produced for this request
+    def make_reply(self, body):
+        return json.dumps(self.reply)
+
+    # Server-sent events in chunked transfer encoding, a few characters per event
+    async def write_stream(self, writer, body):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\n"
+            b"\r\n"
+        )
+        content = self.make_reply(body)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        pieces = [content[i:i + 8] for i in range(0, len(content), 8)]
+        for index, piece in enumerate(pieces + [None]):
+            event = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": piece} if piece is not None else {},
+                    "finish_reason": None if piece is not None else "stop",
+                }],
+            }
+            self.write_chunk(writer, f"data: {json.dumps(event)}\n\n".encode())
+            await writer.drain()
+            if index < len(pieces) - 1:
+                await asyncio.sleep(self.token_delay)
+        if body.get("stream_options", {}).get("include_usage"):
+            event = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [],
+                "usage": self.make_usage(body, content),
+            }
+            self.write_chunk(writer, f"data: {json.dumps(event)}\n\n".encode())
+        self.write_chunk(writer, b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    # Seconds to wait before answering the current request
+    def request_latency(self):
+        latency = self.latency + random.uniform(0, self.jitter)
+        if random.random() < self.stall_rate:
+            latency += self.stall
+        return latency
+
+    def write_error(self, writer):
+        payload = json.dumps({"error": {"message": "Simulated failure", "type": "server_error"}}).encode()
+        writer.write(
+            f"HTTP/1.1 {self.failure_status} Error\r\n".encode() +
+            b"Content-Type: application/json\r\n"
+            b"Content-Length: " + str(len(payload)).encode() + b"\r\n"
+            b"\r\n" + payload
+        )
+
+    def write_chunk(self, writer, data):
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    async def handle(self, reader, writer):
+        self.connections[writer] = asyncio.current_task()
+        try:
+            # Keep-alive: serve requests on this connection until the client closes it
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                body = json.loads(await reader.readexactly(length)) if length else {}
+                self.requests += 1
+                self.models[body.get("model")] += 1
+
+                await asyncio.sleep(self.request_latency())
+
+                if self.failures < 0 or self.requests <= self.failures:
+                    self.write_error(writer)
+                    await writer.drain()
+                    continue
+
+                if body.get("stream"):
+                    await self.write_stream(writer, body)
+                    continue
+
+                content = self.make_reply(body)
+                payload = json.dumps({
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "fake"),
+                    "choices": [{
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": content},
+                    }],
+                    "usage": self.make_usage(body, content),
+                }).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\n"
+                    b"Content-Type: application/json\r\n"
+                    b"Content-Length: " + str(len(payload)).encode() + b"\r\n"
+                    b"\r\n" + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Cancelled by stop(), the client side is gone either way
+            pass
+        finally:
+            self.connections.pop(writer, None)
+            writer.close()
+
+
+# Answers like the real model would for whichever onboarding step the request
+# is for, so scripted conversations walk the whole flow with the LLM in the loop.
+# The step is recognised from the prefix steps.py puts before the user's input.
+class StepAwareLLMServer(FakeLLMServer):
+    def make_reply(self, body):
+        from .steps import STEPS
+
+        content = body.get("messages", [{}])[-1].get("content", "")
+        # Extraction requests, see extraction.messages
+        if content.startswith("Question: "):
+            return json.dumps(self.extract(content.partition("User message: ")[2]))
+        # Longest prefix first, "User response: " must win over "Response: "
+        for step in sorted(STEPS.values(), key=lambda step: -len(step.user_prefix)):
+            if content.startswith(step.user_prefix):
+                return json.dumps(self.answer(step, content[len(step.user_prefix):].strip()))
+        return super().make_reply(body)
+
+    def answer(self, step, text):
+        reply = {"message": f"Got it: {text}", "valid": True}
+        if step.output_key:
+            reply[step.output_key] = text
+        elif text.lower() in ("yes", "y"):
+            reply["add_vehicle"] = True
+        elif text.lower() in ("no", "n"):
+            reply["no_vehicle"] = True
+        else:
+            reply["valid"] = False
+        return reply
+
+    # Comma separated details, classified with the local validators
+    def extract(self, text):
+        from . import validators
+
+        found = {"zip": None, "name": None, "email": None, "vehicles": [], "more_vehicles": None,
+                 "license_type": None, "license_status": None}
+        vehicle = {}
+        for part in (part.strip() for part in text.split(",")):
+            answer = validators.normalise(part)
+            if part.isdigit() and len(part) == 5:
+                found["zip"] = part
+            elif validators.EMAIL.match(part):
+                found["email"] = part
+            elif validators.vin_check_digit_ok(part.upper()):
+                vehicle["vin"] = part.upper()
+            elif answer in validators.VEHICLE_USES:
+                vehicle["use"] = validators.VEHICLE_USES[answer]
+            elif answer in validators.LICENSE_TYPES:
+                found["license_type"] = answer
+            elif answer in validators.LICENSE_STATUSES:
+                found["license_status"] = validators.LICENSE_STATUSES[answer]
+            elif answer in ("no more vehicles", "no vehicles"):
+                found["more_vehicles"] = False
+            elif len(part.split()) >= 2 and part.replace(" ", "").isalpha():
+                found["name"] = part
+        if vehicle:
+            fields = ["vin", "use", "blind_spot", "commute_days", "commute_miles", "annual_mileage"]
+            found["vehicles"].append({field: vehicle.get(field) for field in fields})
+        return found
@@ -0,0 +1,131 @@
+import bisect
+import datetime
+from collections import defaultdict
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import StepDwell, StepEvent, StepRollup
+from .steps import COMPLETE, ORDER
+
+# Onboarding funnel. The consumer records a StepEvent whenever a session moves
+# to another step, and the write buffer adds each batch to the StepRollup rows
+# of its day in the same transaction. Reports only read the rollup, so they
+# cost a few rows per day and step however many sessions there were.
+#
+# A step's entries are the sessions that moved into it, its completions the
+# ones that moved on, the difference is where users dropped off. Dwell time
+# runs from entering a step to leaving it, user think time and LLM included.
+
+# Upper bounds in seconds of the dwell time histogram buckets, the last bucket is open
+DWELL_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def bucket(seconds):
+    return bisect.bisect_left(DWELL_BUCKETS, seconds)
+
+
+def day_of(moment):
+    return timezone.localdate(moment)
+
+
+# Totals per (day, step) for a batch of events
+def summarize(events):
+    totals = defaultdict(lambda: {"entries": 0, "completions": 0, "turns": 0, "llm_retries": 0,
+                                  "dwell_seconds": 0.0, "dwell": defaultdict(int)})
+    for event in events:
+        day = day_of(event.created_at)
+        totals[day, event.next_step]["entries"] += 1
+        if event.step:
+            total = totals[day, event.step]
+            total["completions"] += 1
+            total["turns"] += event.turns
+            total["llm_retries"] += event.llm_retries
+            total["dwell_seconds"] += event.dwell_seconds
+            total["dwell"][bucket(event.dwell_seconds)] += 1
+    return totals
+
+
+# Add `values` to the counters of one rollup row, creating it the first time.
+# A single UPDATE with F() holds the row only until the flush commits.
+def add(model, keys, values):
+    changes = {field: F(field) + value for field, value in values.items()}
+    if model.objects.filter(**keys).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **values)
+    except IntegrityError:
+        # Another flush created the row first
+        model.objects.filter(**keys).update(**changes)
+
+
+# Add a batch of events to the rollup. Called last in the write buffer's
+# transaction, in key order so concurrent flushes never wait on each other in a cycle.
+def record(events):
+    for (day, step), total in sorted(summarize(events).items()):
+        add(StepRollup, {"day": day, "step": step}, {
+            field: total[field] for field in ("entries", "completions", "turns", "llm_retries", "dwell_seconds")
+        })
+        for index, count in sorted(total["dwell"].items()):
+            add(StepDwell, {"day": day, "step": step, "bucket": index}, {"completions": count})
+
+
+# Recompute the rollup from the events, for a backfill or after changing how it is computed
+def rebuild(batch_size=5000):
+    with transaction.atomic():
+        StepRollup.objects.all().delete()
+        StepDwell.objects.all().delete()
+        events = []
+        for event in StepEvent.objects.order_by().iterator(chunk_size=batch_size):
+            events.append(event)
+            if len(events) == batch_size:
+                record(events)
+                events = []
+        record(events)
+
+
+# Upper bound of the bucket holding the middle completion
+def median(histogram):
+    total = sum(histogram)
+    if not total:
+        return None
+    seen = 0
+    for index, count in enumerate(histogram):
+        seen += count
+        if seen * 2 >= total:
+            return DWELL_BUCKETS[index] if index < len(DWELL_BUCKETS) else None
+    return None
+
+
+# Funnel over the days from `start` to `end` (inclusive), in step order
+def report(start, end):
+    steps = {}
+    for rollup in StepRollup.objects.filter(day__gte=start, day__lte=end):
+        total = steps.setdefault(rollup.step, {"entries": 0, "completions": 0, "turns": 0, "llm_retries": 0,
+                                               "dwell_seconds": 0.0, "histogram": [0] * (len(DWELL_BUCKETS) + 1)})
+        for field in ("entries", "completions", "turns", "llm_retries", "dwell_seconds"):
+            total[field] += getattr(rollup, field)
+    for dwell in StepDwell.objects.filter(day__gte=start, day__lte=end, step__in=steps, bucket__lte=len(DWELL_BUCKETS)):
+        steps[dwell.step]["histogram"][dwell.bucket] += dwell.completions
+
+    order = ORDER + [COMPLETE]
+    rows = []
+    for step in sorted(steps, key=lambda name: order.index(name) if name in order else len(order)):
+        total = steps[step]
+        done = total["completions"]
+        rows.append({
+            "step": step,
+            "entries": total["entries"],
+            "completions": done,
+            "dropped": max(total["entries"] - done, 0) if step != COMPLETE else 0,
+            "median_dwell_seconds": median(total["histogram"]),
+            "mean_dwell_seconds": round(total["dwell_seconds"] / done, 1) if done else None,
+            "turns_per_completion": round(total["turns"] / done, 2) if done else None,
+            "llm_retries": total["llm_retries"],
+        })
+    return rows
+
+
+def last_days(days):
+    end = timezone.localdate()
+    return end - datetime.timedelta(days=max(days, 1) - 1), end
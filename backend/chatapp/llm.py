@@ -0,0 +1,261 @@
+import asyncio
+import weakref
+from importlib.util import find_spec
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DEFAULT_CONNECTION_LIMITS
+from . import metrics, ratelimit, resilience
+
+# One concurrency cap per event loop so a Daphne worker never has more than
+# LLM_MAX_CONCURRENCY completions in flight at once
+_semaphores = weakref.WeakKeyDictionary()
+
+# Process wide client registry. Daphne runs a single event loop, so in practice
+# every connection shares one client and one keep-alive connection pool.
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_semaphore():
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+        _semaphores[loop] = semaphore
+    return semaphore
+
+
+# semaphore.acquire() within `timeout` seconds, False if it ran out. Not
+# wait_for, which before Python 3.12 can swallow a cancellation that arrives
+# just as the slot is granted (a losing hedged copy) and keep the slot.
+async def acquire_within(semaphore, timeout):
+    waiter = asyncio.ensure_future(semaphore.acquire())
+    try:
+        await asyncio.wait({waiter}, timeout=timeout)
+    except asyncio.CancelledError:
+        if waiter.done() and not waiter.cancelled():
+            semaphore.release()
+        else:
+            waiter.cancel()
+        raise
+    if waiter.done():
+        return True
+    waiter.cancel()
+    return False
+
+
+def build_client():
+    # Same Limits class the SDK itself uses, so this works with whichever httpx it ships with
+    limits = type(DEFAULT_CONNECTION_LIMITS)(
+        max_connections=settings.LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+    )
+    http_client = DefaultAsyncHttpxClient(
+        limits=limits,
+        # HTTP/2 needs the optional h2 package (pip install httpx[http2])
+        http2=settings.LLM_HTTP2 and find_spec("h2") is not None,
+    )
+    return AsyncOpenAI(
+        api_key=settings.OPENAI_API_KEY,
+        base_url=settings.OPENAI_BASE_URL,
+        # Retries happen in LLMClient.call
+        max_retries=0,
+        http_client=http_client,
+    )
+
+
+# Lazily create the shared client the first time a connection needs it
+def get_client():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = build_client()
+        _clients[loop] = client
+    return client
+
+
+# Connection pool numbers for the current process, used for metrics
+def pool_stats():
+    stats = {"clients": 0, "connections": 0, "idle_connections": 0, "queued_requests": 0}
+    for client in list(_clients.values()):
+        pool = getattr(client._client._transport, "_pool", None)
+        if pool is None:
+            continue
+        stats["clients"] += 1
+        stats["connections"] += len(pool.connections)
+        stats["idle_connections"] += sum(1 for connection in pool.connections if connection.is_idle())
+        stats["queued_requests"] += len(getattr(pool, "_requests", []))
+    return stats
+
+
+# Tests swap the API settings with override_settings, so forget cached clients
+@receiver(setting_changed)
+def reset_clients(setting, **kwargs):
+    if setting.startswith("OPENAI_") or setting.startswith("LLM_"):
+        _clients.clear()
+        _semaphores.clear()
+        resilience.reset()
+        ratelimit.reset()
+
+
+# Token counts the provider reported for one completion. cached_tokens is the
+# part of the prompt served from the provider's prompt cache.
+def read_usage(usage):
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens or 0,
+        "cached_tokens": getattr(details, "cached_tokens", None) or 0,
+        "completion_tokens": usage.completion_tokens or 0,
+    }
+
+
+# Async wrapper around the chat completions API so a slow completion only
+# suspends the socket waiting on it instead of the whole event loop. Every call
+# has a deadline, is retried with backoff, goes through the model's circuit
+# breaker and can be hedged (see resilience.py). A call that fails for good
+# raises LLMUnavailable. With LLM_RPM/LLM_TPM set, calls also wait for the
+# rate limiter, `session` and `priority` decide their place in its queue. A
+# hedged copy waits for the limiter and a concurrency slot like any request.
+class LLMClient:
+    def __init__(self, client=None, model=None, timeout=None, session=None):
+        self._client = client
+        self.model = model or settings.LLM_MODEL
+        self.timeout = timeout or settings.LLM_TIMEOUT
+        self.session = session
+        self.priority = 0
+        # Retries made by this client, the consumer moves them into the step's funnel event
+        self.retries = 0
+
+    # The shared client is looked up on first use so connecting stays cheap
+    @property
+    def client(self):
+        return self._client or get_client()
+
+    def create(self, messages, cache_key=None, **kwargs):
+        if cache_key and settings.LLM_PROMPT_CACHE_KEY:
+            # Routes calls that share a prompt prefix to the same provider cache
+            kwargs["extra_body"] = {"prompt_cache_key": cache_key}
+        return self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            timeout=self.timeout,
+            **kwargs,
+        )
+
+    # Waits for the rate limiter and a concurrency slot, both within the
+    # deadline. Running out of time here is local congestion, not a provider
+    # failure, so it raises LLMUnavailable and the breaker is left alone.
+    async def admit(self, tokens, deadline):
+        loop = asyncio.get_running_loop()
+        if ratelimit.enabled():
+            limiter = ratelimit.get_limiter()
+            try:
+                await asyncio.wait_for(limiter.acquire(tokens, self.session, self.priority),
+                                       timeout=max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                metrics.counters["llm_rate_limited"] += 1
+                raise resilience.LLMUnavailable("Rate limit queue wait passed the deadline") from None
+        if not await acquire_within(get_semaphore(), max(deadline - loop.time(), 0)):
+            metrics.counters["llm_saturated"] += 1
+            raise resilience.LLMUnavailable("Concurrency cap wait passed the deadline")
+
+    # One request, hedged copies included, each admitted on its own. A request
+    # cut short by the deadline only had what was left of it, so that is not
+    # held against the provider either, LLM_TIMEOUT is what catches a slow one.
+    async def send(self, request, tokens, deadline):
+        await self.admit(tokens, deadline)
+        try:
+            return await asyncio.wait_for(request(), timeout=max(deadline - asyncio.get_running_loop().time(), 0))
+        except asyncio.TimeoutError:
+            raise resilience.LLMUnavailable("Deadline passed waiting for the provider") from None
+        finally:
+            get_semaphore().release()
+
+    # Runs request() until it succeeds, retrying provider failures with backoff
+    # while the deadline allows
+    async def call(self, request, hedge_delay=0, tokens=0):
+        breaker = resilience.get_breaker(self.model)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.LLM_DEADLINE
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                metrics.counters["llm_fast_failures"] += 1
+                raise resilience.CircuitOpen(f"Circuit open for {self.model}")
+            # allow() let this call through as the half-open probe, it must end in success() or failure()
+            probe = breaker.probing
+            answered = False
+            try:
+                try:
+                    response = await resilience.hedge(lambda: self.send(request, tokens, deadline), hedge_delay)
+                except resilience.LLMUnavailable:
+                    # Out of time before the provider answered, see admit() and send()
+                    raise
+                except Exception as exc:
+                    metrics.counters["llm_errors"] += 1
+                    if not resilience.retryable(exc):
+                        # A request the provider rejects (bad key, bad schema) will not get better,
+                        # and says nothing about whether the provider is healthy
+                        raise resilience.LLMUnavailable(str(exc)) from exc
+                    answered = True
+                    breaker.failure()
+                    delay = resilience.backoff(attempt, exc)
+                    if attempt >= settings.LLM_MAX_RETRIES or loop.time() + delay >= deadline:
+                        raise resilience.LLMUnavailable(str(exc)) from exc
+                    metrics.counters["llm_retries"] += 1
+                    self.retries += 1
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                else:
+                    answered = True
+                    breaker.success()
+                    return response
+            finally:
+                # Without this a probe that got no verdict (queued past the deadline, rejected,
+                # cancelled) would keep the circuit shut for good
+                if probe and not answered:
+                    breaker.release()
+
+    # Returns the completion text and its token usage
+    async def complete(self, messages, cache_key=None, **kwargs):
+        tokens = ratelimit.estimate_tokens(messages)
+        response = await self.call(lambda: self.create(messages, cache_key, **kwargs),
+                                   hedge_delay=settings.LLM_HEDGE_DELAY, tokens=tokens)
+        usage = read_usage(response.usage)
+        self.settle(tokens, usage)
+        return response.choices[0].message.content.strip(), usage
+
+    def settle(self, tokens, usage):
+        if usage and ratelimit.enabled():
+            ratelimit.get_limiter().settle(tokens, usage["prompt_tokens"] + usage["completion_tokens"])
+
+    # Yields the completion text piece by piece as the model generates it.
+    # Token usage arrives with the last chunk and is copied into `usage`.
+    # Only opening the stream is retried, once text has been sent on there is
+    # no taking it back. Streams are never hedged.
+    async def stream(self, messages, cache_key=None, usage=None, **kwargs):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.LLM_DEADLINE
+        tokens = ratelimit.estimate_tokens(messages)
+        stream = await self.call(lambda: self.create(
+            messages, cache_key, stream=True, stream_options={"include_usage": True}, **kwargs,
+        ), tokens=tokens)
+        chunks = stream.__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), timeout=max(deadline - loop.time(), 0))
+            except StopAsyncIteration:
+                self.settle(tokens, usage)
+                return
+            except Exception as exc:
+                metrics.counters["llm_errors"] += 1
+                resilience.get_breaker(self.model).failure()
+                await stream.close()
+                raise resilience.LLMUnavailable(str(exc)) from exc
+            if chunk.usage is not None and usage is not None:
+                usage.update(read_usage(chunk.usage))
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
@@ -0,0 +1,89 @@
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+from Chatbot import databases
+from chatapp.models import ChatMessage, ChatSession
+
+PROFILES = {
+    "sqlite": lambda path: databases.sqlite(path, tuned=False),
+    "sqlite-tuned": lambda path: databases.sqlite(path, tuned=True),
+    "postgres": lambda path: databases.postgres(pool=False),
+    "postgres-pool": lambda path: databases.postgres(pool=True),
+}
+
+
+# Concurrent writer benchmark. Every writer thread repeats what a consumer does
+# when its write buffer flushes: insert the turn's messages and update the
+# session row in one transaction. Each profile runs in its own throwaway test
+# database so the real data is never touched.
+class Command(BaseCommand):
+    help = "Compare database profiles under concurrent ChatMessage writers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profiles", default="sqlite,sqlite-tuned",
+                            help=f"Comma separated, any of {', '.join(PROFILES)}")
+        parser.add_argument("--writers", default="1,4,16", help="Comma separated writer thread counts")
+        parser.add_argument("--transactions", type=int, default=200, help="Transactions per writer")
+
+    def handle(self, *args, **options):
+        profiles = options["profiles"].split(",")
+        unknown = set(profiles) - set(PROFILES)
+        if unknown:
+            raise CommandError(f"Unknown profiles: {', '.join(sorted(unknown))}")
+
+        self.stdout.write(f"{'profile':<14} {'writers':>7} {'txn/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        with tempfile.TemporaryDirectory() as directory:
+            for profile in profiles:
+                alias = f"bench_{profile.replace('-', '_')}"
+                database = PROFILES[profile](Path(directory) / f"{alias}.sqlite3")
+                database["TEST"] = {"NAME": str(Path(directory) / f"test_{alias}.sqlite3")}
+                connections.settings[alias] = connections.configure_settings({"default": database})["default"]
+
+                creation = connections[alias].creation
+                old_name = creation.create_test_db(verbosity=0, autoclobber=True)
+                try:
+                    for writers in [int(n) for n in options["writers"].split(",")]:
+                        self.run(profile, alias, writers, options["transactions"])
+                finally:
+                    connections[alias].close()
+                    creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, profile, alias, writers, transactions):
+        sessions = [ChatSession.objects.using(alias).create() for _ in range(writers)]
+        latencies, errors = [], []
+
+        def writer(session):
+            for i in range(transactions):
+                started = time.perf_counter()
+                try:
+                    with transaction.atomic(using=alias):
+                        ChatMessage.objects.using(alias).bulk_create([
+                            ChatMessage(session=session, role="user", content=f"answer {i}"),
+                            ChatMessage(session=session, role="assistant", content=f"question {i}"),
+                        ])
+                        session.current_step = f"step {i}"
+                        session.save(using=alias, update_fields=["current_step"])
+                except OperationalError:
+                    errors.append(1)
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000)
+            connections[alias].close()
+
+        threads = [threading.Thread(target=writer, args=(session,)) for session in sessions]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        latencies.sort()
+        p50 = statistics.median(latencies) if latencies else 0
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0
+        self.stdout.write(
+            f"{profile:<14} {writers:>7} {len(latencies) / wall:>8.0f} {p50:>8.2f} {p99:>8.2f} {len(errors):>7}"
+        )
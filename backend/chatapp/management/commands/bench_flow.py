@@ -0,0 +1,122 @@
+import asyncio
+import statistics
+import time
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from chatapp import writes
+from chatapp.fakellm import StepAwareLLMServer
+from chatapp.models import ChatSession
+from chatapp.routing import websocket_urlpatterns
+
+VINS = ["1HGBH41JXMN109186", "1M8GDM9AXKP042788", "5YJSA1E26HF000337"]
+
+
+# Answers for one complete onboarding: contact details, `vehicles` vehicles
+# alternating between the commuting and annual mileage paths, then the license.
+# `combined` gives the contact details and the license each in one message.
+def onboarding_script(vehicles, combined=False):
+    answers = ["12345, John Smith, john@example.com"] if combined else ["12345", "John Smith", "john@example.com"]
+    for index in range(vehicles):
+        answers.append("yes")
+        answers.append(VINS[index % len(VINS)])
+        if index % 2 == 0:
+            answers += ["commuting", "yes", "5", "12"]
+        else:
+            answers += ["business", "no", "8000"]
+    answers.append("no")
+    answers += ["personal, valid"] if combined else ["personal", "valid"]
+    return answers
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+# End to end benchmark: N sockets each run a full scripted onboarding against
+# a step-aware fake LLM. Reports throughput, turn latency and how many
+# database commits the flows cost. Runs offline in a throwaway database.
+class Command(BaseCommand):
+    help = "Benchmark complete onboarding flows over concurrent sockets (offline, uses a fake LLM)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sockets", type=int, default=100, help="Concurrent sockets, each runs one flow")
+        parser.add_argument("--vehicles", type=int, default=2, help="Vehicles added per flow")
+        parser.add_argument("--latency", type=float, default=0.2, help="Fake LLM latency in seconds")
+        parser.add_argument("--jitter", type=float, default=0.1, help="Extra random fake LLM latency in seconds")
+        parser.add_argument("--llm-only", action="store_true", help="Skip local validators so every turn hits the LLM")
+        parser.add_argument("--extract", action="store_true",
+                            help="Answer several questions per message with LLM_EXTRACTION on")
+        parser.add_argument("--routing", action="store_true",
+                            help="Try LLM_SMALL_MODEL first on simple steps (LLM_ROUTING), requests are counted per model")
+        parser.add_argument("--stall-rate", type=float, default=0.0, help="Fraction of fake LLM requests that stall")
+        parser.add_argument("--stall", type=float, default=5.0, help="Seconds a stalled request takes")
+        parser.add_argument("--hedge-delay", type=float, default=0.0, help="LLM_HEDGE_DELAY for the run, 0 is off")
+        parser.add_argument("--rpm", type=int, default=0, help="LLM_RPM for the run, 0 is unlimited")
+        parser.add_argument("--tpm", type=int, default=0, help="LLM_TPM for the run, 0 is unlimited")
+        parser.add_argument("--max-p95", type=float, help="Fail if the p95 turn latency in ms is above this")
+
+    def handle(self, *args, **options):
+        # Never write benchmark sessions into the real database
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            report = asyncio.run(self.run(options))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options["max_p95"] is not None and report["p95"] > options["max_p95"]:
+            raise CommandError(f"p95 turn latency {report['p95']:.1f} ms is above {options['max_p95']:.1f} ms")
+
+    async def run(self, options):
+        script = onboarding_script(options["vehicles"], combined=options["extract"])
+        commits, rows = writes.stats["commits"], writes.stats["rows"]
+
+        async with StepAwareLLMServer(latency=options["latency"], jitter=options["jitter"],
+                                      stall_rate=options["stall_rate"], stall=options["stall"]) as server:
+            # Response cache off so repeated scripted answers still reach the LLM
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url, RESPONSE_CACHE="",
+                                   LOCAL_VALIDATORS=not options["llm_only"], LLM_EXTRACTION=options["extract"],
+                                   LLM_ROUTING=options["routing"],
+                                   LLM_HEDGE_DELAY=options["hedge_delay"], LLM_RPM=options["rpm"], LLM_TPM=options["tpm"], WS_TURNS_PER_MINUTE=0):
+                started = time.perf_counter()
+                results = await asyncio.gather(*(self.drive_flow(script) for _ in range(options["sockets"])))
+                wall = time.perf_counter() - started
+            # The summary frame alone does not show the session row was marked complete
+            saved = await ChatSession.objects.filter(is_complete=True, completed_at__isnull=False).acount()
+
+        latencies = sorted(ms for flow in results for ms in flow["latencies"])
+        completed = sum(flow["complete"] for flow in results)
+        report = {
+            "p50": statistics.median(latencies),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+        }
+        commits, rows = writes.stats["commits"] - commits, writes.stats["rows"] - rows
+
+        self.stdout.write(f"flows          {completed}/{len(results)} complete ({saved} saved as complete), {len(script)} turns each")
+        self.stdout.write(f"throughput     {len(latencies) / wall:.1f} turns/s, {completed / wall:.1f} flows/s")
+        self.stdout.write(f"turn latency   p50 {report['p50']:.1f} ms, p95 {report['p95']:.1f} ms, "
+                          f"p99 {report['p99']:.1f} ms, max {latencies[-1]:.1f} ms")
+        models = ", ".join(f"{model} {count}" for model, count in server.models.most_common())
+        self.stdout.write(f"LLM requests   {server.requests} ({server.requests / len(latencies):.2f} per turn: {models})")
+        self.stdout.write(f"DB writes      {commits} commits, {rows} rows ({commits / max(completed, 1):.1f} commits per flow)")
+        return report
+
+    async def drive_flow(self, script):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), "/ws/chat/")
+        connected, _ = await communicator.connect(timeout=30)
+        assert connected
+        await communicator.receive_json_from(timeout=30)
+
+        latencies = []
+        frame = {}
+        for answer in script:
+            started = time.perf_counter()
+            await communicator.send_json_to({"message": answer})
+            frame = await communicator.receive_json_from(timeout=60)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        await communicator.disconnect()
+        return {"latencies": latencies, "complete": frame.get("message", "").startswith("Information collected:")}
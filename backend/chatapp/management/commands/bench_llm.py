@@ -0,0 +1,64 @@
+import asyncio
+import statistics
+import time
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from chatapp.fakellm import FakeLLMServer
+from chatapp.routing import websocket_urlpatterns
+
+
+# Drives N concurrent sockets through ChatConsumer against a local fake LLM
+# and reports turn latency. With a non-blocking LLM path the latency should
+# stay close to the fake server's latency no matter how many sockets are open.
+class Command(BaseCommand):
+    help = "Benchmark turn latency as the number of concurrent sockets grows (offline, uses a fake LLM)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sockets", default="1,10,50,100,200", help="Comma separated socket counts")
+        parser.add_argument("--turns", type=int, default=3, help="Messages sent per socket")
+        parser.add_argument("--latency", type=float, default=0.2, help="Fake LLM latency in seconds")
+
+    def handle(self, *args, **options):
+        counts = [int(n) for n in options["sockets"].split(",")]
+
+        # Never write benchmark sessions into the real database
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            asyncio.run(self.run(counts, options["turns"], options["latency"]))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    async def run(self, counts, turns, latency):
+        async with FakeLLMServer(latency=latency) as server:
+            # Response cache off so every turn really goes to the (fake) LLM
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url, RESPONSE_CACHE=""):
+                self.stdout.write(f"{'sockets':>8} {'turns':>7} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'wall s':>7}")
+                for count in counts:
+                    started = time.perf_counter()
+                    results = await asyncio.gather(*(self.drive_socket(turns) for _ in range(count)))
+                    wall = time.perf_counter() - started
+                    latencies = sorted(ms for socket in results for ms in socket)
+                    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+                    self.stdout.write(
+                        f"{count:>8} {len(latencies):>7} {statistics.median(latencies):>8.1f} "
+                        f"{p95:>8.1f} {latencies[-1]:>8.1f} {wall:>7.2f}"
+                    )
+
+    async def drive_socket(self, turns):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), "/ws/chat/")
+        connected, _ = await communicator.connect(timeout=30)
+        assert connected
+        await communicator.receive_json_from(timeout=30)
+
+        latencies = []
+        for _ in range(turns):
+            started = time.perf_counter()
+            await communicator.send_json_to({"message": "my zip is 1234"})
+            await communicator.receive_json_from(timeout=60)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        await communicator.disconnect()
+        return latencies
@@ -0,0 +1,83 @@
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from chatapp.fakellm import FakeLLMServer
+from chatapp.management.commands.runworkers import listen, start_workers, stop_workers
+from chatapp.wsclient import WebSocketClient
+
+
+# Throughput of real Daphne worker processes (runworkers) as the worker count
+# grows. Everything runs locally: a throwaway SQLite database and a fake LLM.
+class Command(BaseCommand):
+    help = "Benchmark turn throughput across 1..N Daphne workers (offline, uses a fake LLM)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", default=",".join(str(n) for n in sorted({1, 2, os.cpu_count() or 1})),
+                            help="Comma separated worker counts")
+        parser.add_argument("--sockets", type=int, default=200, help="Concurrent sockets")
+        parser.add_argument("--turns", type=int, default=5, help="Messages sent per socket")
+        parser.add_argument("--latency", type=float, default=0.05, help="Fake LLM latency in seconds")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, SQLITE_PATH=str(Path(directory) / "bench.sqlite3"), OPENAI_API_KEY="fake",
+                       RESPONSE_CACHE_BACKEND="off")
+            subprocess.run([sys.executable, "manage.py", "migrate", "-v", "0"], cwd=settings.BASE_DIR, env=env, check=True)
+            asyncio.run(self.run(env, options))
+
+    async def run(self, env, options):
+        async with FakeLLMServer(latency=options["latency"]) as server:
+            env["OPENAI_BASE_URL"] = server.base_url
+            self.stdout.write(f"{'workers':>7} {'turns':>7} {'turns/s':>8} {'p50 ms':>8} {'p95 ms':>8}")
+            for workers in [int(n) for n in options["workers"].split(",")]:
+                sock = listen("127.0.0.1", 0)
+                url = f"ws://127.0.0.1:{sock.getsockname()[1]}/ws/chat/"
+                processes = start_workers(sock, workers, env=env, verbosity=0)
+                try:
+                    await self.wait_until_ready(sock.getsockname()[1])
+                    started = time.perf_counter()
+                    results = await asyncio.gather(*(
+                        self.drive_socket(url, options["turns"]) for _ in range(options["sockets"])
+                    ))
+                    wall = time.perf_counter() - started
+                finally:
+                    stop_workers(processes)
+                    sock.close()
+
+                latencies = sorted(ms for socket_latencies in results for ms in socket_latencies)
+                p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+                self.stdout.write(
+                    f"{workers:>7} {len(latencies):>7} {len(latencies) / wall:>8.1f} "
+                    f"{statistics.median(latencies):>8.1f} {p95:>8.1f}"
+                )
+
+    async def wait_until_ready(self, port, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                client = await WebSocketClient.connect(f"ws://127.0.0.1:{port}/ws/chat/")
+                await client.receive_json()
+                await client.close()
+                return
+            except (ConnectionError, OSError):
+                await asyncio.sleep(0.2)
+        raise TimeoutError("Workers did not start")
+
+    async def drive_socket(self, url, turns):
+        client = await WebSocketClient.connect(url)
+        await client.receive_json()
+        latencies = []
+        for _ in range(turns):
+            started = time.perf_counter()
+            await client.send_json({"message": "my zip is 1234"})
+            await client.receive_json()
+            latencies.append((time.perf_counter() - started) * 1000)
+        await client.close()
+        return latencies
@@ -0,0 +1,64 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from chatapp import search
+from chatapp.models import ChatMessage, ChatSession
+
+FILLER = ("my zip is the car truck yes no personal business commuting miles days week work drive "
+          "valid license name email thanks sorry again what vehicle blind spot warning").split()
+
+# Common words, a word in about 1 of 1000 messages, and one that never occurs
+QUERIES = {"common": "car", "rare": "hailstorm", "missing": "zeppelin"}
+
+
+# Full-text index against the substring scan the admin used to do. Fills a
+# throwaway database with synthetic transcripts, then times the first page of
+# results for a common, a rare and a missing word with both.
+class Command(BaseCommand):
+    help = "Compare the transcript full-text index with a substring scan (offline, throwaway database)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sessions", type=int, default=2000, help="Sessions to create")
+        parser.add_argument("--messages", type=int, default=50, help="Messages per session")
+        parser.add_argument("--repeat", type=int, default=5, help="Runs per query")
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, options):
+        rng = random.Random(1)
+        sessions = ChatSession.objects.bulk_create(ChatSession() for _ in range(options["sessions"]))
+        started = time.perf_counter()
+        messages = []
+        for session in sessions:
+            for n in range(options["messages"]):
+                words = rng.choices(FILLER, k=rng.randint(3, 15))
+                if rng.random() < 0.001:
+                    words.append(QUERIES["rare"])
+                messages.append(ChatMessage(session=session, role="user" if n % 2 else "assistant", content=" ".join(words)))
+        ChatMessage.objects.bulk_create(messages, batch_size=5000)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"{len(messages)} messages indexed in {elapsed:.1f} s ({len(messages) / elapsed:.0f} rows/s, "
+                          f"{search.backend()} backend)")
+
+        self.stdout.write(f"{'query':<10} {'scan ms':>9} {'index ms':>9} {'speedup':>8}")
+        for name, term in QUERIES.items():
+            scan = self.time(options["repeat"], lambda: list(
+                ChatMessage.objects.filter(content__icontains=term).order_by("-timestamp")[:20]
+            ))
+            index = self.time(options["repeat"], lambda: search.search(term))
+            self.stdout.write(f"{name:<10} {scan:>9.1f} {index:>9.1f} {scan / max(index, 0.001):>7.1f}x")
+
+    def time(self, repeat, query):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            query()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
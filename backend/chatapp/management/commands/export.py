@@ -0,0 +1,59 @@
+import os
+import sys
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from chatapp import export
+
+
+# Completed sessions with their vehicles for downstream quoting. Nightly jobs
+# pass --watermark so each run only exports what completed since the last one.
+class Command(BaseCommand):
+    help = "Stream completed sessions as CSV, JSONL or Parquet"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=export.FORMATS, default="jsonl")
+        parser.add_argument("--messages", action="store_true", help="Include the transcript of each session")
+        parser.add_argument("--since", help="Only sessions completed after this ISO date and time")
+        parser.add_argument("--watermark", help="File holding the completed_at reached by the last run, "
+                                                "read as --since and updated once the export is written")
+        parser.add_argument("--output", help="File to write, stdout by default")
+        parser.add_argument("--chunk-size", type=int, default=export.CHUNK_SIZE, help="Sessions read per query")
+
+    def handle(self, *args, **options):
+        watermark = Path(options["watermark"]) if options["watermark"] else None
+        since = options["since"]
+        if since is None and watermark is not None and watermark.exists():
+            since = watermark.read_text().strip() or None
+        until = export.watermark()
+        try:
+            pieces = export.stream(options["format"], since=export.parse_since(since) if since else None,
+                                   until=until, messages=options["messages"], chunk_size=options["chunk_size"])
+            self.write(pieces, options["format"], options["output"])
+        except export.ExportError as exc:
+            raise CommandError(exc)
+
+        if watermark is not None:
+            watermark.write_text(until.isoformat() + "\n")
+        self.stderr.write(f"Exported sessions completed {'after ' + since if since else 'ever'} up to {until.isoformat()}")
+
+    # A file is written next to its final name and renamed when complete, so a
+    # failed run never leaves half an export behind
+    def write(self, pieces, format, output):
+        binary = format == "parquet"
+        if output is None:
+            for piece in pieces:
+                if binary:
+                    sys.stdout.buffer.write(piece)
+                else:
+                    self.stdout.write(piece, ending="")
+            return
+
+        partial = f"{output}.part"
+        try:
+            with open(partial, "wb") if binary else open(partial, "w", newline="", encoding="utf-8") as file:
+                for piece in pieces:
+                    file.write(piece)
+            os.replace(partial, output)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
@@ -0,0 +1,41 @@
+import datetime
+import json
+from django.core.management.base import BaseCommand, CommandError
+from chatapp import funnel
+
+
+# Where users drop off and how long each step takes, read from the rollup
+class Command(BaseCommand):
+    help = "Show the onboarding funnel per step from the step rollup"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=7, help="Days up to today to include")
+        parser.add_argument("--start", help="First day (YYYY-MM-DD), instead of --days")
+        parser.add_argument("--end", help="Last day (YYYY-MM-DD), defaults to today")
+        parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+        parser.add_argument("--rebuild", action="store_true", help="Recompute the rollup from the step events first")
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            funnel.rebuild()
+        start, end = funnel.last_days(options["days"])
+        try:
+            if options["start"]:
+                start = datetime.date.fromisoformat(options["start"])
+            if options["end"]:
+                end = datetime.date.fromisoformat(options["end"])
+        except ValueError as exc:
+            raise CommandError(exc)
+
+        rows = funnel.report(start, end)
+        if options["json"]:
+            self.stdout.write(json.dumps({"start": str(start), "end": str(end), "steps": rows}, indent=2))
+            return
+
+        self.stdout.write(f"Funnel {start} to {end}")
+        self.stdout.write(f"{'step':<20} {'entries':>8} {'done':>8} {'dropped':>8} {'median s':>9} {'turns':>6} {'retries':>8}")
+        for row in rows:
+            median = "-" if row["median_dwell_seconds"] is None else f"<={row['median_dwell_seconds']}"
+            turns = "-" if row["turns_per_completion"] is None else row["turns_per_completion"]
+            self.stdout.write(f"{row['step']:<20} {row['entries']:>8} {row['completions']:>8} {row['dropped']:>8} "
+                              f"{median:>9} {turns:>6} {row['llm_retries']:>8}")
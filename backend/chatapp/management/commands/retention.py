@@ -0,0 +1,53 @@
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from chatapp import conversations, retention
+
+
+# Scheduled cleanup: archive expired transcripts, delete them in batches, then
+# compact the database. Safe to run as often as wanted, e.g. nightly from cron.
+class Command(BaseCommand):
+    help = "Archive and delete chat transcripts past their retention period, then compact the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only count what would be archived")
+        parser.add_argument("--limit", type=int, help="Sessions to archive at most in this run")
+        parser.add_argument("--batch-size", type=int, help=f"Sessions per batch (RETENTION_BATCH_SIZE, "
+                                                           f"{settings.RETENTION_BATCH_SIZE})")
+        parser.add_argument("--no-compact", action="store_true", help="Skip the vacuum and analyze")
+        parser.add_argument("--full-vacuum", action="store_true",
+                            help="Rewrite the database once so SQLite can vacuum incrementally from then on")
+        parser.add_argument("--show", metavar="SESSION", help="Print the archived transcript of a session and exit")
+
+    def handle(self, *args, **options):
+        if options["show"]:
+            session_id = conversations.parse_session_id(options["show"])
+            if session_id is None:
+                raise CommandError(f"Not a session id: {options['show']}")
+            for message in retention.load(session_id):
+                self.stdout.write(json.dumps(message))
+            return
+
+        if options["dry_run"]:
+            plan = retention.plan()
+            self.stdout.write(f"Would archive {plan['sessions']} sessions, {plan['messages']} messages")
+            return
+
+        try:
+            stats = retention.run(limit=options["limit"], batch_size=options["batch_size"])
+        except retention.RetentionError as exc:
+            raise CommandError(exc)
+        seconds = max(stats["seconds"], 1e-9)
+        ratio = stats["raw_bytes"] / stats["archived_bytes"] if stats["archived_bytes"] else 0
+        self.stdout.write(f"archived       {stats['sessions']} sessions, {stats['messages']} messages "
+                          f"in {stats['batches']} batches, {stats['seconds']:.1f} s")
+        self.stdout.write(f"throughput     {stats['sessions'] / seconds:.0f} sessions/s, {stats['messages'] / seconds:.0f} messages/s")
+        self.stdout.write(f"archive        {stats['archived_bytes']} bytes written to {stats['files']} blocks "
+                          f"({ratio:.1f}x compression, {settings.ARCHIVE_COMPRESSION})")
+
+        if not options["no_compact"]:
+            result = retention.compact(full=options["full_vacuum"])
+            line = f"compact        {result.get('vacuum', 'nothing to do')}, {result['seconds']:.1f} s"
+            if "free_bytes_before" in result:
+                line += f", free pages {result['free_bytes_before']} -> {result['free_bytes_after']} bytes"
+            self.stdout.write(line)
@@ -0,0 +1,72 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+def listen(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+    return sock
+
+
+# Every worker is a full Daphne process accepting from the same inherited socket,
+# the kernel spreads new connections across them
+def start_workers(sock, workers, env=None, verbosity=1):
+    application = settings.ASGI_APPLICATION.replace(".application", ":application")
+    # Each worker budgets its share of the LLM rate limits
+    env = dict(os.environ if env is None else env)
+    env.setdefault("LLM_RATE_WORKERS", str(workers))
+    command = [sys.executable, "-m", "daphne", "-v", str(verbosity), "--fd", str(sock.fileno()), application]
+    return [
+        subprocess.Popen(command, pass_fds=[sock.fileno()], cwd=settings.BASE_DIR, env=env)
+        for _ in range(workers)
+    ]
+
+
+def stop_workers(processes):
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+class Command(BaseCommand):
+    help = "Serve the ASGI application with several Daphne worker processes on one port"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8000)
+
+    def handle(self, *args, **options):
+        sock = listen(options["host"], options["port"])
+        processes = start_workers(sock, options["workers"])
+        self.stdout.write(f"Serving on {options['host']}:{options['port']} with {options['workers']} Daphne workers")
+        if "InMemoryChannelLayer" in settings.CHANNEL_LAYERS["default"]["BACKEND"]:
+            self.stdout.write("Warning: in-memory channel layer, pushes only reach sockets on the same worker (set REDIS_URL)")
+        if "LocMemCache" in settings.CACHES["conversations"]["BACKEND"]:
+            self.stdout.write("Warning: in-memory conversation cache, resumed sessions fall back to the database copy "
+                              "written with each flush (set REDIS_URL)")
+
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+        try:
+            # If a worker dies take the others down too so a supervisor can restart us
+            while all(process.poll() is None for process in processes):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stop_workers(processes)
+            sock.close()
@@ -0,0 +1,129 @@
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from django.conf import settings
+
+# In process metrics, exposed in the Prometheus text format on /metrics.
+# Every Daphne worker keeps its own numbers, scrape each worker separately.
+
+# Phase timings are kept per (step, phase). The last METRICS_SAMPLES
+# observations give the percentiles, count and sum cover the whole lifetime.
+class Summary:
+    def __init__(self, size=None):
+        self.samples = deque(maxlen=size or settings.METRICS_SAMPLES)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+timings = defaultdict(Summary)
+
+# Monotonic totals
+counters = Counter()
+
+# Values that go up and down
+gauges = Counter()
+
+# Model tier decisions per (step, decision): "small" answered by the small
+# model, "escalated" sent on to the large one, "large" routed there directly
+routes = Counter()
+
+
+def observe(step, phase, seconds):
+    timings[step, phase].observe(seconds)
+
+
+@contextmanager
+def timed(step, phase):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(step, phase, time.perf_counter() - started)
+
+
+def percentiles(step, phase):
+    summary = timings[step, phase]
+    return {f"p{round(q * 100)}": summary.quantile(q) for q in QUANTILES}
+
+
+def reset():
+    timings.clear()
+    counters.clear()
+    gauges.clear()
+    routes.clear()
+
+
+def labels(**values):
+    return "{" + ",".join(f'{name}="{value}"' for name, value in values.items()) + "}"
+
+
+# Everything as Prometheus text, including the numbers the LLM pool, the local
+# validators, the response cache and the write buffer already keep
+def render():
+    from . import llm, parsing, ratelimit, resilience, response_cache, validators, writes
+
+    lines = [
+        "# HELP chatbot_phase_seconds Time spent in each phase of a chat turn",
+        "# TYPE chatbot_phase_seconds summary",
+    ]
+    for (step, phase), summary in sorted(timings.items()):
+        for q in QUANTILES:
+            lines.append(f"chatbot_phase_seconds{labels(step=step, phase=phase, quantile=q)} {summary.quantile(q):.6f}")
+        lines.append(f"chatbot_phase_seconds_sum{labels(step=step, phase=phase)} {summary.sum:.6f}")
+        lines.append(f"chatbot_phase_seconds_count{labels(step=step, phase=phase)} {summary.count}")
+
+    for name, value in sorted(counters.items()):
+        lines.append(f"# TYPE chatbot_{name}_total counter")
+        lines.append(f"chatbot_{name}_total {value}")
+    for name, value in sorted(gauges.items()):
+        lines.append(f"# TYPE chatbot_{name} gauge")
+        lines.append(f"chatbot_{name} {value}")
+
+    lines.append("# TYPE chatbot_llm_route_total counter")
+    for (step, decision), value in sorted(routes.items()):
+        lines.append(f"chatbot_llm_route_total{labels(step=step, decision=decision)} {value}")
+
+    lines.append("# TYPE chatbot_llm_breaker_open gauge")
+    for model, is_open in sorted(resilience.breaker_states().items()):
+        lines.append(f"chatbot_llm_breaker_open{labels(model=model)} {int(is_open)}")
+
+    for name, value in ratelimit.stats().items():
+        lines.append(f"# TYPE chatbot_llm_queue_{name} gauge")
+        lines.append(f"chatbot_llm_queue_{name} {value}")
+
+    for name, value in llm.pool_stats().items():
+        lines.append(f"# TYPE chatbot_llm_pool_{name} gauge")
+        lines.append(f"chatbot_llm_pool_{name} {value}")
+
+    lines.append("# TYPE chatbot_validator_total counter")
+    for step, counts in sorted(validators.stats().items()):
+        for result, value in counts.items():
+            lines.append(f"chatbot_validator_total{labels(step=step, result=result)} {value}")
+
+    lines.append("# TYPE chatbot_response_cache_total counter")
+    for step, counts in sorted(response_cache.stats().items()):
+        for result in ("hit", "miss"):
+            lines.append(f"chatbot_response_cache_total{labels(step=step, result=result)} {counts[result]}")
+
+    lines.append("# TYPE chatbot_llm_parse_total counter")
+    for result, value in sorted(parsing.stats().items()):
+        lines.append(f"chatbot_llm_parse_total{labels(result=result)} {value}")
+
+    for name, value in writes.stats.items():
+        lines.append(f"# TYPE chatbot_db_{name}_total counter")
+        lines.append(f"chatbot_db_{name}_total {value}")
+
+    return "\n".join(lines) + "\n"
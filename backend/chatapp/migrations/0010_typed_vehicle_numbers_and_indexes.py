@@ -0,0 +1,113 @@
+import re
+from django.db import migrations, models
+
+NUMBER = re.compile(r"\d[\d,]*(?:\.\d+)?")
+
+
+# "15,000", "12 miles" and "10.5" -> numbers, anything unreadable becomes NULL
+def parse(value, cast):
+    match = NUMBER.search(value or "")
+    if match is None:
+        return None
+    try:
+        return cast(float(match.group().replace(",", "")))
+    except ValueError:
+        return None
+
+
+def copy_numbers(apps, schema_editor):
+    Vehicle = apps.get_model('chatapp', 'Vehicle')
+    db_alias = schema_editor.connection.alias
+    vehicles = list(Vehicle.objects.using(db_alias).all())
+    for vehicle in vehicles:
+        vehicle.commute_days_value = parse(vehicle.commute_days, int)
+        vehicle.commute_miles_value = parse(vehicle.commute_miles, float)
+        vehicle.annual_mileage_value = parse(vehicle.annual_mileage, int)
+    Vehicle.objects.using(db_alias).bulk_update(
+        vehicles, ['commute_days_value', 'commute_miles_value', 'annual_mileage_value'], batch_size=500,
+    )
+
+
+def copy_strings(apps, schema_editor):
+    Vehicle = apps.get_model('chatapp', 'Vehicle')
+    db_alias = schema_editor.connection.alias
+    vehicles = list(Vehicle.objects.using(db_alias).all())
+    for vehicle in vehicles:
+        for field in ['commute_days', 'commute_miles', 'annual_mileage']:
+            value = getattr(vehicle, f'{field}_value')
+            setattr(vehicle, field, None if value is None else f'{value:g}')
+    Vehicle.objects.using(db_alias).bulk_update(vehicles, ['commute_days', 'commute_miles', 'annual_mileage'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0009_message_timestamp_default'),
+    ]
+
+    operations = [
+        # Vehicle numbers move from CharField to numeric columns through temporary fields
+        migrations.AddField(
+            model_name='vehicle',
+            name='commute_days_value',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='commute_miles_value',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='annual_mileage_value',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(copy_numbers, copy_strings),
+        migrations.RemoveField(
+            model_name='vehicle',
+            name='commute_days',
+        ),
+        migrations.RemoveField(
+            model_name='vehicle',
+            name='commute_miles',
+        ),
+        migrations.RemoveField(
+            model_name='vehicle',
+            name='annual_mileage',
+        ),
+        migrations.RenameField(
+            model_name='vehicle',
+            old_name='commute_days_value',
+            new_name='commute_days',
+        ),
+        migrations.RenameField(
+            model_name='vehicle',
+            old_name='commute_miles_value',
+            new_name='commute_miles',
+        ),
+        migrations.RenameField(
+            model_name='vehicle',
+            old_name='annual_mileage_value',
+            new_name='annual_mileage',
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['session', 'timestamp'], name='message_session_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(fields=['-started_at'], name='session_started_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(fields=['is_complete', '-started_at'], name='session_complete_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(fields=['current_step', '-started_at'], name='session_step_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(fields=['session', 'vin'], name='vehicle_session_vin_idx'),
+        ),
+    ]
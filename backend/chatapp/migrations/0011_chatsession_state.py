@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0010_typed_vehicle_numbers_and_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='state',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:13
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0011_chatsession_state'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['-timestamp'], name='message_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(django.db.models.functions.text.Lower('email'), name='session_email_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(django.db.models.functions.text.Lower('full_name'), name='session_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(fields=['zip_code'], name='session_zip_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='llmusage',
+            index=models.Index(fields=['-created_at'], name='usage_created_idx'),
+        ),
+    ]
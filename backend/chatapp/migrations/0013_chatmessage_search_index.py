@@ -0,0 +1,58 @@
+from django.db import migrations
+
+# See chatapp/search.py. The index lives outside the Django models, so it is
+# created per database vendor here.
+
+SQLITE = [
+    """CREATE VIRTUAL TABLE chatapp_chatmessage_fts USING fts5(
+        content, content='chatapp_chatmessage', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER chatapp_chatmessage_fts_insert AFTER INSERT ON chatapp_chatmessage BEGIN
+        INSERT INTO chatapp_chatmessage_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER chatapp_chatmessage_fts_delete AFTER DELETE ON chatapp_chatmessage BEGIN
+        INSERT INTO chatapp_chatmessage_fts(chatapp_chatmessage_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER chatapp_chatmessage_fts_update AFTER UPDATE OF content ON chatapp_chatmessage BEGIN
+        INSERT INTO chatapp_chatmessage_fts(chatapp_chatmessage_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO chatapp_chatmessage_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    # Index the messages already there
+    "INSERT INTO chatapp_chatmessage_fts(chatapp_chatmessage_fts) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS chatapp_chatmessage_fts_insert",
+    "DROP TRIGGER IF EXISTS chatapp_chatmessage_fts_delete",
+    "DROP TRIGGER IF EXISTS chatapp_chatmessage_fts_update",
+    "DROP TABLE IF EXISTS chatapp_chatmessage_fts",
+]
+
+POSTGRES = [
+    "CREATE INDEX IF NOT EXISTS message_content_search_idx ON chatapp_chatmessage USING GIN (to_tsvector('english', content))",
+]
+
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS message_content_search_idx",
+]
+
+
+def run(statements):
+    def apply(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return apply
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0012_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE, 'postgresql': POSTGRES}),
+            run({'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRES_REVERSE}),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:17
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0013_chatmessage_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StepRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('step', models.CharField(max_length=50)),
+                ('entries', models.PositiveIntegerField(default=0)),
+                ('completions', models.PositiveIntegerField(default=0)),
+                ('turns', models.PositiveIntegerField(default=0)),
+                ('llm_retries', models.PositiveIntegerField(default=0)),
+                ('dwell_seconds', models.FloatField(default=0)),
+            ],
+            options={
+                'ordering': ['day', 'step'],
+                'constraints': [models.UniqueConstraint(fields=('day', 'step'), name='rollup_day_step_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StepDwell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('step', models.CharField(max_length=50)),
+                ('bucket', models.PositiveSmallIntegerField()),
+                ('completions', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['day', 'step', 'bucket'],
+                'constraints': [models.UniqueConstraint(fields=('day', 'step', 'bucket'), name='dwell_day_step_bucket_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StepEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('step', models.CharField(blank=True, max_length=50)),
+                ('next_step', models.CharField(max_length=50)),
+                ('entered_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('dwell_seconds', models.FloatField(default=0)),
+                ('turns', models.PositiveIntegerField(default=0)),
+                ('llm_retries', models.PositiveIntegerField(default=0)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='step_events', to='chatapp.chatsession')),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['session', 'created_at'], name='event_session_time_idx'), models.Index(fields=['created_at'], name='event_time_idx')],
+            },
+        ),
+    ]
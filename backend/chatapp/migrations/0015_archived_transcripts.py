@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:21
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0014_step_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTranscript',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('path', models.CharField(max_length=200)),
+                ('offset', models.BigIntegerField()),
+                ('length', models.BigIntegerField()),
+                ('messages', models.PositiveIntegerField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archives', to='chatapp.chatsession')),
+            ],
+            options={
+                'ordering': ['archived_at'],
+                'indexes': [models.Index(fields=['session', 'archived_at'], name='archive_session_idx')],
+            },
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models.functions import Lower
+from django.utils import timezone
 
 # Create your models here.
 from django.contrib.auth.models import User
@@ -18,27 +20,130 @@ class ChatSession(models.Model):
     
     current_step = models.CharField(max_length=50, default='zip')
     is_complete = models.BooleanField(default=False)
+    # Snapshot of the consumer state so a dropped connection can resume (see conversations.py)
+    state = models.JSONField(null=True, blank=True, editable=False)
     
     class Meta:
         ordering = ['-started_at']
+        # Match the admin changelist: newest first, optionally filtered by completion or step
+        indexes = [
+            models.Index(fields=['-started_at'], name='session_started_idx'),
+            models.Index(fields=['is_complete', '-started_at'], name='session_complete_idx'),
+            models.Index(fields=['current_step', '-started_at'], name='session_step_idx'),
+            # Admin search, see ChatSessionAdmin.get_search_results
+            models.Index(Lower('email'), name='session_email_idx'),
+            models.Index(Lower('full_name'), name='session_name_idx'),
+            models.Index(fields=['zip_code'], name='session_zip_idx'),
+        ]
 
 class ChatMessage(models.Model):
     session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='messages')
     role = models.CharField(max_length=10, choices=[('user', 'User'), ('assistant', 'Assistant')])
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the message is sent, not when the write buffer flushes it
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['session', 'timestamp'], name='message_session_time_idx'),
+            # Newest first message changelist
+            models.Index(fields=['-timestamp'], name='message_time_idx'),
+        ]
 
 class Vehicle(models.Model):
     session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='vehicles')
     vin = models.CharField(max_length=200)
     use_type = models.CharField(max_length=50)
     blind_spot = models.CharField(max_length=20)
-    commute_days = models.CharField(max_length=50, null=True, blank=True)
-    commute_miles = models.CharField(max_length=50, null=True, blank=True)
-    annual_mileage = models.CharField(max_length=50, null=True, blank=True)
+    commute_days = models.PositiveSmallIntegerField(null=True, blank=True)
+    commute_miles = models.FloatField(null=True, blank=True)
+    annual_mileage = models.PositiveIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     class Meta:
-        ordering = ['vin']
\ No newline at end of file
+        ordering = ['vin']
+        indexes = [
+            models.Index(fields=['session', 'vin'], name='vehicle_session_vin_idx'),
+        ]
+
+# Token usage of one LLM call, recorded per step to track input cost and prompt cache hits
+class LLMUsage(models.Model):
+    session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='llm_usage')
+    step = models.CharField(max_length=50)
+    model = models.CharField(max_length=50)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    cached_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], name='usage_created_idx'),
+        ]
+
+# One row each time a session moves to another step, append only. step is ""
+# for the start of a session and next_step "complete" at the end, see funnel.py
+class StepEvent(models.Model):
+    session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='step_events')
+    step = models.CharField(max_length=50, blank=True)
+    next_step = models.CharField(max_length=50)
+    entered_at = models.DateTimeField()
+    created_at = models.DateTimeField(default=timezone.now)
+    dwell_seconds = models.FloatField(default=0)
+    turns = models.PositiveIntegerField(default=0)
+    llm_retries = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['session', 'created_at'], name='event_session_time_idx'),
+            models.Index(fields=['created_at'], name='event_time_idx'),
+        ]
+
+# Per day and step totals of the events, kept up to date as they are written
+class StepRollup(models.Model):
+    day = models.DateField()
+    step = models.CharField(max_length=50)
+    entries = models.PositiveIntegerField(default=0)
+    completions = models.PositiveIntegerField(default=0)
+    turns = models.PositiveIntegerField(default=0)
+    llm_retries = models.PositiveIntegerField(default=0)
+    dwell_seconds = models.FloatField(default=0)
+
+    class Meta:
+        ordering = ['day', 'step']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'step'], name='rollup_day_step_unique'),
+        ]
+
+# Completions per funnel.DWELL_BUCKETS bucket of a day and step, for the median.
+# A row per bucket so flushes can add to it with a plain UPDATE.
+class StepDwell(models.Model):
+    day = models.DateField()
+    step = models.CharField(max_length=50)
+    bucket = models.PositiveSmallIntegerField()
+    completions = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['day', 'step', 'bucket']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'step', 'bucket'], name='dwell_day_step_bucket_unique'),
+        ]
+
+# Where an archived transcript went, see retention.py. Each row points at one
+# compressed block of a per-day archive file holding the session's messages.
+class ArchivedTranscript(models.Model):
+    session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='archives')
+    day = models.DateField()
+    path = models.CharField(max_length=200)
+    offset = models.BigIntegerField()
+    length = models.BigIntegerField()
+    messages = models.PositiveIntegerField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['archived_at']
+        indexes = [
+            models.Index(fields=['session', 'archived_at'], name='archive_session_idx'),
+        ]
@@ -0,0 +1,54 @@
+import json
+from collections import Counter
+
+# Tolerant reading of completion text. Structured outputs make clean JSON the
+# normal case, but a model can still wrap the object in a code fence or a
+# sentence. Rather than failing the turn the first JSON object in the text is
+# salvaged, and only text without one is reported as a failure.
+
+# "clean", "salvaged", "failed" and "invalid" (no message) parses, exposed on /metrics
+counters = Counter()
+
+DECODER = json.JSONDecoder()
+
+# Sent back with the unreadable reply when the consumer asks for a repair
+REPAIR_PROMPT = "Your last reply was not a valid JSON object. Reply again with only the JSON object in the required format and no other text."
+
+
+def extract_json(text):
+    try:
+        parsed = json.loads(text)
+    except ValueError:
+        parsed = None
+    if isinstance(parsed, dict):
+        counters["clean"] += 1
+        return parsed
+
+    # Try every "{" in turn, raw_decode stops at the end of the object so
+    # fences, prose and trailing text around it do not matter
+    start = text.find("{")
+    while start != -1:
+        try:
+            parsed, _ = DECODER.raw_decode(text, start)
+        except ValueError:
+            parsed = None
+        if isinstance(parsed, dict):
+            counters["salvaged"] += 1
+            return parsed
+        start = text.find("{", start + 1)
+
+    counters["failed"] += 1
+    raise ValueError(f"No JSON object in completion: {text[:200]!r}")
+
+
+# A step reply has to carry the text for the user
+def extract_reply(text):
+    parsed = extract_json(text)
+    if not isinstance(parsed.get("message"), str):
+        counters["invalid"] += 1
+        raise ValueError("Completion has no message")
+    return parsed
+
+
+def stats():
+    return dict(counters)
@@ -0,0 +1,150 @@
+import asyncio
+import heapq
+import itertools
+import time
+import weakref
+from collections import Counter
+from django.conf import settings
+from . import metrics
+
+# Client side budget for the provider's requests-per-minute (LLM_RPM) and
+# tokens-per-minute (LLM_TPM) quotas, so a burst queues here instead of every
+# socket getting a 429 at once. Calls that have to wait are served by priority
+# (LLM_PRIORITY=progress lets sessions close to completion go first), then by
+# how many turns their session already had, so one busy session cannot starve
+# the others. The budget is split evenly between LLM_RATE_WORKERS processes.
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        # Units per second, 0 means unlimited
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Seconds until `amount` can be taken
+    def wait_time(self, amount):
+        if not self.rate:
+            return 0.0
+        self.refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        if self.rate:
+            self.tokens -= amount
+
+    # Give back (or charge) the difference once the real amount is known
+    def adjust(self, amount):
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    def __init__(self, rpm, tpm, burst=None, workers=None):
+        burst = settings.LLM_RATE_BURST if burst is None else burst
+        share = 1 / max(workers or settings.LLM_RATE_WORKERS, 1)
+        request_rate, token_rate = rpm * share / 60, tpm * share / 60
+        # A full bucket allows `burst` seconds worth of calls at once
+        self.requests = TokenBucket(request_rate, max(1, request_rate * burst))
+        self.tokens = TokenBucket(token_rate, max(1, token_rate * burst))
+        self.queue = []
+        self.order = itertools.count()
+        # Turns granted or queued per session, for the fair share
+        self.turns = Counter()
+        self.dispatcher = None
+
+    def wait_time(self, tokens):
+        return max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+    def grant(self, tokens):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+
+    async def acquire(self, tokens, session=None, priority=0):
+        started = time.perf_counter()
+        self.turns[session] += 1
+        if not self.queue and self.wait_time(tokens) == 0:
+            self.grant(tokens)
+            metrics.observe("all", "llm_queue", 0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.queue, (-priority, self.turns[session], next(self.order), tokens, future))
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.ensure_future(self.dispatch())
+        try:
+            await future
+        finally:
+            metrics.observe("all", "llm_queue", time.perf_counter() - started)
+
+    # Hands out the budget to the head of the queue as it refills. Waiters
+    # that gave up (their deadline passed) are cancelled and skipped.
+    async def dispatch(self):
+        while self.queue:
+            *_, tokens, future = self.queue[0]
+            if future.done():
+                heapq.heappop(self.queue)
+                continue
+            wait = self.wait_time(tokens)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            heapq.heappop(self.queue)
+            self.grant(tokens)
+            future.set_result(None)
+
+    # Correct the token bucket with the usage the provider reported
+    def settle(self, estimate, actual):
+        self.tokens.adjust(estimate - actual)
+
+    def forget(self, session):
+        self.turns.pop(session, None)
+
+    def queued(self):
+        return sum(1 for *_, future in self.queue if not future.done())
+
+
+# One limiter per event loop, like the concurrency semaphore in llm.py
+_limiters = weakref.WeakKeyDictionary()
+
+
+def enabled():
+    return bool(settings.LLM_RPM or settings.LLM_TPM)
+
+
+def get_limiter():
+    loop = asyncio.get_running_loop()
+    limiter = _limiters.get(loop)
+    if limiter is None:
+        limiter = _limiters[loop] = RateLimiter(settings.LLM_RPM, settings.LLM_TPM)
+    return limiter
+
+
+def forget(session):
+    for limiter in list(_limiters.values()):
+        limiter.forget(session)
+
+
+def reset():
+    _limiters.clear()
+
+
+# Rough prompt size (4 characters per token) plus the expected reply
+def estimate_tokens(messages):
+    prompt = sum(len(message.get("content") or "") for message in messages) // 4
+    return prompt + settings.LLM_COMPLETION_TOKENS_ESTIMATE
+
+
+def stats():
+    limiters = list(_limiters.values())
+    return {
+        "queued": sum(limiter.queued() for limiter in limiters),
+        "sessions": sum(len(limiter.turns) for limiter in limiters),
+    }
@@ -0,0 +1,133 @@
+import asyncio
+import random
+import time
+from django.conf import settings
+from openai import APIConnectionError, APIStatusError, APITimeoutError
+from . import metrics
+
+# Failure handling for LLM calls, used by LLMClient. Retries are done here
+# instead of in the SDK so backoff, the per-call deadline, the circuit breaker
+# and hedging all see the same attempts.
+
+# Deterministic reply for a turn the LLM could not answer, the state is left as it was
+FALLBACK_MESSAGE = "Sorry, I'm having trouble answering right now. Please send that again in a moment."
+
+
+# Raised by LLMClient when a completion failed for good, the consumer answers
+# with FALLBACK_MESSAGE instead of dropping the socket
+class LLMUnavailable(Exception):
+    pass
+
+
+class CircuitOpen(LLMUnavailable):
+    pass
+
+
+# Consecutive provider failures open the breaker for LLM_BREAKER_COOLDOWN
+# seconds, calls fail fast meanwhile. After the cooldown a single probe call
+# goes through and closes it again if it succeeds.
+class CircuitBreaker:
+    def __init__(self, threshold=None, cooldown=None):
+        self.threshold = threshold or settings.LLM_BREAKER_THRESHOLD
+        self.cooldown = settings.LLM_BREAKER_COOLDOWN if cooldown is None else cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if self.probing or time.monotonic() - self.opened_at < self.cooldown:
+            return False
+        self.probing = True
+        return True
+
+    # The probe ended without a verdict on the provider (queued past the deadline, rejected
+    # request, cancelled), the next call probes instead
+    def release(self):
+        self.probing = False
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.failures >= self.threshold:
+            if self.opened_at is None:
+                metrics.counters["llm_breaker_opened"] += 1
+            self.opened_at = time.monotonic()
+
+
+# One breaker per model, so a stalled small model does not block the large one
+_breakers = {}
+
+
+def get_breaker(model):
+    breaker = _breakers.get(model)
+    if breaker is None:
+        breaker = _breakers[model] = CircuitBreaker()
+    return breaker
+
+
+def breaker_states():
+    return {model: breaker.is_open for model, breaker in _breakers.items()}
+
+
+def reset():
+    _breakers.clear()
+
+
+# Rate limits, server errors, dropped connections and timeouts are worth another try
+def retryable(exc):
+    if isinstance(exc, (APITimeoutError, APIConnectionError, asyncio.TimeoutError)):
+        return True
+    return isinstance(exc, APIStatusError) and (exc.status_code == 429 or exc.status_code >= 500)
+
+
+# Exponential backoff with full jitter, at least what a Retry-After header asks for
+def backoff(attempt, exc=None):
+    delay = random.uniform(0, min(settings.LLM_BACKOFF_MAX, settings.LLM_BACKOFF_BASE * 2 ** attempt))
+    response = getattr(exc, "response", None)
+    try:
+        retry_after = float(response.headers.get("retry-after", 0)) if response is not None else 0
+    except ValueError:
+        retry_after = 0
+    return max(delay, min(retry_after, settings.LLM_BACKOFF_MAX))
+
+
+# Runs request() and, if it has not finished after `delay` seconds, a second
+# copy of it. The first successful result wins and the other is cancelled.
+async def hedge(request, delay):
+    first = asyncio.ensure_future(request())
+    tasks = [first]
+    try:
+        if not delay:
+            return await first
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            return first.result()
+
+        metrics.counters["llm_hedges"] += 1
+        tasks.append(asyncio.ensure_future(request()))
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not first:
+                        metrics.counters["llm_hedges_won"] += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,48 @@
+import hashlib
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import caches
+from .steps import STEPS
+
+# Memoizes parsed LLM replies so byte-identical answers to the same prompt are
+# served without another completion. Entries live in the Django cache named by
+# RESPONSE_CACHE (see CACHES in settings), which decides the backend, the TTL
+# and how many entries are kept. The memory backend evicts the least recently
+# used entries, the file backend a random share of them once it is full.
+# The file backend does disk I/O, so only the async cache API is used here.
+
+# Per step counters: "hit" means the reply came from the cache
+counters = defaultdict(lambda: {"hit": 0, "miss": 0})
+
+
+def enabled():
+    return bool(settings.RESPONSE_CACHE)
+
+
+def make_key(step, prompt, input):
+    # The prompt hash is the prompt version, editing a prompt invalidates its entries
+    version = hashlib.sha256(prompt.encode()).hexdigest()[:16]
+    normalised = " ".join(input.split())
+    # "Yes" and "yes" are the same answer, except where the reply repeats the user's text
+    if not getattr(STEPS.get(step), "case_sensitive", False):
+        normalised = normalised.casefold()
+    digest = hashlib.sha256(normalised.encode()).hexdigest()
+    return f"llm:{step}:{version}:{digest}"
+
+
+async def get(step, prompt, input):
+    parsed = await caches[settings.RESPONSE_CACHE].aget(make_key(step, prompt, input))
+    counters[step]["hit" if parsed is not None else "miss"] += 1
+    return parsed
+
+
+async def set(step, prompt, input, parsed):
+    await caches[settings.RESPONSE_CACHE].aset(make_key(step, prompt, input), parsed)
+
+
+def stats():
+    result = {}
+    for step, counts in counters.items():
+        total = counts["hit"] + counts["miss"]
+        result[step] = dict(counts, hit_rate=counts["hit"] / total if total else 0.0)
+    return result
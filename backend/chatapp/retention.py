@@ -0,0 +1,224 @@
+import datetime
+import gzip
+import json
+import os
+import time
+from collections import Counter, defaultdict
+from importlib.util import find_spec
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from .models import ArchivedTranscript, ChatMessage, ChatSession
+from .search import FTS_TABLE
+
+# Retention of chat transcripts, run by the retention command.
+#
+# Expired transcripts are written to one archive file per day (the day the
+# session completed, or started for abandoned ones), as JSON lines of
+# {"session", "complete", "started_at", "completed_at", "messages"}. Each batch
+# appends one compressed block to the file. gzip and zstd both read
+# concatenated blocks as one stream, so the files also work with zcat/zstdcat.
+# ArchivedTranscript records the block of every session, load() reads it back.
+#
+# Only after the block is on disk are the messages deleted, one batch per
+# transaction, and compact() then hands the space back to the file system.
+
+CODECS = {
+    "gzip": ".jsonl.gz",
+    "zstd": ".jsonl.zst",
+}
+
+
+class RetentionError(Exception):
+    pass
+
+
+def check_codec(name):
+    if name not in CODECS:
+        raise RetentionError(f"Unknown ARCHIVE_COMPRESSION {name!r}, use one of {', '.join(CODECS)}")
+    if name == "zstd" and find_spec("zstandard") is None:
+        raise RetentionError("zstd archives need the optional zstandard package (pip install zstandard)")
+
+
+def compress(data, codec):
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor().compress(data)
+    return gzip.compress(data)
+
+
+def decompress(data, codec):
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def codec_of(path):
+    return next(name for name, extension in CODECS.items() if path.endswith(extension))
+
+
+# Sessions whose transcript is past its TTL and still in the database
+def expired(now=None):
+    now = now or timezone.now()
+    rules = Q()
+    if settings.RETENTION_COMPLETED_DAYS:
+        rules |= Q(is_complete=True, completed_at__lt=now - datetime.timedelta(days=settings.RETENTION_COMPLETED_DAYS))
+    if settings.RETENTION_ABANDONED_DAYS:
+        rules |= Q(is_complete=False, started_at__lt=now - datetime.timedelta(days=settings.RETENTION_ABANDONED_DAYS))
+    if not rules:
+        return ChatSession.objects.none()
+    return (
+        ChatSession.objects.filter(rules)
+        .filter(Exists(ChatMessage.objects.filter(session=OuterRef("pk"))))
+        .order_by("started_at")
+    )
+
+
+def archive_day(session):
+    return timezone.localdate(session.completed_at if session.is_complete and session.completed_at else session.started_at)
+
+
+def archive_path(day, codec):
+    return os.path.join(f"{day:%Y}", f"{day:%m}", f"{day.isoformat()}{CODECS[codec]}")
+
+
+# Append one compressed block to an archive file, returns where it starts
+def append(path, block):
+    full = os.path.join(settings.ARCHIVE_DIR, path)
+    os.makedirs(os.path.dirname(full), exist_ok=True)
+    with open(full, "ab") as file:
+        offset = file.seek(0, os.SEEK_END)
+        file.write(block)
+        file.flush()
+        os.fsync(file.fileno())
+    return offset
+
+
+# Archive and delete the transcripts of one batch of sessions
+def archive_batch(sessions, codec, stats):
+    ids = [session.id for session in sessions]
+    transcripts = defaultdict(list)
+    last_id = 0
+    for message in ChatMessage.objects.filter(session_id__in=ids).order_by("session_id", "timestamp", "id").iterator():
+        transcripts[message.session_id].append(
+            {"role": message.role, "content": message.content, "timestamp": message.timestamp.isoformat()}
+        )
+        last_id = max(last_id, message.id)
+
+    by_day = defaultdict(list)
+    for session in sessions:
+        if transcripts[session.id]:
+            by_day[archive_day(session)].append(session)
+
+    index = []
+    for day, day_sessions in sorted(by_day.items()):
+        lines = "".join(json.dumps({
+            "session": str(session.id),
+            "complete": session.is_complete,
+            "started_at": session.started_at.isoformat(),
+            "completed_at": session.completed_at.isoformat() if session.completed_at else None,
+            "messages": transcripts[session.id],
+        }, separators=(",", ":")) + "\n" for session in day_sessions).encode()
+        block = compress(lines, codec)
+        path = archive_path(day, codec)
+        offset = append(path, block)
+        stats["files"] += 1
+        stats["raw_bytes"] += len(lines)
+        stats["archived_bytes"] += len(block)
+        index += [
+            ArchivedTranscript(session=session, day=day, path=path, offset=offset, length=len(block),
+                               messages=len(transcripts[session.id]))
+            for session in day_sessions
+        ]
+
+    # Messages written after they were read (a resumed session) are left for the next run
+    with transaction.atomic():
+        ArchivedTranscript.objects.bulk_create(index)
+        deleted, _ = ChatMessage.objects.filter(session_id__in=ids, id__lte=last_id).delete()
+    stats["sessions"] += len(index)
+    stats["messages"] += deleted
+
+
+# Archives and deletes everything expired, `limit` sessions at most. Returns
+# the counts and the seconds spent.
+def run(limit=None, batch_size=None, now=None):
+    codec = settings.ARCHIVE_COMPRESSION
+    check_codec(codec)
+    batch_size = batch_size or settings.RETENTION_BATCH_SIZE
+    stats = Counter()
+    started = time.perf_counter()
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        # Done sessions drop out of expired(), so the head of the query is always the next batch
+        sessions = list(expired(now).only("id", "is_complete", "started_at", "completed_at")[:size])
+        if not sessions:
+            break
+        archive_batch(sessions, codec, stats)
+        stats["batches"] += 1
+        if remaining is not None:
+            remaining -= len(sessions)
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+
+# What a run would do, without touching anything
+def plan(now=None):
+    sessions = expired(now)
+    return {
+        "sessions": sessions.count(),
+        "messages": ChatMessage.objects.filter(session__in=sessions.values("pk")).count(),
+    }
+
+
+# Archived messages of a session, oldest first
+def load(session_id):
+    messages = []
+    for entry in ArchivedTranscript.objects.filter(session_id=session_id):
+        with open(os.path.join(settings.ARCHIVE_DIR, entry.path), "rb") as file:
+            file.seek(entry.offset)
+            block = file.read(entry.length)
+        for line in decompress(block, codec_of(entry.path)).splitlines():
+            transcript = json.loads(line)
+            if transcript["session"] == str(session_id):
+                messages += transcript["messages"]
+    return messages
+
+
+def sqlite_pragma(cursor, name):
+    cursor.execute(f"PRAGMA {name}")
+    return cursor.fetchone()[0]
+
+
+# Give the space of deleted rows back and refresh the planner statistics.
+# On SQLite pages are freed with incremental_vacuum, which needs
+# auto_vacuum=INCREMENTAL. Switching an existing database over takes one
+# full VACUUM, done only when `full` is set since it rewrites the whole file.
+def compact(full=False):
+    result = {}
+    started = time.perf_counter()
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            page_size = sqlite_pragma(cursor, "page_size")
+            result["free_bytes_before"] = sqlite_pragma(cursor, "freelist_count") * page_size
+            if sqlite_pragma(cursor, "auto_vacuum") != 2 and full:
+                cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                cursor.execute("VACUUM")
+                result["vacuum"] = "full"
+            elif sqlite_pragma(cursor, "auto_vacuum") == 2:
+                cursor.execute("PRAGMA incremental_vacuum")
+                cursor.fetchall()
+                result["vacuum"] = "incremental"
+            else:
+                result["vacuum"] = "skipped, auto_vacuum is not INCREMENTAL (run once with --full-vacuum)"
+            # Merge the full-text index segments left by the deletes
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+            cursor.execute("ANALYZE")
+            result["free_bytes_after"] = sqlite_pragma(cursor, "freelist_count") * page_size
+        elif connection.vendor == "postgresql":
+            cursor.execute(f"VACUUM {'FULL ' if full else ''}ANALYZE chatapp_chatmessage")
+            result["vacuum"] = "full" if full else "vacuum analyze"
+    result["seconds"] = time.perf_counter() - started
+    return result
@@ -0,0 +1,107 @@
+import re
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from .models import ChatMessage
+
+# Full-text search over chat transcripts. The index is kept by the database
+# itself, so every row the write buffer inserts is searchable once committed:
+#
+#   sqlite    an FTS5 table (chatapp_chatmessage_fts) with external content,
+#             synced by insert/update/delete triggers on chatapp_chatmessage
+#   postgres  a GIN index on to_tsvector('english', content)
+#
+# Both are created by migration 0013. Any other database falls back to a
+# substring scan. Note that a SQLite migration which rebuilds the
+# chatapp_chatmessage table drops the triggers, add them back in that migration.
+
+FTS_TABLE = "chatapp_chatmessage_fts"
+
+# Text search configuration on PostgreSQL, SQLite stems with the porter tokenizer
+CONFIG = "english"
+
+WORDS = re.compile(r"\w+")
+
+MAX_PER_PAGE = 100
+
+
+def backend():
+    return connection.vendor if connection.vendor in ("sqlite", "postgresql") else "scan"
+
+
+# Every word has to match. On SQLite each word is quoted so FTS5 operators
+# and punctuation in what ops type cannot break the query.
+def fts_query(text):
+    words = WORDS.findall(text)
+    return " ".join(f'"{word}"' for word in words) if words else None
+
+
+# Limit a ChatMessage queryset to the messages matching `text`, for the admin
+def filter_messages(queryset, text):
+    query = fts_query(text)
+    if query is None:
+        return queryset.none()
+    if backend() == "sqlite":
+        return queryset.filter(pk__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [query]))
+    if backend() == "postgresql":
+        return queryset.filter(pk__in=RawSQL(
+            f"SELECT id FROM chatapp_chatmessage WHERE to_tsvector('{CONFIG}', content) @@ plainto_tsquery('{CONFIG}', %s)",
+            [text],
+        ))
+    return queryset.filter(content__icontains=text)
+
+
+# Ranked matches, best first. Returns (hits, has_next), one row more than a
+# page is read instead of counting every match.
+def search(text, page=1, per_page=20, role=None):
+    query = fts_query(text)
+    if query is None:
+        return [], False
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    offset = (max(page, 1) - 1) * per_page
+
+    if backend() == "scan":
+        messages = ChatMessage.objects.filter(content__icontains=text).order_by("-timestamp")
+        if role:
+            messages = messages.filter(role=role)
+        found = list(messages[offset:offset + per_page + 1])
+        rows = [(message.id, message.content[:200], 0.0) for message in found]
+        messages = {message.id: message for message in found}
+    else:
+        role_filter = "AND m.role = %s" if role else ""
+        if backend() == "sqlite":
+            sql = f"""
+                SELECT m.id, snippet({FTS_TABLE}, 0, '[', ']', '...', 12), -bm25({FTS_TABLE}) AS score
+                FROM {FTS_TABLE} JOIN chatapp_chatmessage m ON m.id = {FTS_TABLE}.rowid
+                WHERE {FTS_TABLE} MATCH %s {role_filter}
+                ORDER BY score DESC LIMIT %s OFFSET %s
+            """
+            params = [query]
+        else:
+            sql = f"""
+                SELECT m.id, ts_headline('{CONFIG}', m.content, q, 'StartSel=[, StopSel=], MaxWords=24, MinWords=8'),
+                       ts_rank(to_tsvector('{CONFIG}', m.content), q) AS score
+                FROM chatapp_chatmessage m, plainto_tsquery('{CONFIG}', %s) q
+                WHERE to_tsvector('{CONFIG}', m.content) @@ q {role_filter}
+                ORDER BY score DESC LIMIT %s OFFSET %s
+            """
+            params = [text]
+        params += ([role] if role else []) + [per_page + 1, offset]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        # Typed columns through the ORM, the raw rows only carry what the index computed
+        messages = ChatMessage.objects.only("session_id", "role", "timestamp").in_bulk([row[0] for row in rows[:per_page]])
+
+    hits = [
+        {
+            "message": message_id,
+            "session": str(messages[message_id].session_id),
+            "role": messages[message_id].role,
+            "snippet": snippet,
+            "timestamp": messages[message_id].timestamp.isoformat(),
+            "rank": round(float(rank), 4),
+        }
+        for message_id, snippet, rank in rows[:per_page]
+        if message_id in messages
+    ]
+    return hits, len(rows) > per_page
@@ -0,0 +1,399 @@
+from django.conf import settings
+from . import validators
+
+# Declarative onboarding flow. Each Step holds its prebuilt system prompt, the
+# key the LLM (or local validator) returns the answer under, where that answer
+# is stored, and a transition that picks the next step. The consumer only
+# looks up STEPS[state["step"]], so steps can be added or reordered here.
+
+# Returned by a transition when onboarding is finished
+COMPLETE = "complete"
+
+ZIP_PROMPT = """You are a ZIP code validator. You MUST validate strictly.
+
+        VALIDATION RULES:
+        1. MUST be EXACTLY 5 digits - no more, no less
+        2. MUST contain ONLY numbers (0-9)
+        3. "1234" is INVALID (only 4 digits)
+        4. "123456" is INVALID (6 digits)
+        5. "12a45" is INVALID (contains letter)
+
+        Count the digits carefully. If it's not exactly 5 digits, it's invalid.
+
+        Response format (JSON only):
+        {"message": "your message", "valid": true/false, "zip": "value only if valid"}
+
+        Examples:
+        - Input "1234" → {"message": "That's only 4 digits. Please enter a 5-digit ZIP code.", "valid": false}
+        - Input "12345" → {"message": "Perfect! What's your full name?", "valid": true, "zip": "12345"}
+        - Input "123456" → {"message": "That's 6 digits. ZIP codes need exactly 5 digits.", "valid": false}"""
+
+NAME_PROMPT = """You collect and validate full names for onboarding.
+
+    VALIDATION RULES:
+    1. Must include both first and last name
+    2. Each name should be at least 2 characters
+    3. Only letters, spaces, hyphens, and apostrophes allowed inside the name
+    4. No numbers or special characters besides hyphen and apostrophe
+    5. Names Can't have vulgar language in them
+
+    Response format (JSON only):
+    {"message": "your message", "valid": true/false, "name": "full name only if valid"}
+
+    Examples:
+    - Input "John" → {"message": "I need both your first and last name. Could you provide your full name?", "valid": false}
+    - Input "John Smith" → {"message": "Thanks, John! Now I need your email address.", "valid": true, "name": "John Smith"}
+    - Input "Mary-Jane O'Brien" → {"message": "Nice to meet you, Mary-Jane! What's your email address?", "valid": true, "name": "Mary-Jane O'Brien"}
+    - Input "John123" → {"message": "Names shouldn't contain numbers. Please enter your full name using only letters.", "valid": false}"""
+
+EMAIL_PROMPT = """You collect and validate email addresses for onboarding.
+
+        VALIDATION RULES:
+        1. Must have @ symbol
+        2. Must have domain (e.g., .com, .org, .edu)
+        3. Must have text before and after @
+        4. No spaces allowed
+        5. Standard email format: username@domain.extension
+
+        Response format (JSON only):
+        {"message": "your message", "valid": true/false, "email": "email only if valid"}
+
+        Examples:
+        - Input "john@gmail.com" → {"message": "Great! Now let's add your vehicle information. Do you want to add a vehicle?", "valid": true, "email": "john@gmail.com"}
+        - Input "sarah.smith@company.org" → {"message": "Perfect! Ready to add vehicle details. Would you like to add a vehicle?", "valid": true, "email": "sarah.smith@company.org"}
+        - Input "notanemail" → {"message": "That doesn't look like a valid email. Please include an @ symbol and domain.", "valid": false}
+        - Input "john@" → {"message": "Your email seems incomplete. Please provide the full email address including the domain.", "valid": false}
+        - Input "john smith@gmail.com" → {"message": "Email addresses can't contain spaces. Please enter a valid email.", "valid": false}"""
+
+ADD_VEHICLE_PROMPT = """You ask if the user wants to add a vehicle and interpret their response.
+
+        TASK: Determine if the user wants to add a vehicle or skip to license information.
+
+        Interpret YES responses: "yes", "yeah", "sure", "ok", "y", "yep", "definitely", "I do", "let's do it", etc.
+        Interpret NO responses: "no", "nope", "n", "not now", "skip", "no thanks", "later", "I don't", etc.
+
+        Response format (JSON only):
+        If they want to add a vehicle: {"message": "your message asking for VIN or Year/Make/Model/Body Type", "valid": true, "add_vehicle": true}
+        If they don't want to add: {"message": "your message moving to license type question", "valid": true, "no_vehicle": true}
+        If unclear: {"message": "your message asking for clarification", "valid": false}
+
+        Examples:
+        - Input "yes" → {"message": "Great! Please provide your vehicle's VIN or the Year, Make, Model, and Body Type.", "valid": true, "add_vehicle": true}
+        - Input "no" → {"message": "No problem! Now I need to know your US License Type. Is it Foreign, Personal, or Commercial?", "valid": true, "no_vehicle": true}
+        - Input "sure thing" → {"message": "Perfect! I'll need either your vehicle's VIN number or the Year, Make, Model, and Body Type.", "valid": true, "add_vehicle": true}
+        - Input "maybe" → {"message": "I need a yes or no answer. Would you like to add a vehicle now?", "valid": false}"""
+
+VEHICLE_VIN_PROMPT = """You collect vehicle identification information.
+
+        Accept EITHER:
+        1. A VIN (Vehicle Identification Number) - 17 characters
+        2. Year, Make, Model, and Body Type (all four required)
+
+        Response format (JSON only):
+        {"message": "your message", "valid": true/false, "vin": "the VIN or year/make/model/body info"}
+
+        Examples:
+        - Input "1HGBH41JXMN109186" → {"message": "Got it! How is this vehicle primarily used? (commuting, commercial, farming, or business)", "valid": true, "vin": "1HGBH41JXMN109186"}
+        - Input "2022 Honda Civic Sedan" → {"message": "Perfect! How do you primarily use this 2022 Honda Civic? (commuting, commercial, farming, or business)", "valid": true, "vin": "2022 Honda Civic Sedan"}
+        - Input "Honda Civic" → {"message": "I need more details. Please provide either a VIN or the Year, Make, Model, and Body Type.", "valid": false}"""
+
+VEHICLE_USE_PROMPT = """You collect vehicle use type.
+
+        Valid uses: commuting, commercial, farming, business (accept variations)
+
+        Response format (JSON only):
+        {"message": "your message asking about blind spot warning", "valid": true/false, "use": "commuting/commercial/farming/business"}
+
+        IMPORTANT: After validating the use type, immediately ask "Does this vehicle have blind spot warning equipped? (yes or no)"
+
+        Examples:
+        - Input "commuting" → {"message": "Does this vehicle have blind spot warning equipped? (yes or no)", "valid": true, "use": "commuting"}
+        - Input "I use it for work" → {"message": "Is this for commuting to work or commercial/business use?", "valid": false}
+        - Input "commercial" → {"message": "Got it, commercial use. Is this vehicle equipped with blind spot warning? (yes or no)", "valid": true, "use": "commercial"}
+        - Input "farming" → {"message": "Got it, farming use. Does this vehicle have blind spot warning equipped? (yes or no)", "valid": true, "use": "farming"}
+        - Input "business" → {"message": "Understood, business use. Is this vehicle equipped with blind spot warning? (yes or no)", "valid": true, "use": "business"}"""
+
+# Filled in once per vehicle use below, never per turn
+BLIND_SPOT_PROMPT_TEMPLATE = """You ask about blind spot warning.
+
+        Accept: yes/no variations (y, n, yeah, nope, etc.)
+
+        Response format (JSON only):
+        {{"message": "your message", "valid": true/false, "blind_spot": "yes/no"}}
+
+        IMPORTANT: After validating the blind spot response, your message should ask: "{next_question}"
+
+        Examples:
+        - Input "yes" → {{"message": "Great to hear that your vehicle has blind spot warning. {next_question}", "valid": true, "blind_spot": "yes"}}
+        - Input "no" → {{"message": "Noted, no blind spot warning. {next_question}", "valid": true, "blind_spot": "no"}}"""
+
+COMMUTE_DAYS_PROMPT = """You collect days per week for commuting.
+
+        Valid: 1-7 days
+
+        Response format (JSON only):
+        {"message": "your message asking for one-way miles", "valid": true/false, "days": number}
+
+        Examples:
+        - Input "5" → {"message": "And how many miles is your one-way commute to work or school?", "valid": true, "days": 5}
+        - Input "every day" → {"message": "So that's 7 days a week. How many miles one-way to work/school?", "valid": true, "days": 7}"""
+
+COMMUTE_MILES_PROMPT = """You collect one-way commute miles.
+
+
+        Response format (JSON only):
+        {"message": "your message about adding another vehicle", "valid": true/false, "miles": number}
+
+        Examples:
+        - Input "15" → {"message": "Great! Would you like to add another vehicle?", "valid": true, "miles": 15}
+        - Input "10.5" → {"message": "Got it, 10.5 miles. Do you have another vehicle to add?", "valid": true, "miles": 10.5}"""
+
+ANNUAL_MILEAGE_PROMPT = """You collect annual mileage for commercial/farming/business vehicles.
+
+
+        Response format (JSON only):
+        {"message": "your message about adding another vehicle", "valid": true/false, "mileage": number}
+
+        Examples:
+        - Input "12000" → {"message": "Noted! Would you like to add another vehicle?", "valid": true, "mileage": 12000}
+        - Input "15,000" → {"message": "Got it, 15,000 miles annually. Do you have another vehicle to add?", "valid": true, "mileage": 15000}"""
+
+ADD_ANOTHER_VEHICLE_PROMPT = """Ask if they want to add another vehicle.
+
+        Same logic as before - interpret yes/no responses.
+
+        Response format (JSON only):
+        If yes: {"message": "your message asking for next vehicle's VIN", "valid": true, "add_vehicle": true}
+        If no: {"message": "your message about US license type which is either Foreign, Personal, or Commercial?", "valid": true, "no_vehicle": true}"""
+
+LICENSE_TYPE_PROMPT = """You collect US License Type information.
+
+        Valid types: Foreign, Personal, Commercial (accept case variations)
+
+        Response format (JSON only):
+        {"message": "your message", "valid": true/false, "license_type": "foreign/personal/commercial"}
+
+        Examples:
+        - Input "personal" → {"message": "Thank you. Is your personal license currently valid or suspended?", "valid": true, "license_type": "personal"}
+        - Input "commercial" → {"message": "Got it, commercial license. Is it currently valid or suspended?", "valid": true, "license_type": "commercial"}
+        - Input "foreign" → {"message": "Thank you! I've collected all your information. Here's a summary of what you provided...", "valid": true, "license_type": "foreign"}
+        - Input "regular" → {"message": "Do you mean a personal license? Please specify: Foreign, Personal, or Commercial.", "valid": false}"""
+
+LICENSE_STATUS_PROMPT = """You collect license status (only for personal or commercial licenses).
+
+        Valid statuses: valid, suspended (accept variations like "active", "good standing" = valid)
+
+        Response format (JSON only):
+        {"message": "your message summarizing all collected information", "valid": true/false, "license_status": "valid/suspended"}
+
+        Examples:
+        - Input "expired" → {"message": "Is your license currently valid or suspended? Please specify one of these two options.", "valid": false}
+        - Input "I don't know" → {"message": "I need to know if your license is valid or suspended. Please check and let me know.", "valid": false}
+        - Input "revoked" → {"message": "I need to know if it's currently valid or suspended. If it's revoked, please indicate 'suspended'.", "valid": false}
+        - Input "valid" → {"message": "Perfect! I've collected all your information. Here's what I have: [provide summary]", "valid": true, "license_status": "valid"}
+        - Input "suspended" → {"message": "Noted. I've collected all your information. Here's a summary: [provide summary]", "valid": true, "license_status": "suspended"}
+        - Input "active" → {"message": "Great, your license is active. Here's everything I've collected: [provide summary]", "valid": true, "license_status": "valid"}"""
+
+COMMUTE_DAYS_QUESTION = "How many days per week do you use this vehicle for commuting?"
+ANNUAL_MILEAGE_QUESTION = "What's the annual mileage for this vehicle?"
+
+BLIND_SPOT_PROMPTS = {
+    "commuting": BLIND_SPOT_PROMPT_TEMPLATE.format(next_question=COMMUTE_DAYS_QUESTION),
+    "other": BLIND_SPOT_PROMPT_TEMPLATE.format(next_question=ANNUAL_MILEAGE_QUESTION),
+}
+
+
+# The plain question for each step, used when the bot moves to a step without
+# an LLM written message (skipping ahead, or a reply that could not be parsed)
+QUESTIONS = {
+    "zip": "What's your 5-digit ZIP code?",
+    "name": "What's your full name?",
+    "email": "What's your email address?",
+    "add_vehicle": "Do you want to add a vehicle?",
+    "vehicle_vin": "Please provide your vehicle's VIN or the Year, Make, Model, and Body Type.",
+    "vehicle_use": "How is this vehicle primarily used? (commuting, commercial, farming, or business)",
+    "blind_spot": "Does this vehicle have blind spot warning equipped? (yes or no)",
+    "commute_days": COMMUTE_DAYS_QUESTION,
+    "commute_miles": "And how many miles is your one-way commute to work or school?",
+    "annual_mileage": ANNUAL_MILEAGE_QUESTION,
+    "add_another_vehicle": "Would you like to add another vehicle?",
+    "license_type": "What's your US License Type? Is it Foreign, Personal, or Commercial?",
+    "license_status": "Is your license currently valid or suspended?",
+}
+
+
+# JSON schema helpers for structured outputs. Strict schemas need every key
+# listed as required, so optional values are nullable instead.
+def nullable(type_, enum=None):
+    schema = {"type": [type_, "null"]}
+    if enum:
+        schema["enum"] = enum + [None]
+    return schema
+
+
+def strict_object(properties):
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+# Schema of the answer each output_key holds
+ANSWER_SCHEMAS = {
+    "zip": nullable("string"),
+    "name": nullable("string"),
+    "email": nullable("string"),
+    "vin": nullable("string"),
+    "use": nullable("string", ["commuting", "commercial", "farming", "business"]),
+    "blind_spot": nullable("string", ["yes", "no"]),
+    "days": nullable("integer"),
+    "miles": nullable("number"),
+    "mileage": nullable("number"),
+    "license_type": nullable("string", ["foreign", "personal", "commercial"]),
+    "license_status": nullable("string", ["valid", "suspended"]),
+}
+
+
+# Structured output setting for a completion, see LLM_RESPONSE_FORMAT
+def response_format(name, schema):
+    if settings.LLM_RESPONSE_FORMAT == "json_schema":
+        return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+    if settings.LLM_RESPONSE_FORMAT == "json_object":
+        return {"type": "json_object"}
+    return None
+
+
+class Step:
+    def __init__(self, name, prompt, user_prefix, output_key=None, field=None, vehicle=False,
+                 transition=None, validator=None, completes_vehicle=False, tier="large", case_sensitive=False):
+        self.name = name
+        # Either a prompt string or a function of the state that picks a prebuilt one
+        self.prompt = prompt
+        self.user_prefix = user_prefix
+        # Key holding the answer in the parsed reply, stored under field
+        self.output_key = output_key
+        self.field = field or output_key
+        # Answers for the vehicle being added go into state["current_vehicle"]
+        self.vehicle = vehicle
+        # (state, parsed) -> next step name, COMPLETE, or None to stay on this step
+        self.transition = transition
+        self.validator = validator
+        self.completes_vehicle = completes_vehicle
+        # "small" lets LLM_SMALL_MODEL try first, for answers that are a word,
+        # a number or a choice from a list
+        self.tier = tier
+        # The reply repeats the answer as typed (a name), so the response cache keeps its case
+        self.case_sensitive = case_sensitive
+        # "message" first so streamed replies start with the text the user sees
+        properties = {"message": {"type": "string"}, "valid": {"type": "boolean"}}
+        if output_key:
+            properties[output_key] = ANSWER_SCHEMAS[output_key]
+        else:
+            properties.update(add_vehicle=nullable("boolean"), no_vehicle=nullable("boolean"))
+        self.schema = strict_object(properties)
+
+    # Structured output setting for this step's completions
+    def response_format(self):
+        return response_format(f"{self.name}_reply", self.schema)
+
+    def messages(self, state, input):
+        prompt = self.prompt(state) if callable(self.prompt) else self.prompt
+        return [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": self.user_prefix + input},
+        ]
+
+    # Local fast path, None means the LLM has to decide
+    def validate(self, state, input):
+        result = self.validator(input, state) if self.validator else None
+        validators.counters[self.name]["hit" if result is not None else "miss"] += 1
+        return result
+
+    # Store the answer from a valid reply and return the next step
+    def advance(self, state, parsed):
+        if not parsed.get("valid"):
+            return None
+        if self.output_key:
+            # Strict schemas send null for a missing answer
+            if parsed.get(self.output_key) is None:
+                return None
+            target = state["current_vehicle"] if self.vehicle else state
+            target[self.field] = parsed[self.output_key]
+        return self.transition(state, parsed)
+
+
+def go_to(step):
+    return lambda state, parsed: step
+
+
+def add_vehicle_transition(state, parsed):
+    if parsed.get("add_vehicle"):
+        return "vehicle_vin"
+    if parsed.get("no_vehicle"):
+        return "license_type"
+    return None
+
+
+def blind_spot_prompt(state):
+    return BLIND_SPOT_PROMPTS["commuting" if state["current_vehicle"].get("use") == "commuting" else "other"]
+
+
+def blind_spot_transition(state, parsed):
+    return "commute_days" if state["current_vehicle"]["use"] == "commuting" else "annual_mileage"
+
+
+def license_type_transition(state, parsed):
+    # Only personal and commercial licenses have a status to ask about
+    return "license_status" if parsed["license_type"] in ["personal", "commercial"] else COMPLETE
+
+
+STEPS = {step.name: step for step in [
+    Step("zip", ZIP_PROMPT, "Validate this ZIP code: ", output_key="zip",
+         transition=go_to("name"), validator=validators.validate_zip, tier="small"),
+    Step("name", NAME_PROMPT, "Validate this name: ", output_key="name",
+         transition=go_to("email"), case_sensitive=True),
+    Step("email", EMAIL_PROMPT, "Validate this email: ", output_key="email",
+         transition=go_to("add_vehicle"), validator=validators.validate_email, tier="small", case_sensitive=True),
+    Step("add_vehicle", ADD_VEHICLE_PROMPT, "User response: ",
+         transition=add_vehicle_transition, validator=validators.validate_add_vehicle, tier="small"),
+    Step("vehicle_vin", VEHICLE_VIN_PROMPT, "Vehicle info: ", output_key="vin", vehicle=True,
+         transition=go_to("vehicle_use"), validator=validators.validate_vin, case_sensitive=True),
+    Step("vehicle_use", VEHICLE_USE_PROMPT, "Vehicle use: ", output_key="use", vehicle=True,
+         transition=go_to("blind_spot"), validator=validators.validate_vehicle_use, tier="small"),
+    Step("blind_spot", blind_spot_prompt, "Blind spot response: ", output_key="blind_spot", vehicle=True,
+         transition=blind_spot_transition, validator=validators.validate_blind_spot, tier="small"),
+    Step("commute_days", COMMUTE_DAYS_PROMPT, "Days per week: ", output_key="days", field="commute_days",
+         vehicle=True, transition=go_to("commute_miles"), validator=validators.validate_commute_days, tier="small"),
+    Step("commute_miles", COMMUTE_MILES_PROMPT, "Miles: ", output_key="miles", field="commute_miles",
+         vehicle=True, transition=go_to("add_another_vehicle"), validator=validators.validate_commute_miles,
+         completes_vehicle=True, tier="small"),
+    Step("annual_mileage", ANNUAL_MILEAGE_PROMPT, "Annual mileage: ", output_key="mileage", field="annual_mileage",
+         vehicle=True, transition=go_to("add_another_vehicle"), validator=validators.validate_annual_mileage,
+         completes_vehicle=True, tier="small"),
+    Step("add_another_vehicle", ADD_ANOTHER_VEHICLE_PROMPT, "Response: ",
+         transition=add_vehicle_transition, validator=validators.validate_add_vehicle, tier="small"),
+    Step("license_type", LICENSE_TYPE_PROMPT, "License type: ", output_key="license_type",
+         transition=license_type_transition, validator=validators.validate_license_type, tier="small"),
+    Step("license_status", LICENSE_STATUS_PROMPT, "License status: ", output_key="license_status",
+         transition=go_to(COMPLETE), validator=validators.validate_license_status, tier="small"),
+]}
+
+
+ORDER = list(STEPS)
+
+
+# How far along the onboarding a conversation is, used as its rate limit priority
+def progress(state):
+    return ORDER.index(state["step"])
+
+
+def summary(state):
+    return f"""Information collected:
+                - ZIP: {state['zip']}
+                - Name: {state['name']}
+                - Email: {state['email']}
+                - Vehicles: {len(state['vehicles'])}
+                - License Type: {state['license_type']}
+                - License Status: {state.get('license_status', 'N/A')}"""
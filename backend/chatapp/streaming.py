@@ -0,0 +1,57 @@
+import re
+
+MESSAGE_KEY = re.compile(r'"message"\s*:\s*"')
+HEX = re.compile(r"[0-9a-fA-F]{4}")
+ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+# Pulls the "message" string out of a JSON object while it is still being
+# generated. feed() takes the next chunk of raw completion text and returns
+# whatever new message text can be decoded so far.
+class MessageStreamParser:
+    def __init__(self):
+        self.buffer = ""
+        self.position = None
+        self.done = False
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        if self.done:
+            return ""
+
+        if self.position is None:
+            match = MESSAGE_KEY.search(self.buffer)
+            if match is None:
+                return ""
+            self.position = match.end()
+
+        decoded = []
+        buffer, i = self.buffer, self.position
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                self.done = True
+                i += 1
+                break
+            if char != "\\":
+                decoded.append(char)
+                i += 1
+                continue
+
+            # Escape sequences may be split across chunks, wait for the rest
+            if i + 1 >= len(buffer):
+                break
+            escape = buffer[i + 1]
+            if escape == "u":
+                if i + 6 > len(buffer):
+                    break
+                digits = buffer[i + 2:i + 6]
+                # A malformed escape is shown as it came, the full reply parse sorts it out
+                decoded.append(chr(int(digits, 16)) if HEX.fullmatch(digits) else buffer[i:i + 6])
+                i += 6
+            else:
+                decoded.append(ESCAPES.get(escape, escape))
+                i += 2
+
+        self.position = i
+        return "".join(decoded)
@@ -1,3 +1,943 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import gzip
+import json
+import os
+import tempfile
+import time
+from importlib.util import find_spec
+from io import StringIO
+from unittest import mock, skipUnless
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from openai import APITimeoutError
+from .fakellm import FakeLLMServer, StepAwareLLMServer
+from .llm import LLMClient, pool_stats
+from .resilience import FALLBACK_MESSAGE, CircuitOpen, LLMUnavailable
+from .management.commands.bench_flow import onboarding_script
+from . import export, extraction, funnel, metrics, parsing, ratelimit, resilience, response_cache, retention, search, steps, validators, writes
+from .consumers import BUSY_MESSAGE, TOO_FAST_MESSAGE, ChatConsumer, push_to_session
+from .conversations import new_state
+from .models import ArchivedTranscript, ChatMessage, ChatSession, LLMUsage, Vehicle
+from .streaming import MessageStreamParser
+
+PROMPT = [{"role": "user", "content": "Validate this ZIP code: 12345"}]
+
 
 # Create your tests here.
+class LLMClientTests(SimpleTestCase):
+    async def test_concurrent_completions_do_not_block_each_other(self):
+        async with FakeLLMServer(latency=0.2) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url):
+                llm = LLMClient()
+                started = time.perf_counter()
+                replies = await asyncio.gather(*(llm.complete(PROMPT) for _ in range(20)))
+
+        self.assertEqual(len(replies), 20)
+        self.assertLess(time.perf_counter() - started, 1.5)
+
+    async def test_concurrency_cap(self):
+        async with FakeLLMServer(latency=0.1) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url, LLM_MAX_CONCURRENCY=1):
+                llm = LLMClient()
+                started = time.perf_counter()
+                await asyncio.gather(*(llm.complete(PROMPT) for _ in range(3)))
+
+        self.assertGreaterEqual(time.perf_counter() - started, 0.3)
+
+    async def test_timeout(self):
+        async with FakeLLMServer(latency=2) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url, LLM_MAX_RETRIES=0):
+                llm = LLMClient(timeout=0.2)
+                errors = metrics.counters["llm_errors"]
+                with self.assertRaises(LLMUnavailable) as raised:
+                    await llm.complete(PROMPT)
+
+        self.assertIsInstance(raised.exception.__cause__, (APITimeoutError, asyncio.TimeoutError))
+        self.assertEqual(metrics.counters["llm_errors"], errors + 1)
+
+    async def test_server_errors_are_retried_with_backoff(self):
+        async with FakeLLMServer(latency=0, failures=2) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url,
+                                   LLM_MAX_RETRIES=2, LLM_BACKOFF_BASE=0.01):
+                retries = metrics.counters["llm_retries"]
+                text, _ = await LLMClient().complete(PROMPT)
+
+        self.assertEqual(json.loads(text), server.reply)
+        self.assertEqual(server.requests, 3)
+        self.assertEqual(metrics.counters["llm_retries"], retries + 2)
+
+    async def test_breaker_opens_and_fails_fast(self):
+        async with FakeLLMServer(latency=0, failures=-1) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url,
+                                   LLM_MAX_RETRIES=0, LLM_BREAKER_THRESHOLD=2, LLM_BREAKER_COOLDOWN=60):
+                llm = LLMClient()
+                for _ in range(2):
+                    with self.assertRaises(LLMUnavailable):
+                        await llm.complete(PROMPT)
+                with self.assertRaises(CircuitOpen):
+                    await llm.complete(PROMPT)
+
+        self.assertEqual(server.requests, 2)
+
+    async def test_hedged_request_beats_a_stalled_one(self):
+        class StallFirst(FakeLLMServer):
+            def request_latency(self):
+                return 5 if self.requests == 1 else 0
+
+        async with StallFirst() as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url, LLM_HEDGE_DELAY=0.1):
+                started = time.perf_counter()
+                await LLMClient().complete(PROMPT)
+                self.assertLess(time.perf_counter() - started, 2)
+
+        self.assertEqual(server.requests, 2)
+
+    async def test_waiting_for_a_slot_is_not_a_provider_failure(self):
+        async with FakeLLMServer(latency=0.6) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url,
+                                   LLM_MAX_CONCURRENCY=1, LLM_DEADLINE=1.5, LLM_BREAKER_THRESHOLD=1):
+                llm = LLMClient()
+                results = await asyncio.gather(*(llm.complete(PROMPT) for _ in range(4)), return_exceptions=True)
+                breaker = resilience.get_breaker(llm.model)
+
+        # Two fit in the deadline, the others ran out of time queued or part way through
+        self.assertEqual(sum(isinstance(result, LLMUnavailable) for result in results), 2)
+        self.assertFalse(breaker.is_open)
+        self.assertEqual(breaker.failures, 0)
+
+    async def test_rejected_probe_leaves_the_circuit_open(self):
+        async with FakeLLMServer(latency=0, failures=-1, failure_status=400) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url,
+                                   LLM_BREAKER_THRESHOLD=1, LLM_BREAKER_COOLDOWN=0):
+                llm = LLMClient()
+                breaker = resilience.get_breaker(llm.model)
+                breaker.failure()
+                with self.assertRaises(LLMUnavailable):
+                    await llm.complete(PROMPT)
+
+        self.assertTrue(breaker.is_open)
+        self.assertEqual(breaker.failures, 1)
+        self.assertFalse(breaker.probing)
+
+    async def test_hedged_copy_waits_for_a_slot(self):
+        async with FakeLLMServer(latency=0.3) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url,
+                                   LLM_MAX_CONCURRENCY=1, LLM_HEDGE_DELAY=0.05):
+                await LLMClient().complete(PROMPT)
+
+        # The copy never got past the concurrency cap before the first answer came back
+        self.assertEqual(server.requests, 1)
+
+    async def test_clients_share_one_pool(self):
+        async with FakeLLMServer(latency=0) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url):
+                first, second = LLMClient(), LLMClient()
+                self.assertIs(first.client, second.client)
+
+                await first.complete(PROMPT)
+                await second.complete(PROMPT)
+                stats = pool_stats()
+
+        self.assertEqual(stats["clients"], 1)
+        self.assertEqual(stats["connections"], 1)
+        self.assertEqual(stats["idle_connections"], 1)
+
+
+class RateLimiterTests(SimpleTestCase):
+    async def test_priority_then_fair_share(self):
+        # One request of burst, then ten per second
+        limiter = ratelimit.RateLimiter(rpm=600, tpm=0, burst=0.1, workers=1)
+        await limiter.acquire(1, session="a")
+        order = []
+
+        async def turn(session, priority):
+            await limiter.acquire(1, session=session, priority=priority)
+            order.append(session)
+
+        await asyncio.gather(turn("a", 0), turn("a", 0), turn("b", 0), turn("c", 5))
+        self.assertEqual(order, ["c", "b", "a", "a"])
+        self.assertEqual(limiter.queued(), 0)
+
+    async def test_token_budget_is_settled_with_real_usage(self):
+        limiter = ratelimit.RateLimiter(rpm=0, tpm=6000, burst=1, workers=1)
+        await limiter.acquire(100)
+        started = time.perf_counter()
+        limiter.settle(100, 20)
+        await limiter.acquire(50)
+        self.assertLess(time.perf_counter() - started, 0.05)
+        await limiter.acquire(50)
+        self.assertGreater(time.perf_counter() - started, 0.1)
+
+    async def test_completions_queue_for_the_request_budget(self):
+        async with FakeLLMServer(latency=0) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url,
+                                   LLM_RPM=600, LLM_RATE_BURST=0.1):
+                started = time.perf_counter()
+                await asyncio.gather(*(LLMClient(session=n).complete(PROMPT) for n in range(4)))
+
+        self.assertGreaterEqual(time.perf_counter() - started, 0.25)
+        self.assertEqual(server.requests, 4)
+
+    async def test_half_open_probe_stuck_in_the_queue_is_released(self):
+        async with FakeLLMServer(latency=0) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url, LLM_RPM=60,
+                                   LLM_RATE_BURST=1, LLM_DEADLINE=0.2, LLM_BREAKER_THRESHOLD=1, LLM_BREAKER_COOLDOWN=0):
+                llm = LLMClient()
+                breaker = resilience.get_breaker(llm.model)
+                breaker.failure()
+                await ratelimit.get_limiter().acquire(1)
+                with self.assertRaises(LLMUnavailable):
+                    await llm.complete(PROMPT)
+
+                # The probe never reached the provider, the next call may probe again
+                self.assertFalse(breaker.probing)
+                self.assertTrue(breaker.allow())
+
+        self.assertEqual(server.requests, 0)
+
+
+class ValidatorTests(SimpleTestCase):
+    def state(self, step, **current_vehicle):
+        return {"step": step, "current_vehicle": current_vehicle}
+
+    def test_zip(self):
+        self.assertEqual(steps.STEPS["zip"].validate(self.state("zip"), " 12345 ")["zip"], "12345")
+        self.assertFalse(steps.STEPS["zip"].validate(self.state("zip"), "1234")["valid"])
+        self.assertIsNone(steps.STEPS["zip"].validate(self.state("zip"), "my zip is 12345"))
+
+    def test_vin_check_digit(self):
+        self.assertEqual(steps.STEPS["vehicle_vin"].validate(self.state("vehicle_vin"), "1hgbh41jxmn109186")["vin"], "1HGBH41JXMN109186")
+        self.assertIsNone(steps.STEPS["vehicle_vin"].validate(self.state("vehicle_vin"), "1HGBH41J1MN109186"))
+        self.assertIsNone(steps.STEPS["vehicle_vin"].validate(self.state("vehicle_vin"), "2022 Honda Civic Sedan"))
+
+    def test_yes_no_steps(self):
+        self.assertTrue(steps.STEPS["add_vehicle"].validate(self.state("add_vehicle"), "Yes!")["add_vehicle"])
+        self.assertTrue(steps.STEPS["add_another_vehicle"].validate(self.state("add_another_vehicle"), "nope")["no_vehicle"])
+        self.assertIsNone(steps.STEPS["add_vehicle"].validate(self.state("add_vehicle"), "maybe"))
+
+        commuting = steps.STEPS["blind_spot"].validate(self.state("blind_spot", use="commuting"), "y")
+        self.assertEqual(commuting["blind_spot"], "yes")
+        self.assertIn("days per week", commuting["message"])
+        self.assertIn("annual mileage", steps.STEPS["blind_spot"].validate(self.state("blind_spot", use="farming"), "no")["message"])
+
+    def test_numbers(self):
+        self.assertEqual(steps.STEPS["commute_days"].validate(self.state("commute_days"), "5")["days"], 5)
+        self.assertFalse(steps.STEPS["commute_days"].validate(self.state("commute_days"), "9")["valid"])
+        self.assertEqual(steps.STEPS["commute_miles"].validate(self.state("commute_miles"), "10.5")["miles"], 10.5)
+        self.assertEqual(steps.STEPS["annual_mileage"].validate(self.state("annual_mileage"), "15,000")["mileage"], 15000)
+        self.assertIsNone(steps.STEPS["annual_mileage"].validate(self.state("annual_mileage"), "about 12k"))
+
+    def test_to_number(self):
+        self.assertEqual(validators.to_number("about 15,000 miles"), 15000)
+        self.assertEqual(validators.to_number(10.5), 10.5)
+        self.assertIsNone(validators.to_number("lots"))
+
+    def test_email_and_license(self):
+        self.assertEqual(steps.STEPS["email"].validate(self.state("email"), "john@gmail.com")["email"], "john@gmail.com")
+        self.assertIsNone(steps.STEPS["email"].validate(self.state("email"), "john@"))
+        self.assertEqual(steps.STEPS["license_type"].validate(self.state("license_type"), "Personal")["license_type"], "personal")
+        self.assertEqual(steps.STEPS["license_status"].validate(self.state("license_status"), "active")["license_status"], "valid")
+
+    def test_counters(self):
+        before = validators.stats().get("zip", {"hit": 0, "miss": 0})
+        steps.STEPS["zip"].validate(self.state("zip"), "12345")
+        steps.STEPS["zip"].validate(self.state("zip"), "twelve")
+        after = validators.stats()["zip"]
+        self.assertEqual(after["hit"], before["hit"] + 1)
+        self.assertEqual(after["miss"], before["miss"] + 1)
+        # Steps without a validator always go to the LLM
+        self.assertIsNone(steps.STEPS["name"].validate(self.state("name"), "John Smith"))
+
+
+class StepTableTests(SimpleTestCase):
+    def test_prompts_are_prebuilt(self):
+        state = {"step": "blind_spot", "current_vehicle": {"use": "commuting"}}
+        first = steps.STEPS["blind_spot"].messages(state, "yes")
+        second = steps.STEPS["blind_spot"].messages(state, "no")
+        self.assertIs(first[0]["content"], second[0]["content"])
+        self.assertIn(steps.COMMUTE_DAYS_QUESTION, first[0]["content"])
+        self.assertEqual(second[1]["content"], "Blind spot response: no")
+
+    def test_transitions(self):
+        state = {"step": "blind_spot", "current_vehicle": {"use": "farming"}}
+        self.assertEqual(steps.STEPS["blind_spot"].advance(state, {"valid": True, "blind_spot": "no"}), "annual_mileage")
+        self.assertEqual(state["current_vehicle"]["blind_spot"], "no")
+        self.assertIsNone(steps.STEPS["blind_spot"].advance(state, {"valid": False}))
+        self.assertEqual(steps.STEPS["license_type"].advance(state, {"valid": True, "license_type": "foreign"}), steps.COMPLETE)
+
+
+class ParsingTests(SimpleTestCase):
+    def test_clean_fenced_and_padded_replies(self):
+        reply = {"message": "Use {braces} freely", "valid": True, "zip": "12345"}
+        for text in [json.dumps(reply), f"```json\n{json.dumps(reply)}\n```",
+                     f"Sure! Here you go: {json.dumps(reply)} Let me know."]:
+            self.assertEqual(parsing.extract_reply(text), reply)
+
+    def test_unreadable_replies_raise(self):
+        for text in ["Please enter your ZIP code.", "{not json}", '{"valid": true}']:
+            with self.assertRaises(ValueError):
+                parsing.extract_reply(text)
+
+    def test_step_schemas(self):
+        response_format = steps.STEPS["commute_days"].response_format()
+        schema = response_format["json_schema"]["schema"]
+        self.assertTrue(response_format["json_schema"]["strict"])
+        self.assertEqual(list(schema["properties"]), ["message", "valid", "days"])
+        self.assertEqual(schema["required"], ["message", "valid", "days"])
+        self.assertIn("no_vehicle", steps.STEPS["add_vehicle"].schema["properties"])
+        with override_settings(LLM_RESPONSE_FORMAT="off"):
+            self.assertIsNone(steps.STEPS["zip"].response_format())
+
+
+class StreamingTests(SimpleTestCase):
+    def test_parser_handles_split_chunks_and_escapes(self):
+        raw = '{"message": "Say \\"hi\\"\\nto Jos\\u00e9", "valid": false}'
+        parser = MessageStreamParser()
+        # Feed one character at a time so every escape is split across chunks
+        text = "".join(parser.feed(char) for char in raw)
+        self.assertEqual(text, 'Say "hi"\nto Jos\u00e9')
+        self.assertTrue(parser.done)
+
+    def test_stream_parser_passes_bad_unicode_escapes_through(self):
+        parser = MessageStreamParser()
+        self.assertEqual(parser.feed('{"message": "a\\uZZZZ b"'), "a\\uZZZZ b")
+        self.assertTrue(parser.done)
+
+    async def test_stream_from_fake_server(self):
+        async with FakeLLMServer(latency=0, token_delay=0) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url):
+                chunks = [chunk async for chunk in LLMClient().stream(PROMPT)]
+
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(json.loads("".join(chunks)), server.reply)
+
+
+class ExtractionTests(SimpleTestCase):
+    def found(self, **fields):
+        return dict({"zip": None, "name": None, "email": None, "vehicles": [], "more_vehicles": None,
+                     "license_type": None, "license_status": None}, **fields)
+
+    def vehicle(self, **fields):
+        return dict({"vin": None, "use": None, "blind_spot": None, "commute_days": None,
+                     "commute_miles": None, "annual_mileage": None}, **fields)
+
+    def test_extraction_follows_the_response_format_setting(self):
+        self.assertEqual(extraction.extraction_format()["json_schema"]["name"], "onboarding_fields")
+        with override_settings(LLM_RESPONSE_FORMAT="json_object"):
+            self.assertEqual(extraction.extraction_format(), {"type": "json_object"})
+        with override_settings(LLM_RESPONSE_FORMAT="off"):
+            self.assertIsNone(extraction.extraction_format())
+
+    def test_contact_details_skip_to_vehicles(self):
+        state = new_state()
+        extraction.apply(state, self.found(zip="12345", name="John Smith", email="john@x.com"))
+        self.assertEqual((state["zip"], state["name"], state["email"]), ("12345", "John Smith", "john@x.com"))
+        self.assertEqual(extraction.skip_answered(state, "zip"), "add_vehicle")
+
+    def test_invalid_values_are_dropped(self):
+        state = new_state()
+        extraction.apply(state, self.found(zip="1234", email="not an email"))
+        self.assertIsNone(state["zip"])
+        self.assertIsNone(state["email"])
+        self.assertEqual(extraction.skip_answered(state, "zip"), "zip")
+
+    def test_whole_onboarding_in_one_message(self):
+        state = new_state()
+        car = self.vehicle(vin="1HGBH41JXMN109186", use="commuting", blind_spot="yes", commute_days=5, commute_miles=12)
+        completed = extraction.apply(state, self.found(zip="12345", name="John Smith", email="john@x.com", vehicles=[car],
+                                                       more_vehicles=False, license_type="personal", license_status="valid"))
+        self.assertEqual(len(completed), 1)
+        self.assertEqual(state["current_vehicle"], {})
+        self.assertEqual(extraction.skip_answered(state, "zip", more_vehicles=False, added=1), steps.COMPLETE)
+
+    def test_partial_vehicle_continues_at_first_missing_field(self):
+        state = dict(new_state(), zip="12345", name="John Smith", email="john@x.com", step="add_vehicle")
+        completed = extraction.apply(state, self.found(vehicles=[self.vehicle(vin="1HGBH41JXMN109186", use="business")]))
+        self.assertEqual(completed, [])
+        self.assertEqual(extraction.skip_answered(state, "add_vehicle"), "blind_spot")
+
+    def test_looks_multi(self):
+        self.assertTrue(extraction.looks_multi("12345, John Smith, john@x.com"))
+        self.assertTrue(extraction.looks_multi("personal and valid"))
+        self.assertFalse(extraction.looks_multi("John Smith"))
+
+
+class ChatConsumerTests(TransactionTestCase):
+    def setUp(self):
+        caches["llm_responses"].clear()
+        caches["conversations"].clear()
+
+    # Sends each message on a fresh socket and returns the replies, the
+    # "Connection Established" frame is kept in self.welcome
+    async def converse(self, *messages, path="/ws/chat/"):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), path)
+        await communicator.connect()
+        self.welcome = await communicator.receive_json_from()
+        frames = []
+        for message in messages:
+            await communicator.send_json_to({"message": message})
+            frames.append(await communicator.receive_json_from())
+        await communicator.disconnect()
+        return frames
+
+    async def test_streamed_turn_sends_deltas_then_final_message(self):
+        async with FakeLLMServer(latency=0, token_delay=0) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url):
+                communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/")
+                await communicator.connect()
+                await communicator.receive_json_from()
+
+                await communicator.send_json_to({"message": "my zip is 1234", "stream": True})
+                deltas = []
+                frame = await communicator.receive_json_from()
+                while "delta" in frame:
+                    deltas.append(frame["delta"])
+                    frame = await communicator.receive_json_from()
+                await communicator.disconnect()
+
+        self.assertGreater(len(deltas), 1)
+        self.assertEqual("".join(deltas), server.reply["message"])
+        self.assertEqual(frame, {"message": server.reply["message"]})
+        self.assertEqual(await ChatMessage.objects.filter(role="assistant").acount(), 1)
+
+    async def test_full_onboarding_flow(self):
+        reply = {"message": "Thanks, John! Now I need your email address.", "valid": True, "name": "John Smith"}
+        answers = ["12345", "John Smith", "john@gmail.com", "yes", "1HGBH41JXMN109186", "commuting",
+                   "yes", "5", "12", "no", "personal", "valid"]
+        async with FakeLLMServer(latency=0, reply=reply) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url):
+                *_, frame = await self.converse(*answers)
+
+        # Only the name step needed the LLM
+        self.assertEqual(server.requests, 1)
+        self.assertIn("Information collected:", frame["message"])
+        session = await ChatSession.objects.aget()
+        self.assertTrue(session.is_complete)
+        self.assertEqual(session.license_status, "valid")
+        vehicle = await Vehicle.objects.aget()
+        self.assertEqual(vehicle.use_type, "commuting")
+        self.assertEqual((vehicle.commute_days, vehicle.commute_miles), (5, 12))
+
+    async def test_scripted_flow_through_step_aware_llm(self):
+        script = onboarding_script(vehicles=2)
+        async with StepAwareLLMServer(latency=0, jitter=0.01) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url, LOCAL_VALIDATORS=False):
+                *_, frame = await self.converse(*script)
+
+        self.assertEqual(server.requests, len(script))
+        self.assertIn("Information collected:", frame["message"])
+        self.assertEqual(await Vehicle.objects.acount(), 2)
+        self.assertTrue((await ChatSession.objects.aget()).is_complete)
+
+    async def test_messages_sent_during_a_turn_are_queued_then_coalesced(self):
+        async with FakeLLMServer(latency=0.3) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url, LOCAL_VALIDATORS=False,
+                                   LLM_ROUTING=False, RESPONSE_CACHE=""):
+                communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/")
+                await communicator.connect()
+                await communicator.receive_json_from()
+                for message in ("my zip is 1234", "sorry", "I mean 12345"):
+                    await communicator.send_json_to({"message": message})
+                frames = [await communicator.receive_json_from(timeout=5) for _ in range(4)]
+                await communicator.disconnect()
+
+        self.assertEqual(frames[0], {"busy": True, "queued": True, "message": BUSY_MESSAGE})
+        self.assertEqual(frames[1], frames[0])
+        self.assertEqual(frames[2:], [{"message": server.reply["message"]}] * 2)
+        # The two later messages were answered by one turn
+        self.assertEqual(server.requests, 2)
+        users = [message.content async for message in ChatMessage.objects.filter(role="user").order_by("id")]
+        self.assertEqual(users, ["my zip is 1234", "sorry\nI mean 12345"])
+
+    async def test_oversized_and_malformed_frames_are_refused(self):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/")
+        with override_settings(WS_MAX_MESSAGE_LENGTH=50):
+            await communicator.connect()
+            await communicator.receive_json_from()
+            await communicator.send_json_to({"message": "x" * 100})
+            too_long = await communicator.receive_json_from()
+            await communicator.send_to(text_data="not json")
+            malformed = await communicator.receive_json_from()
+            await communicator.disconnect()
+
+        self.assertEqual(too_long["error"], "too_long")
+        self.assertEqual(malformed["error"], "bad_request")
+        self.assertEqual(await ChatMessage.objects.acount(), 0)
+
+    async def test_turns_over_the_rate_limit_get_a_busy_frame(self):
+        with override_settings(WS_TURNS_PER_MINUTE=1, WS_TURN_BURST=1):
+            frames = await self.converse("1234", "12345")
+
+        self.assertEqual(frames[1], {"busy": True, "queued": False, "message": TOO_FAST_MESSAGE})
+        self.assertEqual((await ChatSession.objects.aget()).current_step, "zip")
+
+    async def test_funnel_rollup_follows_the_step_transitions(self):
+        reply = {"message": "Thanks, John! Now I need your email address.", "valid": True, "name": "John Smith"}
+        answers = ["12345", "John Smith", "john@gmail.com", "yes", "1HGBH41JXMN109186", "commuting",
+                   "yes", "5", "12", "no", "personal", "valid"]
+        async with FakeLLMServer(latency=0, reply=reply, failures=1) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url,
+                                   LLM_MAX_RETRIES=1, LLM_BACKOFF_BASE=0.01):
+                await self.converse(*answers)
+        # A second user gives up on the name question
+        await self.converse("12345")
+
+        today = funnel.last_days(1)
+        rows = {row["step"]: row for row in await database_sync_to_async(funnel.report)(*today)}
+        self.assertEqual((rows["zip"]["entries"], rows["zip"]["completions"]), (2, 2))
+        self.assertEqual((rows["name"]["entries"], rows["name"]["completions"], rows["name"]["dropped"]), (2, 1, 1))
+        self.assertEqual(rows["name"]["llm_retries"], 1)
+        self.assertEqual(rows["complete"]["entries"], 1)
+        self.assertEqual(rows["license_status"]["completions"], 1)
+        self.assertIsNotNone(rows["zip"]["median_dwell_seconds"])
+        self.assertEqual(list(rows)[:3], ["zip", "name", "email"])
+
+        # The rollup matches a recount from the events, and the command reads it
+        await database_sync_to_async(funnel.rebuild)()
+        rebuilt = {row["step"]: row for row in await database_sync_to_async(funnel.report)(*today)}
+        self.assertEqual(rebuilt, rows)
+        out = StringIO()
+        await database_sync_to_async(call_command)("funnel", "--json", stdout=out)
+        self.assertEqual(json.loads(out.getvalue())["steps"], list(rows.values()))
+
+    async def test_usage_recorded_per_step_with_cached_prefix(self):
+        # Below the provider's 1024 token minimum nothing is cached
+        async with FakeLLMServer(latency=0) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url, LLM_ROUTING=False):
+                await self.converse("my zip is 1234", "my zip is 9876")
+        self.assertEqual([row.cached_tokens async for row in LLMUsage.objects.order_by("id")], [0, 0])
+        await LLMUsage.objects.all().adelete()
+
+        async with FakeLLMServer(latency=0, cache_min_tokens=0) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url, LLM_ROUTING=False):
+                await self.converse("my zip is 4321", "my zip is 6789")
+
+        usage = [row async for row in LLMUsage.objects.order_by("id")]
+        self.assertEqual([row.step for row in usage], ["zip", "zip"])
+        self.assertEqual(usage[0].cached_tokens, 0)
+        # The system prompt is byte-identical between turns so the second call hits the cache
+        self.assertGreater(usage[1].cached_tokens, 0)
+        self.assertGreater(usage[1].prompt_tokens, usage[1].cached_tokens)
+
+    async def test_repeated_answers_come_from_the_response_cache(self):
+        before = response_cache.stats().get("zip", {"hit": 0})["hit"]
+        async with FakeLLMServer(latency=0) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url, LLM_ROUTING=False):
+                first = await self.converse("my zip is 1234")
+                second = await self.converse("my  zip is 1234 ")
+
+        self.assertEqual(server.requests, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(response_cache.stats()["zip"]["hit"], before + 1)
+
+    def test_prompt_change_invalidates_cache_key(self):
+        self.assertEqual(response_cache.make_key("zip", "prompt", "a  b"), response_cache.make_key("zip", "prompt", "a b"))
+        self.assertNotEqual(response_cache.make_key("zip", "prompt", "a"), response_cache.make_key("zip", "prompt v2", "a"))
+        self.assertEqual(response_cache.make_key("add_vehicle", "prompt", "Yes"), response_cache.make_key("add_vehicle", "prompt", "yes"))
+        self.assertNotEqual(response_cache.make_key("name", "prompt", "John"), response_cache.make_key("name", "prompt", "john"))
+
+    async def test_turn_writes_are_batched_into_one_commit(self):
+        before = writes.stats["commits"]
+        with override_settings(DB_FLUSH_INTERVAL=60):
+            # Invalid answers stay buffered until the valid ZIP completes the step
+            await self.converse("1234", "123", "12345")
+
+        self.assertEqual(writes.stats["commits"] - before, 1)
+        self.assertEqual(await ChatMessage.objects.acount(), 6)
+        session = await ChatSession.objects.aget()
+        self.assertEqual((session.zip_code, session.current_step), ("12345", "name"))
+
+    async def test_timer_flushes_pending_rows(self):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/")
+        with override_settings(DB_FLUSH_INTERVAL=0.05):
+            await communicator.connect()
+            await communicator.receive_json_from()
+            await communicator.send_json_to({"message": "1234"})
+            await communicator.receive_json_from()
+            await asyncio.sleep(0.2)
+            self.assertEqual(await ChatMessage.objects.acount(), 2)
+            await communicator.disconnect()
+
+    async def test_failed_timer_flush_keeps_the_batch(self):
+        write = writes.WriteBuffer.write
+        batches = []
+
+        def flaky_write(buffer, *batch):
+            batches.append(batch)
+            if len(batches) == 1:
+                raise DatabaseError("database is locked")
+            write(buffer, *batch)
+
+        buffer = writes.WriteBuffer(await ChatSession.objects.acreate(), interval=0.05)
+        with mock.patch.object(writes.WriteBuffer, "write", flaky_write), self.assertLogs("chatapp.writes", "ERROR"):
+            buffer.add_message("user", "12345")
+            await asyncio.sleep(0.3)
+
+        self.assertEqual(len(batches), 2)
+        self.assertEqual([message.content async for message in ChatMessage.objects.all()], ["12345"])
+
+    async def test_resume_session_from_snapshot(self):
+        await self.converse("12345")
+        session_id = self.welcome["session"]
+
+        await self.converse(path=f"/ws/chat/?session={session_id}")
+        self.assertEqual(self.welcome, {"message": "Connection Established", "session": session_id, "step": "name",
+                                        "question": steps.QUESTIONS["name"]})
+
+    async def test_resume_falls_back_to_database_copy(self):
+        await self.converse("12345")
+        session_id = self.welcome["session"]
+        caches["conversations"].clear()
+
+        await self.converse(path=f"/ws/chat/?session={session_id}")
+        self.assertEqual(self.welcome["session"], session_id)
+        self.assertEqual(self.welcome["step"], "name")
+
+    async def test_stale_snapshot_loses_to_newer_database_copy(self):
+        await self.converse("12345")
+        session_id = self.welcome["session"]
+        stale = caches["conversations"].get(session_id)
+
+        # The session moves on through another worker, this worker's cache still holds the old snapshot
+        async with StepAwareLLMServer(latency=0) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url):
+                await self.converse("John Smith", path=f"/ws/chat/?session={session_id}")
+        caches["conversations"].set(session_id, stale)
+
+        await self.converse(path=f"/ws/chat/?session={session_id}")
+        self.assertEqual(self.welcome["step"], "email")
+
+    async def test_unknown_or_finished_sessions_start_over(self):
+        await self.converse(path="/ws/chat/?session=not-a-uuid")
+        self.assertEqual(self.welcome["step"], "zip")
+
+        finished = await ChatSession.objects.acreate(is_complete=True)
+        await self.converse(path=f"/ws/chat/?session={finished.id}")
+        self.assertNotEqual(self.welcome["session"], str(finished.id))
+        self.assertEqual(await ChatSession.objects.acount(), 3)
+
+    async def test_push_to_session_reaches_its_socket(self):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/")
+        await communicator.connect()
+        welcome = await communicator.receive_json_from()
+
+        await push_to_session(welcome["session"], "Still there?")
+        self.assertEqual(await communicator.receive_json_from(), {"message": "Still there?"})
+        await communicator.disconnect()
+
+    async def test_metrics_endpoint_reports_phase_timings(self):
+        metrics.reset()
+        await self.converse("12345")
+
+        response = await AsyncClient().get("/metrics")
+        body = response.content.decode()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('chatbot_phase_seconds_count{step="zip",phase="validate"} 1', body)
+        self.assertIn('chatbot_phase_seconds{step="zip",phase="db",quantile="0.99"}', body)
+        self.assertIn("chatbot_active_sockets 0", body)
+        self.assertIn("chatbot_db_commits_total", body)
+        self.assertNotIn('phase="llm"', body)
+
+    async def test_extraction_fills_several_steps_from_one_message(self):
+        async with StepAwareLLMServer(latency=0) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url, LLM_EXTRACTION=True):
+                frames = await self.converse("12345, John Smith, john@example.com", "no", "personal, valid")
+
+        self.assertEqual(frames[0]["message"], "Thanks! Do you want to add a vehicle?")
+        self.assertIn("Information collected:", frames[-1]["message"])
+        # One extraction call per combined message, "no" was settled locally
+        self.assertEqual(server.requests, 2)
+        session = await ChatSession.objects.aget()
+        self.assertEqual((session.zip_code, session.email, session.license_status), ("12345", "john@example.com", "valid"))
+        # Reached the end from the license_type step, still marked complete
+        self.assertTrue(session.is_complete)
+        self.assertIsNotNone(session.completed_at)
+        self.assertEqual([row.step async for row in LLMUsage.objects.all()], ["extract", "extract"])
+
+    async def test_unreadable_reply_is_repaired_once_then_falls_back(self):
+        class GarbledServer(FakeLLMServer):
+            def __init__(self, replies, **kwargs):
+                super().__init__(**kwargs)
+                self.replies = replies
+                self.bodies = []
+
+            def make_reply(self, body):
+                self.bodies.append(body)
+                return self.replies[min(len(self.bodies), len(self.replies)) - 1]
+
+        fixed = json.dumps({"message": "Thanks, John! Now I need your email address.", "valid": True, "name": "John Smith"})
+        async with GarbledServer(["Sure, John Smith is a valid name!", fixed], latency=0) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url):
+                frames = await self.converse("12345", "John Smith")
+        self.assertEqual(frames[-1]["message"], "Thanks, John! Now I need your email address.")
+        self.assertEqual(server.bodies[0]["response_format"]["json_schema"]["name"], "name_reply")
+        self.assertEqual(server.bodies[1]["messages"][-1]["content"], parsing.REPAIR_PROMPT)
+
+        caches["llm_responses"].clear()
+        async with GarbledServer(["no json here"], latency=0) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url, LLM_REPAIR_ATTEMPTS=1):
+                frames = await self.converse("12345", "John Smith")
+        self.assertEqual(len(server.bodies), 2)
+        self.assertEqual(frames[-1]["message"], f"Sorry, I didn't catch that. {steps.QUESTIONS['name']}")
+
+    async def test_small_model_first_and_escalation(self):
+        valid = {"message": "Perfect! What's your full name?", "valid": True, "zip": "12345"}
+        async with FakeLLMServer(latency=0, reply=valid) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url, LLM_SMALL_MODEL="small",
+                                   LLM_ROUTING=True):
+                await self.converse("twelve three four five")
+        self.assertEqual(server.models, {"small": 1})
+
+        caches["llm_responses"].clear()
+        async with FakeLLMServer(latency=0) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url, LLM_SMALL_MODEL="small",
+                                   LLM_ROUTING=True):
+                await self.converse("my zip is 1234")
+        # The small model said not valid, so the large one gets the final word
+        self.assertEqual(server.models, {"small": 1, "gpt-4o": 1})
+        self.assertEqual([row.model async for row in LLMUsage.objects.order_by("id")], ["small", "small", "gpt-4o"])
+
+    async def test_large_tier_steps_skip_the_small_model(self):
+        async with StepAwareLLMServer(latency=0) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url, LLM_SMALL_MODEL="small",
+                                   LLM_ROUTING=True):
+                await self.converse("12345", "John Smith")
+        self.assertEqual(server.models, {"gpt-4o": 1})
+        self.assertGreaterEqual(metrics.routes["name", "large"], 1)
+
+    async def test_failing_llm_gets_a_retry_reply_and_keeps_the_socket(self):
+        async with FakeLLMServer(latency=0, failures=-1) as server:
+            with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=server.base_url, LLM_MAX_RETRIES=0):
+                frames = await self.converse("12345", "John Smith", "John Smith")
+
+        self.assertEqual(frames[1:], [{"message": FALLBACK_MESSAGE}] * 2)
+        session = await ChatSession.objects.aget()
+        self.assertEqual(session.current_step, "name")
+
+
+class AdminTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+        self.sessions = [
+            ChatSession.objects.create(full_name=f"Person {n}", email=f"Person{n}@Example.com", zip_code=f"1000{n}")
+            for n in range(5)
+        ]
+        ChatMessage.objects.bulk_create(
+            ChatMessage(session=session, role="user", content=f"message {n}")
+            for session in self.sessions for n in range(3)
+        )
+
+    def changelist(self, model, **params):
+        return self.client.get(reverse(f"admin:chatapp_{model}_changelist"), params)
+
+    def test_message_changelist_queries_do_not_grow_with_rows(self):
+        with CaptureQueriesContext(connection) as few:
+            self.changelist("chatmessage")
+        ChatMessage.objects.bulk_create(
+            ChatMessage(session=ChatSession.objects.create(), role="user", content="more") for _ in range(20)
+        )
+        with CaptureQueriesContext(connection) as many:
+            response = self.changelist("chatmessage")
+        self.assertEqual(response.context["cl"].result_count, 35)
+        self.assertEqual(len(many), len(few))
+
+    def test_session_search_uses_exact_and_prefix_lookups(self):
+        def found(term):
+            return list(self.changelist("chatsession", q=term).context["cl"].result_list)
+
+        self.assertEqual(found("person2@example.com"), [self.sessions[2]])
+        self.assertEqual(found("10003"), [self.sessions[3]])
+        self.assertEqual(found(str(self.sessions[4].pk)), [self.sessions[4]])
+        self.assertEqual(len(found("PERSON")), 5)
+        self.assertEqual(found("son 1"), [])
+
+    def test_session_page_shows_only_the_end_of_the_transcript(self):
+        session = self.sessions[0]
+        ChatMessage.objects.bulk_create(ChatMessage(session=session, role="user", content=f"later {n}") for n in range(60))
+        response = self.client.get(reverse("admin:chatapp_chatsession_change", args=[session.pk]))
+        self.assertContains(response, "later 59")
+        self.assertNotContains(response, "message 0")
+        self.assertContains(response, "All 63 messages")
+
+    def test_paginator_uses_the_row_estimate_for_unfiltered_lists(self):
+        with mock.patch("chatapp.admin.estimated_rows", return_value=2_000_000):
+            self.assertEqual(self.changelist("chatmessage").context["cl"].paginator.count, 2_000_000)
+            self.assertEqual(self.changelist("chatmessage", role="user").context["cl"].paginator.count, 15)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.session = ChatSession.objects.create()
+        ChatMessage.objects.bulk_create([
+            ChatMessage(session=self.session, role="user", content="My car was stolen last week"),
+            ChatMessage(session=self.session, role="user", content="The stolen car, stolen again!"),
+            ChatMessage(session=self.session, role="assistant", content="Sorry to hear your car was stolen."),
+            ChatMessage(session=self.session, role="user", content="I drive a truck"),
+        ])
+
+    def test_ranked_matches_with_role_filter_and_pages(self):
+        hits, has_next = search.search("stolen car", role="user")
+        self.assertEqual([hit["snippet"] for hit in hits][0], "The [stolen] [car], [stolen] again!")
+        self.assertEqual(len(hits), 2)
+        self.assertFalse(has_next)
+        self.assertEqual(hits[0]["session"], str(self.session.pk))
+
+        first, has_next = search.search("stolen", per_page=2)
+        second, _ = search.search("stolen", page=2, per_page=2)
+        self.assertTrue(has_next)
+        self.assertEqual(len({hit["message"] for hit in first + second}), 3)
+        # Stemming, and FTS syntax in the input is taken as plain words
+        self.assertEqual(len(search.search("driving trucks")[0]), 1)
+        self.assertEqual(search.search('"NEAR( -')[0], [])
+
+    def test_index_follows_inserts_and_deletes(self):
+        message = ChatMessage.objects.create(session=self.session, role="user", content="a motorcycle")
+        self.assertEqual(len(search.search("motorcycle")[0]), 1)
+        message.delete()
+        self.assertEqual(search.search("motorcycle")[0], [])
+
+    def test_api_is_for_staff_only(self):
+        url = reverse("search")
+        self.assertEqual(self.client.get(url, {"q": "stolen"}).status_code, 403)
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+        body = self.client.get(url, {"q": "stolen", "per_page": 1}).json()
+        self.assertEqual((len(body["results"]), body["next_page"]), (1, 2))
+        admin_hits = self.client.get(reverse("admin:chatapp_chatmessage_changelist"), {"q": "truck"}).context["cl"]
+        self.assertEqual([message.content for message in admin_hits.result_list], ["I drive a truck"])
+
+    def test_funnel_endpoint_is_for_staff_only(self):
+        url = reverse("funnel")
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+        self.assertEqual(self.client.get(url, {"start": "yesterday"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"days": 30}).json()["steps"], [])
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        long_ago = timezone.now() - datetime.timedelta(hours=1)
+        self.first = self.complete(long_ago - datetime.timedelta(minutes=5), vehicles=2)
+        self.second = self.complete(long_ago, vehicles=0)
+        ChatSession.objects.create(full_name="Not done")
+
+    def complete(self, completed_at, vehicles):
+        session = ChatSession.objects.create(full_name="John Smith", email="john@example.com", zip_code="12345",
+                                             is_complete=True, completed_at=completed_at)
+        for n in range(vehicles):
+            Vehicle.objects.create(session=session, vin=f"VIN{n}", use_type="business", blind_spot="no", annual_mileage=8000)
+        ChatMessage.objects.create(session=session, role="user", content="12345")
+        return session
+
+    def export(self, *args):
+        out = StringIO()
+        call_command("export", *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_jsonl_is_incremental_with_a_watermark(self):
+        with tempfile.TemporaryDirectory() as directory:
+            watermark = os.path.join(directory, "watermark")
+            rows = [json.loads(line) for line in self.export("--watermark", watermark, "--messages").splitlines()]
+            self.assertEqual([row["id"] for row in rows], [str(self.first.pk), str(self.second.pk)])
+            self.assertEqual(len(rows[0]["vehicles"]), 2)
+            self.assertEqual(rows[0]["messages"][0]["content"], "12345")
+
+            self.assertEqual(self.export("--watermark", watermark), "")
+            # Completed after the last run, but only exported once it is older than SETTLE
+            later = self.complete(timezone.now() - datetime.timedelta(seconds=10), vehicles=1)
+            self.assertEqual(self.export("--watermark", watermark), "")
+            with mock.patch.object(export, "SETTLE", datetime.timedelta(0)):
+                rows = self.export("--watermark", watermark).splitlines()
+            self.assertEqual([json.loads(row)["id"] for row in rows], [str(later.pk)])
+
+    def test_csv_has_a_line_per_vehicle(self):
+        lines = list(csv.DictReader(StringIO(self.export("--format", "csv"))))
+        self.assertEqual([line["id"] for line in lines], [str(self.first.pk)] * 2 + [str(self.second.pk)])
+        self.assertEqual([line["vehicle_vin"] for line in lines], ["VIN0", "VIN1", ""])
+
+    def test_prefetching_keeps_queries_per_chunk(self):
+        with CaptureQueriesContext(connection) as queries:
+            list(export.stream("jsonl", messages=True, chunk_size=100))
+        # Sessions, then vehicles and messages for the one chunk
+        self.assertEqual(len(queries), 3)
+
+    @skipUnless(find_spec("pyarrow"), "pyarrow is not installed")
+    def test_parquet(self):
+        import pyarrow.parquet as pq
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "sessions.parquet")
+            self.export("--format", "parquet", "--output", path, "--chunk-size", "1")
+            table = pq.read_table(path)
+            # One row group per chunk
+            self.assertEqual(pq.ParquetFile(path).num_row_groups, 2)
+        self.assertEqual(table.column("id").to_pylist(), [str(self.first.pk), str(self.second.pk)])
+        self.assertEqual([len(vehicles) for vehicles in table.column("vehicles").to_pylist()], [2, 0])
+
+    def test_endpoint_streams_for_staff(self):
+        url = reverse("export")
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+        self.assertEqual(self.client.get(url, {"format": "xml"}).status_code, 400)
+        response = self.client.get(url, {"since": self.first.completed_at.isoformat()})
+        self.assertTrue(response.streaming)
+        self.assertIn("X-Export-Watermark", response)
+        # Served to Daphne as an async iterator, the test client reads it synchronously
+        with self.assertWarnsRegex(Warning, "synchronously"):
+            body = b"".join(response).decode()
+        self.assertEqual([json.loads(line)["id"] for line in body.splitlines()], [str(self.second.pk)])
+
+
+class RetentionTests(TransactionTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        now = timezone.now()
+        self.old = self.session(is_complete=True, completed_at=now - datetime.timedelta(days=100), content="old answer")
+        self.abandoned = self.session(content="gave up")
+        ChatSession.objects.filter(pk=self.abandoned.pk).update(started_at=now - datetime.timedelta(days=40))
+        self.recent = self.session(is_complete=True, completed_at=now - datetime.timedelta(days=5), content="recent")
+
+    def session(self, content, **fields):
+        session = ChatSession.objects.create(**fields)
+        ChatMessage.objects.bulk_create(ChatMessage(session=session, role="user", content=f"{content} {n}") for n in range(3))
+        return session
+
+    def retention(self, *args):
+        out = StringIO()
+        with override_settings(ARCHIVE_DIR=self.directory.name, RETENTION_COMPLETED_DAYS=90, RETENTION_ABANDONED_DAYS=30):
+            call_command("retention", *args, stdout=out)
+        return out.getvalue()
+
+    def test_expired_transcripts_are_archived_then_deleted(self):
+        self.assertIn("Would archive 2 sessions, 6 messages", self.retention("--dry-run"))
+        self.assertEqual(ChatMessage.objects.count(), 9)
+
+        output = self.retention("--batch-size", "1")
+        self.assertIn("archived       2 sessions, 6 messages in 2 batches", output)
+        self.assertIn("compact ", output)
+        self.assertEqual(set(ChatMessage.objects.values_list("session_id", flat=True)), {self.recent.pk})
+        # The full-text index follows the deletes
+        self.assertEqual(search.search("answer")[0], [])
+
+        with override_settings(ARCHIVE_DIR=self.directory.name):
+            messages = retention.load(self.old.pk)
+        self.assertEqual([message["content"] for message in messages], ["old answer 0", "old answer 1", "old answer 2"])
+        entry = ArchivedTranscript.objects.get(session=self.old)
+        self.assertTrue(entry.path.endswith(".jsonl.gz"))
+        # Archive files are plain concatenated gzip JSON lines
+        with gzip.open(os.path.join(self.directory.name, entry.path), "rt") as file:
+            self.assertEqual(json.loads(file.readline())["session"], str(self.old.pk))
+
+        # Nothing left to do on the next run, and --show reads the archive
+        self.assertIn("archived       0 sessions", self.retention("--no-compact"))
+        self.assertIn("gave up 2", self.retention("--show", str(self.abandoned.pk)))
@@ -0,0 +1,159 @@
+import re
+from collections import defaultdict
+
+# Local fast path for steps where a regex or a word list can settle the input.
+# A validator gets the raw user input and the consumer state and returns the
+# same dict the LLM would have returned for that step, or None when the input
+# is ambiguous and has to go to the LLM. Steps pick their validator in steps.py.
+
+# Per step counters: "hit" means answered locally, "miss" means sent to the LLM
+counters = defaultdict(lambda: {"hit": 0, "miss": 0})
+
+YES = {"yes", "y", "yeah", "yep", "yup", "sure", "ok", "okay", "definitely", "of course", "i do", "absolutely", "sure thing"}
+NO = {"no", "n", "nope", "nah", "not now", "skip", "no thanks", "no thank you", "later", "i don't", "i dont", "none"}
+
+VEHICLE_USES = {"commuting": "commuting", "commute": "commuting", "commercial": "commercial",
+                "farming": "farming", "farm": "farming", "business": "business"}
+LICENSE_TYPES = {"foreign", "personal", "commercial"}
+LICENSE_STATUSES = {"valid": "valid", "active": "valid", "good standing": "valid", "in good standing": "valid",
+                    "suspended": "suspended"}
+
+NUMBER = re.compile(r"^\d{1,3}(,\d{3})+(\.\d+)?$|^\d+(\.\d+)?$")
+EMAIL = re.compile(r"^[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}$")
+
+VIN_VALUES = dict(zip("ABCDEFGHJKLMNPRSTUVWXYZ", [1, 2, 3, 4, 5, 6, 7, 8, 1, 2, 3, 4, 5, 7, 9, 2, 3, 4, 5, 6, 7, 8, 9]))
+VIN_VALUES.update({str(digit): digit for digit in range(10)})
+VIN_WEIGHTS = [8, 7, 6, 5, 4, 3, 2, 10, 0, 9, 8, 7, 6, 5, 4, 3, 2]
+
+
+def stats():
+    return {step: dict(counts) for step, counts in counters.items()}
+
+
+def normalise(text):
+    return " ".join(text.lower().strip().strip(".!").split())
+
+
+def parse_number(text):
+    text = text.strip()
+    if not NUMBER.match(text):
+        return None
+    number = float(text.replace(",", ""))
+    return int(number) if number.is_integer() else number
+
+
+# Lenient version for values the LLM returned, e.g. 12, "12" or "about 12 miles"
+def to_number(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    match = re.search(r"\d[\d,]*(\.\d+)?", str(value))
+    return parse_number(match.group()) if match else None
+
+
+# Standard North American VIN check digit (position 9)
+def vin_check_digit_ok(vin):
+    if len(vin) != 17 or any(char not in VIN_VALUES for char in vin):
+        return False
+    total = sum(VIN_VALUES[char] * weight for char, weight in zip(vin, VIN_WEIGHTS))
+    remainder = total % 11
+    return vin[8] == ("X" if remainder == 10 else str(remainder))
+
+
+def validate_zip(text, state):
+    text = text.strip()
+    if not text.isdigit():
+        return None
+    if len(text) == 5:
+        return {"message": "Perfect! What's your full name?", "valid": True, "zip": text}
+    return {"message": f"That's {len(text)} digits. Please enter a 5-digit ZIP code.", "valid": False}
+
+
+def validate_email(text, state):
+    text = text.strip()
+    if not EMAIL.match(text):
+        return None
+    return {"message": "Great! Now let's add your vehicle information. Do you want to add a vehicle?",
+            "valid": True, "email": text}
+
+
+def validate_add_vehicle(text, state):
+    answer = normalise(text)
+    if answer in YES:
+        return {"message": "Great! Please provide your vehicle's VIN or the Year, Make, Model, and Body Type.",
+                "valid": True, "add_vehicle": True}
+    if answer in NO:
+        return {"message": "No problem! Now I need to know your US License Type. Is it Foreign, Personal, or Commercial?",
+                "valid": True, "no_vehicle": True}
+    return None
+
+
+def validate_vin(text, state):
+    vin = text.strip().upper()
+    if not vin_check_digit_ok(vin):
+        return None
+    return {"message": "Got it! How is this vehicle primarily used? (commuting, commercial, farming, or business)",
+            "valid": True, "vin": vin}
+
+
+def validate_vehicle_use(text, state):
+    use = VEHICLE_USES.get(normalise(text))
+    if use is None:
+        return None
+    return {"message": f"Got it, {use} use. Does this vehicle have blind spot warning equipped? (yes or no)",
+            "valid": True, "use": use}
+
+
+def validate_blind_spot(text, state):
+    answer = normalise(text)
+    if state["current_vehicle"].get("use", "") == "commuting":
+        next_question = "How many days per week do you use this vehicle for commuting?"
+    else:
+        next_question = "What's the annual mileage for this vehicle?"
+
+    if answer in YES:
+        return {"message": f"Great to hear that your vehicle has blind spot warning. {next_question}",
+                "valid": True, "blind_spot": "yes"}
+    if answer in NO:
+        return {"message": f"Noted, no blind spot warning. {next_question}", "valid": True, "blind_spot": "no"}
+    return None
+
+
+def validate_commute_days(text, state):
+    days = parse_number(text)
+    if days is None:
+        return None
+    if isinstance(days, int) and 1 <= days <= 7:
+        return {"message": "And how many miles is your one-way commute to work or school?", "valid": True, "days": days}
+    return {"message": "Please enter a whole number of days between 1 and 7.", "valid": False}
+
+
+def validate_commute_miles(text, state):
+    miles = parse_number(text)
+    if miles is None:
+        return None
+    return {"message": "Great! Would you like to add another vehicle?", "valid": True, "miles": miles}
+
+
+def validate_annual_mileage(text, state):
+    mileage = parse_number(text)
+    if mileage is None:
+        return None
+    return {"message": "Noted! Would you like to add another vehicle?", "valid": True, "mileage": mileage}
+
+
+def validate_license_type(text, state):
+    license_type = normalise(text)
+    if license_type not in LICENSE_TYPES:
+        return None
+    if license_type == "foreign":
+        message = "Thank you! I've collected all your information."
+    else:
+        message = f"Thank you. Is your {license_type} license currently valid or suspended?"
+    return {"message": message, "valid": True, "license_type": license_type}
+
+
+def validate_license_status(text, state):
+    status = LICENSE_STATUSES.get(normalise(text))
+    if status is None:
+        return None
+    return {"message": "Perfect! I've collected all your information.", "valid": True, "license_status": status}
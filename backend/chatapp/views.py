@@ -0,0 +1,70 @@
+import datetime
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from . import export, funnel, metrics, search
+
+
+# Prometheus scrape target for this worker
+@require_GET
+def metrics_view(request):
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def page_number(value, default):
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError):
+        return default
+
+
+# Ranked transcript search for staff, /search?q=...&page=2&per_page=20&role=user
+@require_GET
+def search_view(request):
+    if not request.user.is_staff:
+        return JsonResponse({"error": "forbidden"}, status=403)
+    query = request.GET.get("q", "").strip()
+    if not query:
+        return JsonResponse({"error": "missing q"}, status=400)
+    page = page_number(request.GET.get("page"), 1)
+    per_page = page_number(request.GET.get("per_page"), 20)
+    hits, has_next = search.search(query, page=page, per_page=per_page, role=request.GET.get("role") or None)
+    return JsonResponse({
+        "query": query,
+        "page": page,
+        "results": hits,
+        "next_page": page + 1 if has_next else None,
+    })
+
+
+# Funnel per step from the rollup for staff, /funnel?days=7 or ?start=2025-01-01&end=2025-01-31
+@require_GET
+def funnel_view(request):
+    if not request.user.is_staff:
+        return JsonResponse({"error": "forbidden"}, status=403)
+    start, end = funnel.last_days(page_number(request.GET.get("days"), 7))
+    try:
+        if request.GET.get("start"):
+            start = datetime.date.fromisoformat(request.GET["start"])
+        if request.GET.get("end"):
+            end = datetime.date.fromisoformat(request.GET["end"])
+    except ValueError:
+        return JsonResponse({"error": "dates are YYYY-MM-DD"}, status=400)
+    return JsonResponse({"start": str(start), "end": str(end), "steps": funnel.report(start, end)})
+
+
+# Completed sessions for staff as a download, /export?format=csv&since=<X-Export-Watermark of the last run>&messages=1
+@require_GET
+def export_view(request):
+    if not request.user.is_staff:
+        return JsonResponse({"error": "forbidden"}, status=403)
+    format = request.GET.get("format", "jsonl")
+    until = export.watermark()
+    try:
+        since = export.parse_since(request.GET["since"]) if request.GET.get("since") else None
+        pieces = export.stream(format, since=since, until=until, messages=request.GET.get("messages") == "1")
+    except export.ExportError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    response = StreamingHttpResponse(export.astream(pieces), content_type=export.CONTENT_TYPES[format])
+    response["Content-Disposition"] = f'attachment; filename="sessions.{format}"'
+    response["X-Export-Watermark"] = until.isoformat()
+    return response
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from .models import ChatMessage, LLMUsage, StepEvent, Vehicle
+from . import funnel
+
+logger = logging.getLogger(__name__)
+# Process wide numbers for metrics
+stats = {"commits": 0, "rows": 0}
+
+
+# Per connection write buffer. Transcript rows, token usage, vehicles and step
+# events are collected in memory and written together with the changed ChatSession
+# columns in a single transaction. The consumer flushes when a step completes
+# and on disconnect, anything else is flushed after DB_FLUSH_INTERVAL seconds.
+# A batch whose write fails is put back in front of the pending rows.
+class WriteBuffer:
+    def __init__(self, session, interval=None):
+        self.session = session
+        self.interval = settings.DB_FLUSH_INTERVAL if interval is None else interval
+        self.messages = []
+        self.usage = []
+        self.vehicles = []
+        self.events = []
+        self.session_fields = set()
+        self.timer = None
+        self.lock = asyncio.Lock()
+
+    def add_message(self, role, content):
+        self.messages.append(ChatMessage(session=self.session, role=role, content=content))
+        self.schedule()
+
+    def add_usage(self, step, model, usage):
+        self.usage.append(LLMUsage(session=self.session, step=step, model=model, **usage))
+        self.schedule()
+
+    def add_vehicle(self, **fields):
+        self.vehicles.append(Vehicle(session=self.session, **fields))
+        self.schedule()
+
+    def add_event(self, **fields):
+        self.events.append(StepEvent(session=self.session, **fields))
+        self.schedule()
+
+    # Only columns whose value actually changed are written
+    def update_session(self, **fields):
+        for name, value in fields.items():
+            if getattr(self.session, name) != value:
+                setattr(self.session, name, value)
+                self.session_fields.add(name)
+        if self.session_fields:
+            self.schedule()
+
+    def pending(self):
+        return bool(self.messages or self.usage or self.vehicles or self.events or self.session_fields)
+
+    def schedule(self):
+        if self.timer is None and self.interval > 0:
+            loop = asyncio.get_running_loop()
+            self.timer = loop.call_later(self.interval, lambda: asyncio.ensure_future(self.flush_later()))
+
+    # Nobody awaits the timer's flush, so its errors are logged here and the batch retried later
+    async def flush_later(self):
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Timed flush failed for session %s, retrying", self.session.id)
+            self.schedule()
+
+    async def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending():
+            return
+
+        # Take the pending rows now so anything added while we write goes in the next batch
+        batch = (self.messages, self.usage, self.vehicles, self.events, self.session_fields)
+        self.messages, self.usage, self.vehicles, self.events, self.session_fields = [], [], [], [], set()
+        async with self.lock:
+            try:
+                await database_sync_to_async(self.write)(*batch)
+            except Exception:
+                self.restore(*batch)
+                raise
+
+    def restore(self, messages, usage, vehicles, events, session_fields):
+        self.messages = messages + self.messages
+        self.usage = usage + self.usage
+        self.vehicles = vehicles + self.vehicles
+        self.events = events + self.events
+        self.session_fields |= session_fields
+
+    def write(self, messages, usage, vehicles, events, session_fields):
+        with transaction.atomic():
+            if session_fields:
+                self.session.save(update_fields=sorted(session_fields))
+            if messages:
+                ChatMessage.objects.bulk_create(messages)
+            if usage:
+                LLMUsage.objects.bulk_create(usage)
+            if vehicles:
+                Vehicle.objects.bulk_create(vehicles)
+            if events:
+                StepEvent.objects.bulk_create(events)
+                funnel.record(events)
+        stats["commits"] += 1
+        stats["rows"] += len(messages) + len(usage) + len(vehicles) + len(events) + bool(session_fields)
@@ -0,0 +1,80 @@
+import asyncio
+import base64
+import json
+import os
+import struct
+from urllib.parse import urlsplit
+
+# Bare bones asyncio WebSocket client for the load tests, so driving real
+# Daphne workers does not need an extra dependency. Text frames only.
+class WebSocketClient:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, url):
+        parts = urlsplit(url)
+        reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write((
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {parts.hostname}:{parts.port or 80}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n"
+            f"Origin: http://{parts.hostname}\r\n"
+            "\r\n"
+        ).encode())
+        await writer.drain()
+
+        status = await reader.readline()
+        if b" 101 " not in status:
+            writer.close()
+            raise ConnectionError(f"WebSocket handshake failed: {status.decode().strip()}")
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        return cls(reader, writer)
+
+    async def send_json(self, data):
+        payload = json.dumps(data).encode()
+        header = bytearray([0x81])
+        if len(payload) < 126:
+            header.append(0x80 | len(payload))
+        elif len(payload) < 65536:
+            header.append(0x80 | 126)
+            header += struct.pack("!H", len(payload))
+        else:
+            header.append(0x80 | 127)
+            header += struct.pack("!Q", len(payload))
+        # Client frames must be masked
+        mask = os.urandom(4)
+        header += mask
+        self.writer.write(bytes(header) + bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload)))
+        await self.writer.drain()
+
+    async def receive_json(self):
+        while True:
+            first, second = await self.reader.readexactly(2)
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", await self.reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", await self.reader.readexactly(8))[0]
+            payload = await self.reader.readexactly(length)
+            opcode = first & 0x0F
+            if opcode == 0x1:
+                return json.loads(payload)
+            if opcode == 0x8:
+                raise ConnectionError("WebSocket closed by server")
+            # Pings, pongs and anything else are ignored
+
+    async def close(self):
+        try:
+            self.writer.write(bytes([0x88, 0x80]) + os.urandom(4))
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        self.writer.close()
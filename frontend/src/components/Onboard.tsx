@@ -3,7 +3,9 @@ import styles from './Onboard.module.css'
 
 // Create socket to connect with the chat server to simplify frontend logic
 // Replace 127.0.0.1:8000/ with whatever it says from django
-const socket = new WebSocket("ws://127.0.0.1:8000/ws/chat/")
+// If a previous onboarding was cut off we pass its session id so the server resumes it
+const savedSession = localStorage.getItem("onboardSession")
+const socket = new WebSocket("ws://127.0.0.1:8000/ws/chat/" + (savedSession ? `?session=${savedSession}` : ""))
 
 /**
  * This is the page that gets loaded into when the user clicks the Start Button.
@@ -13,7 +15,8 @@ const Onboard = () => {
 
   // Stores all the Messages between the User and the chatBot
   // Initalized with a welcome message
-    const [allMessages, setAllMsg] = useState<{text: string, isUser: boolean}[]>([
+    // streaming marks a bot message that is still being typed out by the server
+    const [allMessages, setAllMsg] = useState<{text: string, isUser: boolean, streaming?: boolean}[]>([
         {text: "Hi! I'm going to be helping you get onboarded today. Let's start off with your ZipCode", isUser: false}
     ])
 
@@ -35,13 +38,51 @@ const Onboard = () => {
     useEffect(() => {
         socket.onmessage = (event) => {
             const data = JSON.parse(event.data)
-            
+
+            // Remember the session so a reload or dropped connection can resume it
+            if (data.session) {
+                localStorage.setItem("onboardSession", data.session)
+            }
+
+            // Resumed session, ask the question of the step we stopped at instead of the ZipCode
+            if (data.question) {
+                setAllMsg([{text: `Welcome back! Let's pick up where we left off. ${data.question}`, isUser: false}])
+            }
+
+            // Partial reply while the bot is still generating, grow the last bot bubble
+            if (data.delta !== undefined) {
+                setAllMsg(prev => {
+                    const last = prev[prev.length - 1]
+                    if (last && last.streaming) {
+                        return [...prev.slice(0, -1), {...last, text: last.text + data.delta}]
+                    }
+                    return [...prev, {text: data.delta, isUser: false, streaming: true}]
+                })
+                return
+            }
+
+            // Busy or refused message, show it but keep any reply that is still streaming last
+            if (data.busy || data.error) {
+                setAllMsg(prev => {
+                    const last = prev[prev.length - 1]
+                    const notice = {text: data.message, isUser: false}
+                    return last && last.streaming ? [...prev.slice(0, -1), notice, last] : [...prev, notice]
+                })
+                return
+            }
+
             // Check if the message indicates completion which is hardcoded to be Information collected:
             if (data.message.includes("Information collected:")) {
                 setIsComplete(true)
+                localStorage.removeItem("onboardSession")
             }
             
-            setAllMsg(prev => [...prev, {text: data.message, isUser: false}])
+            // The final message replaces the streamed text since it can differ (e.g. the summary)
+            setAllMsg(prev => {
+                const last = prev[prev.length - 1]
+                const rest = last && last.streaming ? prev.slice(0, -1) : prev
+                return [...rest, {text: data.message, isUser: false}]
+            })
         }
     }, [])
     
@@ -52,7 +93,7 @@ const Onboard = () => {
         if (!input.trim() || isComplete) return 
 
         setAllMsg(prev => [...prev, {text: input, isUser: true}])
-        socket.send(JSON.stringify({ message: input }))
+        socket.send(JSON.stringify({ message: input, stream: true }))
         setInput("")
     }
       